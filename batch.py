@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+"""
+creates torrents for many roots in one go. the roots come from a
+manifest file or are the entries of a directory. all the jobs hash on
+one shared pool of workers, w/ only so many jobs running at once.
+"""
+
+import os
+import os.path
+import time
+import logging
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from bencode import bencode_to
+from make_torrent import MetaCreator
+
+log = logging.getLogger(__name__)
+
+# how many jobs we run at once by default
+MAX_JOBS = 2
+
+
+def read_manifest(path):
+    """ returns the (root, outfile) jobs listed in the manifest, one
+        per line, the root optionally followed by a tab and where to
+        save it's torrent. blank lines and #comments are skipped """
+    jobs = []
+    with file(path,'r') as fh:
+        for line in fh:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            root, _, outfile = line.partition('\t')
+            jobs.append((root, outfile or None))
+    return jobs
+
+
+def find_roots(path):
+    """ returns the (root, None) jobs for each entry of the directory.
+        torrents (likely saved there by the last run) aren't roots """
+    return [(os.path.join(path,name), None)
+            for name in sorted(os.listdir(path))
+            if not name.startswith('.')
+            and not name.lower().endswith('.torrent')]
+
+
+class JobResult(object):
+    """ how a job went """
+    def __init__(self,root,outfile):
+        self.root = root
+        self.outfile = outfile
+        self.info_hash = None
+        self.total_size = 0
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def throughput(self):
+        """ MB/s hashed """
+        if not self.seconds:
+            return 0.0
+        return self.total_size / self.seconds / (1024 * 1024)
+
+
+class BatchCreator(object):
+    """
+    runs torrent creation jobs, at most max_jobs at a time, all of
+    them hashing on the one pool of workers. each job runner keeps a
+    MetaCreator which it reuses for every job it runs (the sqlite
+    digest cache can't be shared between threads). meta_fields are
+    the outer fields (announce, comment ...) put in every torrent,
+    creator_options are passed on to the MetaCreators.
+    """
+    def __init__(self,out_dir=None,workers=None,max_jobs=MAX_JOBS,
+                      meta_fields=None,**creator_options):
+        self.out_dir = out_dir
+        self.workers = workers or cpu_count()
+        self.max_jobs = max_jobs
+        self.meta_fields = meta_fields or {}
+        self.creator_options = creator_options
+        self.local = threading.local()
+
+    def get_creator(self,pool):
+        creator = getattr(self.local,'creator',None)
+        if creator is None:
+            creator = MetaCreator(pool=pool,**self.creator_options)
+            self.local.creator = creator
+        return creator
+
+    def outfile_for(self,root):
+        name = os.path.basename(root.rstrip(os.sep)) + '.torrent'
+        return os.path.join(self.out_dir or os.path.dirname(root),name)
+
+    def create(self,pool,job):
+        """ creates and saves the torrent of one job """
+        root, outfile = job
+        result = JobResult(root,outfile or self.outfile_for(root))
+        start = time.time()
+        try:
+            creator = self.get_creator(pool)
+            creator.create_info_data([root])
+            result.total_size = creator.total_size
+            meta_data = creator.create_meta_data(**self.meta_fields)
+            if creator.encoding:
+                meta_data['encoding'] = creator.encoding
+            with file(result.outfile,'wb') as fh:
+                bencode_to(fh,meta_data)
+            result.info_hash = creator.info_hash or creator.info_hash_v2
+        except Exception, ex:
+            log.exception('failed creating torrent for %s',root)
+            result.error = ex
+        result.seconds = time.time() - start
+        log.info('%s: %s bytes in %.2fs, %.1f MB/s',root,
+                 result.total_size,result.seconds,result.throughput)
+        return result
+
+    def run(self,jobs):
+        """ runs the (root, outfile) jobs, yielding their JobResults
+            as they finish (not in the jobs' order) """
+        pool = ThreadPool(self.workers)
+        runners = ThreadPool(self.max_jobs)
+        try:
+            create = lambda job: self.create(pool,job)
+            for result in runners.imap_unordered(create,jobs):
+                yield result
+        finally:
+            runners.close()
+            runners.join()
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    """
+    we need to take in the following params:
+     source - a manifest file listing the roots, or a directory
+              whose entries are each a root
+     outdir - where to save the torrents, defaults to next to
+              each root
+    """
+
+    import sys
+    from cmdline_utils import EnhancedOptionParser
+    usage = "usage: %prog [options] manifest|directory"
+    parser = EnhancedOptionParser(usage=usage)
+
+    # output dir
+    parser.add_option("-o", "--outdir",
+                      dest="out_dir",
+                      type="abspath",
+                      help="where to save the torrents")
+
+    # hashing workers
+    parser.add_option("-w", "--workers",
+                      dest="workers",
+                      type="int",
+                      help="number of workers to hash pieces with, "
+                           "shared by all the jobs")
+
+    # concurrent jobs
+    parser.add_option("-j", "--jobs",
+                      dest="max_jobs",
+                      type="int",
+                      default=MAX_JOBS,
+                      help="how many torrents to create at once")
+
+    # announce
+    parser.add_option("-a", "--announce",
+                      dest="announce",
+                      action="store",
+                      help="tracker url")
+
+    # comment
+    parser.add_option("-c","--comment",
+                      dest="comment",
+                      help="comment")
+
+    # read mode
+    parser.add_option("--mmap",
+                      action="store_const",
+                      const="mmap",
+                      dest="read_mode",
+                      default="buffered",
+                      help="hash from memory mapped files")
+
+    # padding
+    parser.add_option("--pad",
+                      action="store_true",
+                      dest="pad_files",
+                      default=False,
+                      help="pad files out to piece boundaries (BEP 47)")
+
+    # torrent version
+    parser.add_option("--v2",
+                      action="store_const",
+                      const="v2",
+                      dest="version",
+                      default="v1",
+                      help="create v2 (BEP 52) only torrents")
+
+    parser.add_option("--hybrid",
+                      action="store_const",
+                      const="hybrid",
+                      dest="version",
+                      help="create hybrid v1 + v2 torrents")
+
+    # digest cache
+    parser.add_option("--cache",
+                      action="store",
+                      dest="cache",
+                      type="abspath",
+                      help="file to cache piece digests in between runs")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no manifest or directory given')
+
+    source = args[0]
+    if os.path.isdir(source):
+        jobs = find_roots(source)
+    else:
+        jobs = read_manifest(source)
+
+    meta_fields = {'announce': options.get('announce'),
+                   'comment': options.get('comment')}
+    batch = BatchCreator(out_dir=options.get('out_dir'),
+                         workers=options.get('workers'),
+                         max_jobs=options.get('max_jobs'),
+                         meta_fields=meta_fields,
+                         read_mode=options.get('read_mode'),
+                         pad_files=options.get('pad_files'),
+                         version=options.get('version'),
+                         cache=options.get('cache'))
+
+    failed = 0
+    total_size, start = 0, time.time()
+    for result in batch.run(jobs):
+        if result.error:
+            failed += 1
+            print 'FAILED %s: %s' % (result.root, result.error)
+            continue
+        total_size += result.total_size
+        print '%s %s %d bytes %.2fs %.1f MB/s' % (
+            result.info_hash, result.outfile, result.total_size,
+            result.seconds, result.throughput)
+
+    seconds = time.time() - start
+    print '%s jobs, %s failed, %.1f MB/s overall' % (
+        len(jobs), failed,
+        total_size / (seconds or 1) / (1024 * 1024))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,400 @@
+#!/usr/bin/python
+
+"""
+benchmarks for the hot paths of making a torrent.
+
+read modes: hashes a (multi GB by default) file w/ each of the
+hasher's read modes, reporting the time taken and how much data
+had to be copied out of the file into new strings along the way.
+
+bdecode: reads the name, infohash and total length out of a big
+generated (or given) .torrent w/ the eager decode_func table and
+w/ the lazy decoder.
+
+suite: generates trees of synthetic data (one huge file, lots of tiny
+files, and a mix of the two) and times finding the files, sizing them,
+hashing them across piece sizes and worker counts, md5ing them and
+bencoding / bdecoding the resulting meta data. each result is written
+as a line of JSON tagged w/ the revision, so runs of different
+revisions can be compared.
+"""
+
+import os
+import os.path
+import time
+import sys
+import json
+import platform
+import resource
+import subprocess
+from multiprocessing import Pool
+from hashlib import sha1
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from piece_hasher import StraitPieceHasher, ParallelPieceHasher, READ_MODES
+from bencode import bencode, bdecode, bdecode_lazy
+from helpers import find_files, determine_file_sizes, md5sum
+
+TREES = ('huge', 'tiny', 'mixed')
+
+MB = 1024 * 1024
+
+
+def make_file(path,size):
+    """ writes size bytes of junk data to path """
+    chunk = os.urandom(MB)
+    with file(path,'wb') as fh:
+        written = 0L
+        while written < size:
+            data = chunk[:size-written]
+            fh.write(data)
+            written += len(data)
+    return path
+
+
+def max_rss():
+    """ peak resident memory of this process, in KB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_read_mode(path,piece_size,read_mode,repeat=3):
+    """ returns the result dict for hashing path w/ the read mode """
+    size = os.path.getsize(path)
+    best, hasher = None, None
+    for i in xrange(repeat):
+        # a new hasher each run, so no pieces are reused from the last
+        hasher = StraitPieceHasher([path],read_mode)
+        start = time.time()
+        hasher.digest(piece_size)
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return {
+        'read_mode': read_mode,
+        'size': size,
+        'piece_size': piece_size,
+        'seconds': best,
+        'mb_per_sec': size / float(MB) / best if best else None,
+        'reads': hasher.stats.reads,
+        'bytes_copied': hasher.stats.bytes_copied,
+        'max_rss_kb': max_rss(),
+    }
+
+
+def bench_read_modes(path,piece_size,repeat=3):
+    """ returns a result dict per read mode for hashing path. each
+        mode is run in it's own process, so one mode's peak memory
+        isn't counted in the next's """
+    results = []
+    for read_mode in READ_MODES:
+        pool = Pool(1)
+        try:
+            results.append(pool.apply(bench_read_mode,
+                                      (path,piece_size,read_mode,repeat)))
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+def make_torrent_data(file_count,piece_count):
+    """ returns the bencoded meta data of a made up torrent """
+    files = [{'length': 1000 + i, 'path': ['dir%d' % (i % 100),
+                                           'file%d' % i]}
+             for i in xrange(file_count)]
+    info = {
+        'name': 'bench',
+        'piece length': 2 ** 18,
+        'pieces': os.urandom(20) * piece_count,
+        'files': files,
+    }
+    return bencode({'announce': 'http://localhost/announce', 'info': info})
+
+
+def bench_bdecode(data,repeat=3):
+    """ returns a result dict per decoder for pulling the name,
+        infohash and total length out of the bencoded data """
+    def eager():
+        meta_data = bdecode(data)
+        info = meta_data['info']
+        infohash = sha1(bencode(info)).digest()
+        return info['name'], infohash
+
+    def lazy():
+        meta_data = bdecode_lazy(data)
+        infohash = sha1(meta_data.raw_item('info')).digest()
+        return meta_data['info']['name'], infohash
+
+    def eager_length():
+        return sum((f['length'] for f in bdecode(data)['info']['files']))
+
+    def lazy_length():
+        files = bdecode_lazy(data)['info']['files']
+        return sum((f['length'] for f in files))
+
+    results = []
+    for name, func in (('eager', eager), ('lazy', lazy),
+                       ('eager length', eager_length),
+                       ('lazy length', lazy_length)):
+        best = None
+        for i in xrange(repeat):
+            start = time.time()
+            func()
+            took = time.time() - start
+            if best is None or took < best:
+                best = took
+        results.append({
+            'decoder': name,
+            'size': len(data),
+            'seconds': best,
+        })
+    return results
+
+
+def make_tree(root,kind,size,tiny_count=10000,tiny_size=4096):
+    """
+    fills root w/ a synthetic tree. huge is a single file of size
+    bytes, tiny is tiny_count files of tiny_size bytes spread over
+    dirs of 100, mixed is half the size in a few big files and half
+    the tiny files. returns root.
+    """
+    def tiny_files(count):
+        data = os.urandom(tiny_size)
+        for i in xrange(count):
+            dir_path = os.path.join(root,'tiny','d%d' % (i // 100))
+            if i % 100 == 0:
+                os.makedirs(dir_path)
+            with file(os.path.join(dir_path,'f%d' % i),'wb') as fh:
+                fh.write(data)
+
+    os.makedirs(root)
+    if kind == 'huge':
+        make_file(os.path.join(root,'huge'),size)
+    elif kind == 'tiny':
+        tiny_files(tiny_count)
+    elif kind == 'mixed':
+        os.makedirs(os.path.join(root,'big'))
+        for i in xrange(4):
+            make_file(os.path.join(root,'big','b%d' % i),size // 8)
+        tiny_files(tiny_count // 2)
+    else:
+        raise Exception('Unknown tree: %s' % kind)
+    return root
+
+
+def best_time(func,repeat=3):
+    """ runs func repeat times, returns the best time and the last
+        thing func returned """
+    best, result = None, None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return best, result
+
+
+def revision():
+    """ the git revision we're benchmarking, if we can tell """
+    try:
+        return subprocess.check_output(
+            ['git','rev-parse','--short','HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull,'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_tree(root,piece_sizes,worker_counts,repeat=3):
+    """
+    returns a result dict per measurement of the tree under root.
+    workers 1 hashes w/ the strait hasher, more w/ the parallel one.
+    """
+    results = []
+
+    def add(bench,seconds,size,**extra):
+        result = {'bench': bench, 'seconds': seconds, 'size': size,
+                  'mb_per_sec': size / float(MB) / seconds
+                                if seconds and size else None}
+        result.update(extra)
+        results.append(result)
+
+    seconds, file_paths = best_time(lambda: find_files(root),repeat)
+    add('find_files',seconds,None,file_count=len(file_paths))
+
+    seconds, file_sizes = best_time(
+        lambda: determine_file_sizes(file_paths),repeat)
+    total_size = sum(file_sizes.itervalues())
+    add('determine_file_sizes',seconds,None,file_count=len(file_paths))
+
+    pieces = None
+    for piece_size in piece_sizes:
+        for workers in worker_counts:
+            # a new hasher each run, so nothing is reused from the last
+            def digest():
+                if workers == 1:
+                    hasher = StraitPieceHasher(file_paths)
+                else:
+                    hasher = ParallelPieceHasher(file_paths,workers)
+                return hasher.digest(piece_size)
+            seconds, pieces = best_time(digest,repeat)
+            add('digest',seconds,total_size,piece_size=piece_size,
+                workers=workers,piece_count=len(pieces) // 20)
+
+    seconds, md5sums = best_time(
+        lambda: [md5sum(path) for path in file_paths],repeat)
+    add('md5sum',seconds,total_size,file_count=len(file_paths))
+
+    # meta data shaped like what we'd write for the tree
+    files = [{'length': file_sizes[path],
+              'path': os.path.relpath(path,root).split(os.sep)}
+             for path in file_paths]
+    meta_data = {'announce': 'http://localhost/announce',
+                 'info': {'name': os.path.basename(root),
+                          'piece length': piece_sizes[-1],
+                          'pieces': pieces,
+                          'files': files}}
+
+    seconds, data = best_time(lambda: bencode(meta_data),repeat)
+    add('bencode',seconds,len(data),file_count=len(files))
+
+    seconds, decoded = best_time(lambda: bdecode(data),repeat)
+    add('bdecode',seconds,len(data),file_count=len(files))
+
+    return results
+
+
+def run_suite(options):
+    piece_sizes = [int(s) * 1024 for s in options.piece_sizes.split(',')]
+    worker_counts = [int(w) for w in options.workers.split(',')]
+    trees = TREES if options.tree == 'all' else [options.tree]
+    out = file(options.out,'a') if options.out else sys.stdout
+
+    # what every result is tagged w/
+    run = {'revision': revision(),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'time': time.time()}
+
+    try:
+        for kind in trees:
+            tmp_dir = mkdtemp()
+            try:
+                root = make_tree(os.path.join(tmp_dir,kind),kind,
+                                 options.tree_size * MB,options.tiny_count)
+                for result in bench_tree(root,piece_sizes,worker_counts,
+                                         options.repeat):
+                    result.update(run)
+                    result['tree'] = kind
+                    out.write(json.dumps(result,sort_keys=True) + '\n')
+                    out.flush()
+            finally:
+                rmtree(tmp_dir)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def run_read_modes(options):
+    tmp_dir = None
+    path = options.path
+    if not path:
+        tmp_dir = mkdtemp()
+        path = make_file(os.path.join(tmp_dir,'data'),options.size * MB)
+
+    try:
+        for result in bench_read_modes(path,options.piece_size,
+                                       options.repeat):
+            print ('%(read_mode)8s: %(seconds).2fs %(mb_per_sec).1fMB/s '
+                   'reads: %(reads)d copied: %(bytes_copied)d bytes '
+                   'max rss: %(max_rss_kb)dKB') % result
+    finally:
+        if tmp_dir:
+            rmtree(tmp_dir)
+
+
+def run_bdecode(options):
+    if options.path:
+        with file(options.path,'rb') as fh:
+            data = fh.read()
+    else:
+        data = make_torrent_data(options.file_count,options.piece_count)
+
+    for result in bench_bdecode(data,options.repeat):
+        print '%(decoder)14s: %(seconds).4fs (%(size)d bytes)' % result
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-b", "--bench",
+                      dest="bench",
+                      type="choice",
+                      choices=["read", "bdecode", "suite"],
+                      default="read",
+                      help="what to benchmark: read, bdecode or suite")
+    parser.add_option("-s", "--size",
+                      dest="size",
+                      type="int",
+                      default=2048,
+                      help="size of the generated file in MB")
+    parser.add_option("-p", "--piece-size",
+                      dest="piece_size",
+                      type="int",
+                      default=2 ** 18,
+                      help="piece size to hash w/")
+    parser.add_option("-r", "--repeat",
+                      dest="repeat",
+                      type="int",
+                      default=3,
+                      help="runs per mode, best is kept")
+    parser.add_option("-f", "--file",
+                      dest="path",
+                      help="use an existing file / .torrent instead")
+    parser.add_option("--file-count",
+                      dest="file_count",
+                      type="int",
+                      default=100000,
+                      help="files in the generated torrent")
+    parser.add_option("--piece-count",
+                      dest="piece_count",
+                      type="int",
+                      default=500000,
+                      help="pieces in the generated torrent")
+    parser.add_option("-t", "--tree",
+                      dest="tree",
+                      type="choice",
+                      choices=list(TREES) + ["all"],
+                      default="all",
+                      help="suite tree: huge, tiny, mixed or all")
+    parser.add_option("--tree-size",
+                      dest="tree_size",
+                      type="int",
+                      default=256,
+                      help="size of the huge / mixed trees in MB")
+    parser.add_option("--tiny-count",
+                      dest="tiny_count",
+                      type="int",
+                      default=10000,
+                      help="files in the tiny tree, half in the mixed")
+    parser.add_option("--piece-sizes",
+                      dest="piece_sizes",
+                      default="32,256,1024",
+                      help="suite piece sizes in KB, comma separated")
+    parser.add_option("-w", "--workers",
+                      dest="workers",
+                      default="1,4",
+                      help="suite worker counts, comma separated")
+    parser.add_option("-o", "--out",
+                      dest="out",
+                      help="append the suite's JSON lines to this file")
+    (options, args) = parser.parse_args()
+
+    if options.bench == 'bdecode':
+        run_bdecode(options)
+    elif options.bench == 'suite':
+        run_suite(options)
+    else:
+        run_read_modes(options)
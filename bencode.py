@@ -14,7 +14,10 @@ from cStringIO import StringIO
 
 def decode_int(x, f):
     f += 1
-    newf = x.index('e', f)
+    # find rather than index so mmaps can be decoded too
+    newf = x.find('e', f)
+    if newf == -1:
+        raise ValueError
     try:
         n = int(x[f:newf])
     except:
@@ -27,7 +30,9 @@ def decode_int(x, f):
     return (n, newf+1)
   
 def decode_string(x, f):
-    colon = x.index(':', f)
+    colon = x.find(':', f)
+    if colon == -1:
+        raise ValueError
     try:
         n = int(x[f:colon])
     except (OverflowError, ValueError):
@@ -85,6 +90,229 @@ def bdecode(x, sloppy = 0):
         raise ValueError, "bad bencoded data"
     return r
 
+def skip_value(x, f):
+    """ returns where the value starting at f ends, without decoding
+        it. strings are jumped over rather than copied. """
+    find = x.find
+    depth = 0
+    while True:
+        c = x[f]
+        if c == 'i':
+            newf = find('e', f)
+            if newf == -1:
+                raise ValueError
+            f = newf + 1
+        elif c == 'l' or c == 'd':
+            depth += 1
+            f += 1
+            continue
+        elif c == 'e':
+            depth -= 1
+            if depth < 0:
+                raise ValueError
+            f += 1
+        else:
+            colon = find(':', f)
+            if colon == -1 or (c == '0' and colon != f+1):
+                raise ValueError
+            f = colon + 1 + int(x[f:colon])
+            if f > len(x):
+                raise ValueError
+        if depth == 0:
+            return f
+
+# containers smaller than this are decoded eagerly, it's quicker
+LAZY_MIN_SIZE = 1024
+
+def decode_lazy(x, f, end=None):
+    """ like decode_func, but big lists and dicts come back as lazy
+        views. end is where the value ends, if known """
+    c = x[f]
+    if c == 'l' or c == 'd':
+        if end is None or end - f >= LAZY_MIN_SIZE:
+            view_type = LazyList if c == 'l' else LazyDict
+            return view_type(x, f, end)
+    return decode_func[c](x, f)[0]
+
+class LazyView(object):
+    """ a bencoded list / dict in x, starting at x[start]. children
+        are found the first time they're asked for and only decoded
+        when accessed. """
+    def __init__(self, x, start, end=None):
+        self.x = x
+        self.start = start
+        self._end = end
+        self._index = None
+
+    def end(self):
+        """ where the view ends in x """
+        if self._end is None:
+            try:
+                self._end = skip_value(self.x, self.start)
+            except (IndexError, ValueError):
+                raise ValueError, "bad bencoded data"
+        return self._end
+
+    def raw(self):
+        """ the bencoded bytes of the whole view """
+        return self.x[self.start:self.end()]
+
+    def _decode(self, span):
+        try:
+            return decode_lazy(self.x, span[0], span[1])
+        except (IndexError, KeyError, ValueError):
+            raise ValueError, "bad bencoded data"
+
+    def decode(self):
+        """ the whole view, eagerly decoded """
+        return bdecode(self.raw())
+
+class LazyList(LazyView):
+    def index(self):
+        if self._index is None:
+            spans, f = [], self.start + 1
+            try:
+                while self.x[f] != 'e':
+                    end = skip_value(self.x, f)
+                    spans.append((f, end))
+                    f = end
+            except (IndexError, ValueError):
+                raise ValueError, "bad bencoded data"
+            self._index = spans
+        return self._index
+
+    def __len__(self):
+        return len(self.index())
+
+    def __getitem__(self, i):
+        return self._decode(self.index()[i])
+
+    def __iter__(self):
+        for span in self.index():
+            yield self._decode(span)
+
+    def span(self, i):
+        return self.index()[i]
+
+    def raw_item(self, i):
+        start, end = self.index()[i]
+        return self.x[start:end]
+
+class LazyDict(LazyView):
+    """ keys are only scanned as far as the one asked for, so finding
+        a key doesn't mean skipping over the values after it. views of
+        the values are kept, anything they learn about where they end
+        saves us skipping over them again. """
+    def __init__(self, x, start, end=None):
+        LazyView.__init__(self, x, start, end)
+        self._spans = {}
+        self._views = {}
+        self._pos = start + 1
+        self._last = None
+
+    def _scan(self, until=None):
+        """ indexes the keys up to until (all of them w/o it) """
+        x = self.x
+        try:
+            while self._index is None:
+                # we need to get past the last key's value first
+                if self._last is not None:
+                    vstart, vend = self._spans[self._last]
+                    if vend is None:
+                        view = self._views.get(self._last)
+                        vend = view.end() if view else skip_value(x, vstart)
+                        self._spans[self._last] = (vstart, vend)
+                    self._pos = vend
+
+                if x[self._pos] == 'e':
+                    self._index = self._spans
+                    self._end = self._pos + 1
+                    break
+
+                k, f = decode_string(x, self._pos)
+                if self._last >= k:
+                    raise ValueError
+                self._last = k
+                self._spans[k] = (f, None)
+
+                # keys are sorted, once we're @ or past it we can stop
+                if until is not None and k >= until:
+                    break
+        except (IndexError, ValueError):
+            raise ValueError, "bad bencoded data"
+
+    def index(self):
+        self._scan()
+        return self._index
+
+    def end(self):
+        if self._end is None:
+            self._scan()
+        return self._end
+
+    def _span(self, k):
+        if k not in self._spans:
+            self._scan(k)
+        return self._spans.get(k)
+
+    def _value(self, k, span):
+        view = self._views.get(k)
+        if view is None:
+            view = self._decode(span)
+            if isinstance(view, LazyView):
+                self._views[k] = view
+        return view
+
+    def __len__(self):
+        return len(self.index())
+
+    def __contains__(self, k):
+        return self._span(k) is not None
+
+    def __getitem__(self, k):
+        span = self._span(k)
+        if span is None:
+            raise KeyError(k)
+        return self._value(k, span)
+
+    def get(self, k, default=None):
+        span = self._span(k)
+        if span is None:
+            return default
+        return self._value(k, span)
+
+    def keys(self):
+        return sorted(self.index())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def span(self, k):
+        """ where the value of k sits in the data """
+        start, end = self._span(k)
+        if end is None:
+            view = self._views.get(k)
+            end = view.end() if view else skip_value(self.x, start)
+            self._spans[k] = (start, end)
+        return (start, end)
+
+    def raw_item(self, k):
+        """ the bencoded bytes of k's value, ie the 'info' to hash
+            for the infohash """
+        start, end = self.span(k)
+        return self.x[start:end]
+
+def bdecode_lazy(x):
+    """ decodes x (a string or mmap) lazily, lists and dicts come
+        back as views over x which decode their children on access """
+    try:
+        return decode_lazy(x, 0)
+    except (IndexError, KeyError, ValueError):
+        raise ValueError, "bad bencoded data"
+
 def test_bdecode():
     try:
         bdecode('0:0:')
@@ -229,7 +457,14 @@ def test_bdecode():
 
 bencached_marker = []
 
+class Fragments(list):
+    """ the fragments of an encoding, w/ bytearrays (eg a torrent's
+        pieces) kept as they are rather than copied into strings """
+    takes_buffers = True
+
 class Bencached:
+    """ an encoding spliced as is into whatever it's encoded along
+        w/, either a string or Fragments """
     def __init__(self, s):
         self.marker = bencached_marker
         self.bencoded = s
@@ -238,7 +473,15 @@ BencachedType = type(Bencached('')) # insufficient, but good as a filter
 
 def encode_bencached(x,r):
     assert x.marker == bencached_marker
-    r.append(x.bencoded)
+    if type(x.bencoded) is StringType:
+        r.append(x.bencoded)
+    elif getattr(r,'takes_buffers',False):
+        r.extend(x.bencoded)
+    else:
+        r.extend([str(f) for f in x.bencoded])
+
+def encode_lazy(x,r):
+    r.append(x.raw())
 
 def encode_int(x,r):
     r.extend(('i',str(x),'e'))
@@ -249,6 +492,12 @@ def encode_bool(x,r):
 def encode_string(x,r):    
     r.extend((str(len(x)),':',x))
 
+def encode_bytearray(x,r):
+    # a string being built has to have it's own copy, a file / hash
+    # being written to can take the bytearray as is
+    r.extend((str(len(x)),':'))
+    r.append(x if getattr(r,'takes_buffers',False) else str(x))
+
 def encode_unicode(x,r):
     #r.append('u')
     encode_string(x.encode('UTF-8'),r)
@@ -261,21 +510,27 @@ def encode_list(x,r):
 
 def encode_dict(x,r):
     r.append('d')
-    ilist = x.items()
+    # keys are sorted as the raw strings they are encoded to
+    ilist = [(k.encode('UTF-8') if type(k) is UnicodeType else k, v)
+             for k, v in x.iteritems()]
     ilist.sort()
     for k,v in ilist:
         # don't just fail if there are None's
         if None in (k,v):
             continue
+        assert type(k) is StringType, 'dict keys must be strings'
         r.extend((str(len(k)),':',k))
         encode_func[type(v)](v, r)
     r.append('e')
 
 encode_func = {}
 encode_func[BencachedType] = encode_bencached
+encode_func[LazyList] = encode_lazy
+encode_func[LazyDict] = encode_lazy
 encode_func[IntType] = encode_int
 encode_func[LongType] = encode_int
 encode_func[StringType] = encode_string
+encode_func[bytearray] = encode_bytearray
 encode_func[ListType] = encode_list
 encode_func[TupleType] = encode_list
 encode_func[DictType] = encode_dict
@@ -294,6 +549,31 @@ def bencode(x):
         assert 0
     return ''.join(r)
 
+def bencode_fragments(x):
+    """ the encoding of x as Fragments, eg for hashing or writing out
+        w/o joining it all up into one string """
+    r = Fragments()
+    encode_func[type(x)](x, r)
+    return r
+
+class StreamWriter:
+    """ stands in for the fragment list the encoders build, writing
+        the fragments to a file object as they come instead """
+    takes_buffers = True
+
+    def __init__(self, fileobj):
+        self.append = fileobj.write
+
+    def extend(self, fragments):
+        # not writelines, which only takes strings for some files
+        for fragment in fragments:
+            self.append(fragment)
+
+def bencode_to(fileobj, x):
+    """ bencodes x straight to fileobj, without building the whole
+        encoded string in memory first """
+    encode_func[type(x)](x, StreamWriter(fileobj))
+
 def test_bencode():
     assert bencode(4) == 'i4e'
     assert bencode(0) == 'i0e'
@@ -308,12 +588,55 @@ def test_bencode():
     assert bencode({}) == 'de'
     assert bencode({'age': 25, 'eyes': 'blue'}) == 'd3:agei25e4:eyes4:bluee'
     assert bencode({'spam.mp3': {'author': 'Alice', 'length': 100000}}) == 'd8:spam.mp3d6:author5:Alice6:lengthi100000eee'
+    assert bencode({u'\xe9t\xe9': 1, u'b': 2}) == 'd1:bi2e5:\xc3\xa9t\xc3\xa9i1ee'
     try:
         bencode({1: 'foo'})
         assert 0
     except AssertionError:
         pass
 
+def test_bdecode_lazy():
+    x = 'd4:infod5:filesld6:lengthi5eee4:name3:abce3:numi7e1:sl1:ai1eee'
+    d = bdecode_lazy(x)
+    assert d.keys() == ['info', 'num', 's']
+    assert d['num'] == 7
+    assert d.get('nope') is None
+    assert 'info' in d and 'nope' not in d
+    assert d['info']['name'] == 'abc'
+    assert d['info']['files'][0]['length'] == 5
+    assert d.raw_item('info') == 'd5:filesld6:lengthi5eee4:name3:abce'
+    assert len(d['s']) == 2 and list(d['s']) == ['a', 1]
+    assert d.decode() == bdecode(x)
+    assert bencode(d) == x
+    assert bencode({'info': d['info']}) == 'd4:info' + d.raw_item('info') + 'e'
+    assert bdecode_lazy('i4e') == 4
+    for bad in ('d1:b0:1:a0:e', 'd3:fooe', 'l01:ae', 'li1e'):
+        try:
+            v = bdecode_lazy(bad)
+            v.index()
+            assert 0
+        except ValueError:
+            pass
+
+def test_bencode_to():
+    for x in (4, '', 'abc', [['Alice', 'Bob'], [2, 3]], {},
+              {'spam.mp3': {'author': 'Alice', 'length': 100000}},
+              {'info': Bencached('d1:ai1ee'), 'pieces': 'x' * 40},
+              {'pieces': bytearray('x' * 40)},
+              {'info': Bencached(bencode_fragments(
+                  {'pieces': bytearray('y' * 20), 'name': 'a'}))}):
+        s = StringIO()
+        bencode_to(s, x)
+        assert s.getvalue() == bencode(x)
+        assert ''.join(map(str, bencode_fragments(x))) == bencode(x)
+
+def test_bencode_fragments():
+    pieces = bytearray('x' * 40)
+    r = bencode_fragments({'pieces': pieces, 'length': 5})
+    assert any(f is pieces for f in r)
+    assert bencode({'info': Bencached(r)}) == \
+           'd4:infod6:lengthi5e6:pieces40:' + 'x' * 40 + 'ee'
+
   
 try:
     import psyco
@@ -0,0 +1,161 @@
+"""
+local cache of piece digests (and md5s) so making torrents for the
+same files over and over doesn't mean reading them over and over.
+
+entries are key'd off the identity of the files (path, size, mtime,
+inode) along w/ the piece size. pieces are only cached for runs of
+files which start on a piece boundary, since only then do a run's
+pieces depend on nothing but it's own files. that covers single file
+torrents, whole torrents being rebuilt w/ the same layout and each
+file of a padded torrent.
+"""
+
+import time
+import sqlite3
+import logging
+from hashlib import sha1
+
+from layout import iter_aligned_runs, PadFile
+from scanner import stat_record
+
+log = logging.getLogger(__name__)
+
+# default cap on how much data the cache holds
+CACHE_SIZE = 256 * 1024 * 1024
+
+
+def file_identity(path,record=None):
+    """ what we know a file by, if any of these change so might it.
+        given it's (scanner) record, that's what it's known by rather
+        than how the file is now """
+    if isinstance(path,PadFile):
+        return 'pad\0%d' % path.length
+    if record is None:
+        record = stat_record(path)
+    return '%s\0%d\0%d\0%d\0%d' % (path, record.size, record.mtime,
+                                   record.dev, record.inode)
+
+
+class PieceCache(object):
+    """
+    sqlite backed cache of digests. the least recently used entries
+    are evicted once the cache grows past max_size bytes.
+    """
+    def __init__(self,path,max_size=CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        # how well are we doing
+        self.hits = 0
+        self.misses = 0
+        self.hit_pieces = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        ' key TEXT PRIMARY KEY,'
+                        ' value BLOB NOT NULL,'
+                        ' size INTEGER NOT NULL,'
+                        ' last_used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_used'
+                        ' ON entries (last_used)')
+        self.db.commit()
+
+    def _run_key(self,paths,piece_size,records):
+        key = sha1(str(piece_size))
+        for path in paths:
+            key.update('\0\0' + file_identity(path,records.get(path)))
+        return 'pieces:' + key.hexdigest()
+
+    def _md5_key(self,path,records):
+        return 'md5:' + sha1(file_identity(path,records.get(path))).hexdigest()
+
+    def get(self,key):
+        row = self.db.execute('SELECT value FROM entries WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE entries SET last_used = ? WHERE key = ?',
+                        (time.time(),key))
+        return str(row[0])
+
+    def set(self,key,value):
+        self.db.execute('INSERT OR REPLACE INTO entries'
+                        ' (key, value, size, last_used)'
+                        ' VALUES (?, ?, ?, ?)',
+                        (key,sqlite3.Binary(value),len(key)+len(value),
+                         time.time()))
+
+    def restore(self,file_paths,file_sizes,piece_size,pieces,md5sums=None,
+                     records=None):
+        """ fills in the pieces (a PieceTable) and md5s we have cached,
+            returns how many pieces were filled in. records are the
+            files' (scanner) records key'd off their paths, taken
+            before hashing, the same should be given to store so what's
+            stored is key'd off the files as they were when read. files
+            w/o records are stat'd """
+        records = records or {}
+        restored = 0
+        for start, stop, paths in iter_aligned_runs(file_paths,file_sizes,
+                                                    piece_size):
+            if start == stop:
+                continue
+            value = self.get(self._run_key(paths,piece_size,records))
+            if value is None or len(value) != (stop - start) * 20:
+                self.misses += 1
+                continue
+            self.hits += 1
+            pieces.set_run(start,value)
+            restored += stop - start
+
+        if md5sums is not None:
+            for path in file_paths:
+                if isinstance(path,PadFile):
+                    continue
+                value = self.get(self._md5_key(path,records))
+                if value is not None:
+                    md5sums[path] = value
+
+        self.hit_pieces += restored
+        self.db.commit()
+        log.info('piece cache: %s runs hit, %s missed, %s pieces reused',
+                 self.hits,self.misses,self.hit_pieces)
+        return restored
+
+    def store(self,file_paths,file_sizes,piece_size,pieces,md5sums=None,
+                   records=None):
+        """ saves the runs' pieces (and md5s) for next time, see
+            restore for records """
+        records = records or {}
+        for start, stop, paths in iter_aligned_runs(file_paths,file_sizes,
+                                                    piece_size):
+            if start == stop or not pieces.has_run(start,stop):
+                continue
+            self.set(self._run_key(paths,piece_size,records),
+                     pieces.digests(start,stop))
+
+        for path, digest in (md5sums or {}).iteritems():
+            self.set(self._md5_key(path,records),digest)
+
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        """ drops the least recently used entries until we fit """
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0)'
+                                ' FROM entries').fetchone()[0]
+        if total <= self.max_size:
+            return 0
+        evicted = 0
+        rows = self.db.execute('SELECT key, size FROM entries'
+                               ' ORDER BY last_used').fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self.db.execute('DELETE FROM entries WHERE key = ?',(key,))
+            total -= size
+            evicted += 1
+        log.debug('piece cache: evicted %s entries',evicted)
+        return evicted
+
+    def close(self):
+        self.db.close()
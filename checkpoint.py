@@ -0,0 +1,120 @@
+"""
+keeps track of how far along hashing a set of files is in a sidecar
+file so that an interrupted run can pick up where it left off
+instead of starting over from zero.
+"""
+
+import os
+import os.path
+import time
+import logging
+
+from bencode import bencode, bdecode
+from piece_hasher import reusable_pieces
+from layout import PadFile
+
+log = logging.getLogger(__name__)
+
+# stands in for the digests of the pieces we haven't hashed yet
+EMPTY_DIGEST = '\0' * 20
+
+
+class Checkpoint(object):
+    """
+    the sidecar file records the ordered file list w/ sizes and
+    mtimes, the piece size and the digests of the pieces hashed
+    so far. digests are only saved for whole pieces, so a resumed
+    run starts back up from the last piece boundary.
+    """
+    def __init__(self,path,resume=False,interval=30):
+        self.path = path
+
+        # should we pick up the digests of an earlier run?
+        self.resume = resume
+
+        # how many seconds between saves
+        self.interval = interval
+
+        self.files = []
+        self.piece_size = None
+        self.last_save = None
+
+    def begin(self,files,piece_size):
+        """ takes note of what we are about to hash, files being
+            the ordered list of (path, size, mtime) """
+        self.files = files
+        self.piece_size = piece_size
+        self.last_save = time.time()
+
+    def restore(self,pieces):
+        """ fills in pieces w/ the saved digests which are still good,
+            returns how many were filled in """
+        if not self.resume or not os.path.exists(self.path):
+            return 0
+
+        try:
+            with file(self.path,'rb') as fh:
+                saved = bdecode(fh.read())
+        except (IOError, ValueError), ex:
+            log.warning('ignoring bad checkpoint %s: %s',self.path,ex)
+            return 0
+
+        if saved.get('piece length') != self.piece_size:
+            log.info('checkpoint piece size changed, starting over')
+            return 0
+
+        saved_files = []
+        for f in saved.get('files',[]):
+            path, mtime = f.get('path'), f.get('mtime')
+            if 'p' in f.get('attr',''):
+                path, mtime = PadFile(f.get('length')), 0
+            saved_files.append((path, f.get('length'), mtime))
+        saved_pieces = saved.get('pieces','')
+
+        restored = 0
+        for index in reusable_pieces(saved_files,self.files,
+                                     self.piece_size):
+            if index >= len(saved_pieces) // 20:
+                break
+            digest = saved_pieces[index*20:(index+1)*20]
+            if digest != EMPTY_DIGEST:
+                pieces[index] = digest
+                restored += 1
+
+        log.info('restored %s of %s pieces from %s',
+                 restored,len(pieces),self.path)
+        return restored
+
+    def update(self,pieces):
+        """ saves the pieces if it's been a while since we last did """
+        if time.time() - self.last_save >= self.interval:
+            self.save(pieces)
+
+    def save(self,pieces):
+        """ writes our progress out to the sidecar file """
+        files = []
+        for path, size, mtime in self.files:
+            if isinstance(path,PadFile):
+                files.append({'length': size, 'attr': 'p'})
+            else:
+                files.append({'path': path, 'length': size, 'mtime': mtime})
+
+        data = {
+            'piece length': self.piece_size,
+            'files': files,
+            # the pieces we don't have yet are all zeros, EMPTY_DIGEST
+            'pieces': pieces.digests()
+        }
+
+        # write it next door and move it into place so that
+        # being interrupted mid save doesn't lose the last one
+        tmp_path = self.path + '.tmp'
+        with file(tmp_path,'wb') as fh:
+            fh.write(bencode(data))
+        os.rename(tmp_path,self.path)
+        self.last_save = time.time()
+
+    def remove(self):
+        """ gets rid of the sidecar file, we're done w/ it """
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,252 @@
+"""
+hashing files spread over more than one drive. going through the files
+in order only ever reads from one drive at a time, instead the files
+are grouped by the device they're on (st_dev) and each device gets
+it's own readers working through it's pieces. the digests are put
+back in piece order as they come in.
+
+a piece which has data on more than one device (where the files change
+drives part way through a piece) is stitched together by reading each
+of it's segments from it's own file, those pieces get a reader of
+their own alongside the devices'. the number of readers per device is
+capped, on spinning disks more than one just has them seeking back and
+forth.
+"""
+
+import sys
+import logging
+from threading import Thread, Lock
+from Queue import Queue
+
+from layout import PadFile
+from piece_hasher import StraitPieceHasher, FileSums, iter_batches, \
+                         iter_missing_runs, iter_batch_jobs, \
+                         hash_piece_batch_job, hash_file_job, \
+                         iter_file_jobs, splits, BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+# how many readers each device gets
+PER_DEVICE = 1
+
+# the group the pieces w/ data on more than one device go in
+STITCHED = 'stitched'
+
+
+def device_runs(layout,devices):
+    """
+    yields (device, start, end) for the runs of consecutive files in
+    the layout which are on the same device, start and end being where
+    in the data the run starts and ends. devices is a lookup of the
+    files' devices. pad files go along w/ the run they're in, empty
+    files are left out.
+    """
+    run = None
+    for path, offset in zip(layout.paths,layout.offsets):
+        size = layout.file_sizes[path]
+        if not size:
+            continue
+        device = run[0] if isinstance(path,PadFile) and run \
+                 else devices[path]
+        if run and run[0] == device:
+            run[2] = offset + size
+            continue
+        if run:
+            yield tuple(run)
+        run = [device, offset, offset + size]
+    if run:
+        yield tuple(run)
+
+
+def plan_device_pieces(layout,devices):
+    """
+    works out which pieces can be read from a single device. returns
+    a lookup of device to the (start, stop) ranges of it's pieces,
+    w/ the pieces which span devices under STITCHED.
+    """
+    piece_size = layout.piece_size
+    ranges = {}
+    stitched = set()
+    for device, start, end in device_runs(layout,devices):
+        first = int(start // piece_size)
+        stop = int((end + piece_size - 1) // piece_size)
+
+        # the pieces the run shares w/ the runs before / after it
+        if start % piece_size:
+            stitched.add(first)
+            first += 1
+        if end % piece_size and end != layout.total_size:
+            stitched.add(stop - 1)
+            stop -= 1
+        if first < stop:
+            ranges.setdefault(device,[]).append((first,stop))
+
+    if stitched:
+        ranges[STITCHED] = [(i, i + 1) for i in sorted(stitched)]
+    return ranges
+
+
+def iter_range_pieces(layout,ranges,missing):
+    """ yields the (piece index, segments) of the pieces in the ranges
+        which are in the missing (start, stop) runs """
+    for start, stop in ranges:
+        for missing_start, missing_stop in missing:
+            run_start = max(start,missing_start)
+            run_stop = min(stop,missing_stop)
+            if run_start >= run_stop:
+                continue
+            segments = layout.iter_segments(run_start,run_stop)
+            for index, piece_segments in enumerate(segments,run_start):
+                yield index, piece_segments
+
+
+def iter_device_results(work,func,per_device=PER_DEVICE):
+    """
+    work is a lookup of device to an iterator of jobs. func is run on
+    each job by per_device threads for each device, so that each
+    device is read from at the same time but no more than per_device
+    ways. yields the results as they're done.
+    """
+    results = Queue()
+    stopped = []
+
+    def worker(jobs,lock):
+        try:
+            while not stopped:
+                # the jobs are a generator, only one of us in it at a time
+                with lock:
+                    job = next(jobs,None)
+                if job is None:
+                    break
+                results.put(('result', func(job)))
+        except Exception:
+            # goes back to the thread we're yielding to, raised there
+            results.put(('error', sys.exc_info()))
+        finally:
+            results.put(('done', None))
+
+    threads = []
+    for device, jobs in work.iteritems():
+        lock = Lock()
+        # stitched pieces read from the devices the others are on, so
+        # they don't get more than the one reader
+        readers = 1 if device == STITCHED else per_device
+        for i in xrange(readers):
+            thread = Thread(target=worker,args=(jobs,lock))
+            thread.daemon = True
+            threads.append(thread)
+
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running:
+            kind, result = results.get()
+            if kind == 'done':
+                running -= 1
+            elif kind == 'error':
+                raise result[0], result[1], result[2]
+            else:
+                yield result
+    finally:
+        # the workers finish the job they're on and stop
+        stopped.append(True)
+        for thread in threads:
+            thread.join()
+
+
+class DevicePieceHasher(StraitPieceHasher):
+    """
+    generates the same pieces hash as the strait hasher, but w/ the
+    files grouped by the device they're on and each device read from
+    at the same time by it's own per_device readers. see the module
+    doc string. the files' v2 trees are worked out from the pieces'
+    reads (see piece_hasher.BatchSums), put back in file order once
+    they're all in, as are the md5s of the files a batch has all of.
+    md5s of files split between batches can't be put back together
+    out of order, those files are read again a whole file per job,
+    the files likewise grouped by device.
+    """
+    def __init__(self,paths=[],per_device=PER_DEVICE,read_mode='buffered',
+                      checkpoint=None,cache=None,pad_files=False,
+                      progress=None,**kwargs):
+        StraitPieceHasher.__init__(self,paths,read_mode,checkpoint,cache,
+                                   pad_files,progress,**kwargs)
+
+        # readers per device, 1 for spinning disks
+        self.per_device = per_device or PER_DEVICE
+
+    def file_devices(self,paths):
+        """ lookup of the files' devices """
+        return dict(( (r.path, r.dev) for r in self.file_records(paths)))
+
+    def hash_pieces(self,layout,pieces,file_hashes=()):
+        """ fills in the missing digests of the pieces list """
+        devices = self.file_devices(layout.file_paths)
+        plan = plan_device_pieces(layout,devices)
+        log.debug('hashing pieces from %s devices',
+                  len([d for d in plan if d != STITCHED]))
+
+        new_hashes = [new_hash for new_hash, results in file_hashes]
+        if not all((splits(new_hash) for new_hash in new_hashes)):
+            log.warning('md5s of files split between batches are read '
+                        'again hashing by device')
+        sizes = layout.file_sizes if new_hashes else None
+
+        batch_len = max(1, BATCH_SIZE // layout.piece_size)
+        missing = list(iter_missing_runs(pieces))
+        work = dict(( (device, iter_batch_jobs(
+                                   iter_batches(iter_range_pieces(layout,
+                                                                  ranges,
+                                                                  missing),
+                                                batch_len),
+                                   sizes))
+                      for device, ranges in plan.iteritems()))
+
+        # our threads put their digests strait into the table
+        hash_batch = lambda job: hash_piece_batch_job(job,self.read_mode,
+                                                      self.read_size,pieces,
+                                                      new_hashes)
+        file_parts = []
+        for digests, stats, parts in iter_device_results(work,hash_batch,
+                                                         self.per_device):
+            for index, digest in digests:
+                pieces[index] = digest
+            file_parts.extend(parts or ())
+            if self.checkpoint:
+                self.checkpoint.update(pieces)
+            self.stats.merge(stats)
+            self.report()
+
+        # the parts come in device by device, they go into the files'
+        # hashes in order
+        file_parts.sort(key=lambda part: (layout.offset(part[0]),part[1]))
+        file_sums = FileSums(file_hashes,layout.file_sizes)
+        for part in file_parts:
+            file_sums.add_part(*part)
+
+    def hash_files(self,file_paths,file_hashes=()):
+        """ fills in the file_hashes' results, a file per job """
+        jobs = list(iter_file_jobs(file_paths,file_hashes))
+        if not jobs:
+            return
+
+        devices = self.file_devices([path for path, h, r in jobs])
+        by_device = {}
+        for job in jobs:
+            by_device.setdefault(devices[job[0]],[]).append(job)
+        work = dict(( (device, iter(device_jobs))
+                      for device, device_jobs in by_device.iteritems()))
+
+        def hash_file(job):
+            path, new_hashes, results = job
+            digests, stats = hash_file_job((path,new_hashes,self.read_mode,
+                                            self.read_size))
+            return job, digests, stats
+
+        for (path, new_hashes, results), digests, stats \
+                in iter_device_results(work,hash_file,self.per_device):
+            for result, digest in zip(results,digests):
+                result[path] = digest
+            self.stats.merge(stats)
+            self.report()
@@ -0,0 +1,67 @@
+"""
+tells the kernel how we're going to read a file. we read each file
+once, start to finish, so we ask for aggressive readahead and for the
+data not to be kept around once we're through w/ it. that way a big
+hashing run doesn't push everything else out of the page cache.
+
+uses os.posix_fadvise when there is one, otherwise calls it out of libc
+w/ ctypes. where neither works the advice is silently skipped, it's
+only ever a hint.
+"""
+
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# the advice values, these are linux's
+NORMAL = 0
+RANDOM = 1
+SEQUENTIAL = 2
+WILLNEED = 3
+DONTNEED = 4
+NOREUSE = 5
+
+
+def _libc_fadvise():
+    """ posix_fadvise out of libc, or None """
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except (ImportError, OSError):
+        return None
+
+    # the 64 bit version takes 64 bit offsets even on 32 bit systems
+    func = getattr(libc,'posix_fadvise64',None) \
+           or getattr(libc,'posix_fadvise',None)
+    if func is None:
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                     ctypes.c_int]
+    func.restype = ctypes.c_int
+
+    def fadvise(fd,offset,length,advice):
+        # unlike os', returns the error rather than setting errno
+        err = func(fd,offset,length,advice)
+        if err:
+            raise OSError(err,os.strerror(err))
+    return fadvise
+
+
+_fadvise = getattr(os,'posix_fadvise',None) or _libc_fadvise()
+
+
+def advise(fd,offset,length,*advice):
+    """ gives the advice for length bytes of the file (0 being to the
+        end) from offset. returns if the advice could be given """
+    if _fadvise is None:
+        return False
+    try:
+        for a in advice:
+            _fadvise(fd,offset,length,a)
+    except (OSError, IOError), ex:
+        log.debug('fadvise failed: %s',ex)
+        return False
+    return True
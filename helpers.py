@@ -5,8 +5,18 @@ from types import StringType, LongType, IntType, ListType, DictType
 ints = (LongType, IntType)
 strings = (StringType,unicode)
 from re import compile
+from collections import namedtuple
 from sha import sha
-from hashlib import md5
+from hashlib import md5, sha256
+from urllib import quote
+
+from scanner import scan
+from fadvise import advise, SEQUENTIAL, NOREUSE, DONTNEED
+from bencode import Bencached, BencachedType, bdecode_lazy, LazyDict, \
+                    bencode_fragments
+
+# how much of a file md5sum reads at a time
+MD5_CHUNK_SIZE = 1024 * 1024
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -16,26 +26,48 @@ def determine_torrent_name(files):
     # if they gave us a single path and it was a dir
     # than use the dir name as the torrent name
     if len(files) == 1 and os.path.isdir(files[0]):
-        name = os.path.basename(files[0])
+        name = os.path.basename(files[0].rstrip(os.sep))
         # if for some reason we did not get an abs path
         # than use what we have
-        name = files[0].replace(os.sep,'')
+        if not name:
+            name = files[0].replace(os.sep,'')
         log.debug('name: %s',name)
         return name
 
     return None
 
-def validate_info_data(info_data):
-    """ raises exceptions if data is bad """
-    reg = compile(r'^[^/\\.~][^/\\]*$')
+# what a name / path dir has to look like to be safe, not starting
+# w/ a dot or ~ and w/o any separators
+SAFE_NAME = compile(r'^[^/\\.~][^/\\]*$')
+
+def validate_info_data(info_data,trusted=False):
+    """ raises exceptions if data is bad. trusted info, eg that we
+        just built (and validated building it), only has it's top
+        level checked rather than every file """
+    reg = SAFE_NAME
 
     # we must represent the info as a dict
     if type(info_data) != DictType:
         raise ValueError('invalid info: data must be a dictionary')
 
+    # v2 (BEP 52) torrents have a file tree, hybrids have both
+    meta_version = info_data.get('meta version',1)
+    if meta_version not in (1, 2):
+        raise ValueError('invalid info: unknown meta version')
+    v1 = meta_version == 1 or 'pieces' in info_data
+
+    if meta_version == 2:
+        piece_size = info_data.get('piece length')
+        if type(piece_size) not in ints or piece_size < 16384 \
+           or piece_size & (piece_size - 1):
+            raise ValueError('invalid info: bad v2 piece length')
+        if not trusted:
+            validate_file_tree(info_data.get('file tree'),reg)
+
     # make sure our pieces are a string % 20
     pieces = info_data.get('pieces')
-    if type(pieces) != StringType or len(pieces) % 20 != 0:
+    if v1 and (type(pieces) not in (StringType, bytearray)
+               or len(pieces) % 20 != 0):
         raise ValueError('invalid info: bad piece key')
 
     # check our torrent's name
@@ -53,46 +85,21 @@ def validate_info_data(info_data):
         raise ValueError('invalid info: single/multiple info')
 
 
-    if 'files' in info_data:
+    # v2 only infos have their files in the file tree
+    if v1 and 'files' in info_data:
         files = info_data.get('files')
 
         # our files must be a list
         if type(files) != ListType:
             raise ValueError('invalid info: files must be list')
 
-        # check each of our sub files
-        duplicate_check = {}
-        for file_data in files:
-            # they are represented as dicts
-            if type(file_data) is not DictType:
-                raise ValueError('invalid info: file data must be dict')
-
-            # they have an int non 0 length
-            length = file_data.get('length')
-            if type(length) not in ints or length < 0:
-                raise ValueError('invalid info: bad file length')
-
-            # our path must be secure and a list of strings
-            path = file_data.get('path')
-            if type(path) != ListType or path == []:
-                raise ValueError('invalid info: bad file path :: %s' % path)
-            # check our path dirs, secure strings
-            for path_piece in path:
-                if type(path_piece) not in strings:
-                    raise ValueError('invalid info: bad path dir: %s',                                          path_piece)
-                if not reg.match(path_piece):
-                    raise ValueError('invalid info: insecure path dir')
-
-            # make sure we haven't seen this guy before
-            if tuple(path) in duplicate_check:
-                raise ValueError('invalid info: duplicate path')
-            else:
-                duplicate_check[tuple(path)] = True
+        if not trusted:
+            validate_files(files,reg)
 
 
     # if we are a single file we will have a length
     # represented as an int
-    else:
+    elif v1:
         length = info_data.get('length')
         if type(length) not in ints or length < 0:
             raise ValueError('invalid info: bad length')
@@ -101,6 +108,81 @@ def validate_info_data(info_data):
     return True
 
 
+def validate_files(files,reg=SAFE_NAME):
+    """ raises exceptions if the v1 files list is bad. the files are
+        gone through once, the path dirs (each distinct one once) and
+        duplicate paths are checked after """
+    paths = []
+    path_dirs = set()
+    add_path, add_dirs = paths.append, path_dirs.update
+    for file_data in files:
+        # they are represented as dicts
+        if type(file_data) is not DictType:
+            raise ValueError('invalid info: file data must be dict')
+
+        # they have an int non 0 length
+        length = file_data.get('length')
+        if type(length) not in ints or length < 0:
+            raise ValueError('invalid info: bad file length')
+
+        # BEP 47 padding files don't have to have a real path
+        attr = file_data.get('attr','')
+        if type(attr) not in strings:
+            raise ValueError('invalid info: bad file attr')
+        path = file_data.get('path')
+        if attr and 'p' in attr:
+            if type(path) is not ListType:
+                raise ValueError('invalid info: bad pad path')
+            continue
+
+        # our path must be a list of strings
+        if type(path) is not ListType or not path:
+            raise ValueError('invalid info: bad file path :: %s' % path)
+        try:
+            add_dirs(path)
+        except TypeError:
+            raise ValueError('invalid info: bad path dir: %s' % path)
+        add_path(tuple(path))
+
+    # check our path dirs, secure strings
+    for path_dir in path_dirs:
+        if type(path_dir) not in strings:
+            raise ValueError('invalid info: bad path dir: %s' % path_dir)
+        if not reg.match(path_dir):
+            raise ValueError('invalid info: insecure path dir')
+
+    # make sure we haven't seen any of them before
+    if len(set(paths)) != len(paths):
+        raise ValueError('invalid info: duplicate path')
+
+
+def validate_file_tree(tree,reg=SAFE_NAME):
+    """ raises exceptions if the v2 file tree is bad """
+    if type(tree) != DictType or not tree:
+        raise ValueError('invalid info: bad file tree')
+
+    for name, node in tree.iteritems():
+        # names are checked the same as v1 path dirs
+        if type(name) not in strings or not reg.match(name):
+            raise ValueError('invalid info: insecure file tree name')
+        if type(node) != DictType:
+            raise ValueError('invalid info: bad file tree node')
+
+        # a file's node has just the '' key, dirs are trees of their own
+        if '' not in node:
+            validate_file_tree(node,reg)
+            continue
+        if len(node) != 1 or type(node['']) != DictType:
+            raise ValueError('invalid info: bad file tree file')
+
+        length = node[''].get('length')
+        if type(length) not in ints or length < 0:
+            raise ValueError('invalid info: bad file length')
+        root = node[''].get('pieces root')
+        if length and (type(root) != StringType or len(root) != 32):
+            raise ValueError('invalid info: bad pieces root')
+
+
 def convert_unicode(s,encoding):
     try:
         if type(s) is ListType:
@@ -116,25 +198,9 @@ def find_files(path,extension=None,exclude=None):
     """ returns abs list of paths found recursively 
         searching from passed path. excluding paths
         which contain exclude arg and only including
-        paths which meet the extension arg """
-    # absolute paths
-    found = []
-
-    for dir_path, dir_names, file_names in os.walk(path,followlinks=True):
-        # remove paths which include the exclude string
-        # this will keep them from being traversed
-        if exclude:
-            bad_dirs = [x for x in dir_names if exclude in dir_names]
-            map(dir_names.remove,bad_dirs)
-
-        # see if any of the current files meet our
-        # extensio and exclude criteria
-        for name in file_names:
-            if (not extension or x.endswith(extension)) \
-               and (not exclude or exclude not in x):
-                found.append(os.path.join(dir_path,name))
-
-    return [os.path.abspath(path) for path in found]
+        paths which meet the extension arg. see
+        scanner.scan for getting their sizes w/ them """
+    return [record.path for record in scan([path],True,extension,exclude)]
 
 
 def get_file_name(path,rel_file_base=None):
@@ -207,16 +273,144 @@ def md5sum(path):
 
     file_sum = md5()
     with file(path,'rb') as fh:
+        advise(fh.fileno(),0,0,SEQUENTIAL,NOREUSE)
         while True:
-            chunk = fh.read(128)
+            chunk = fh.read(MD5_CHUNK_SIZE)
             if not chunk:
                 break
             file_sum.update(chunk)
+        advise(fh.fileno(),0,0,DONTNEED)
 
     digest = file_sum.digest()
     return digest
 
 
+def pad_length(offset,piece_size):
+    """ how much padding it takes to get from offset to the
+        start of the next piece """
+    return (piece_size - offset % piece_size) % piece_size
+
+
+def encode_info(info_data):
+    """ the canonical bencoding of the info, wrapped so that it's
+        spliced as is into whatever it's encoded along w/. it's kept
+        as it's fragments, the info's pieces (a bytearray) aren't
+        copied into it but referenced, so must not be changed after:
+        the encoding would change under any hash already taken of it """
+    if isinstance(info_data,BencachedType):
+        return info_data
+    return Bencached(bencode_fragments(info_data))
+
+
+def info_hash(info_data,v2=False):
+    """ hex infohash of the info, which can be the info dict, it's
+        encoding or a Bencached of it. v2 gives the sha256 hash """
+    if isinstance(info_data,BencachedType):
+        encoded = info_data.bencoded
+    elif isinstance(info_data,strings):
+        encoded = info_data
+    else:
+        encoded = bencode_fragments(info_data)
+
+    # the fragments are hashed one after the other, never joined up
+    h = sha256() if v2 else sha()
+    if isinstance(encoded,strings):
+        h.update(encoded)
+    else:
+        for fragment in encoded:
+            h.update(fragment)
+    return h.hexdigest()
+
+
+def torrent_info_hashes(torrent_data):
+    """ returns the (v1, v2) infohashes of a bencoded torrent, the
+        ones it doesn't have being None. the info is hashed straight
+        from it's span in the data, it's never decoded """
+    meta_data = bdecode_lazy(torrent_data)
+    if not isinstance(meta_data,LazyDict) or 'info' not in meta_data:
+        raise Exception('Torrent has no info')
+    encoded = meta_data.raw_item('info')
+    info = meta_data['info']
+    v1 = v2 = None
+    if 'pieces' in info:
+        v1 = info_hash(encoded)
+    if info.get('meta version') == 2:
+        v2 = info_hash(encoded,v2=True)
+    return v1, v2
+
+
+def magnet_link(v1_hash=None,v2_hash=None,name=None,trackers=(),
+                length=None):
+    """ magnet uri for the hex infohashes (BEP 9, BEP 52) """
+    params = []
+    if v1_hash:
+        params.append('xt=urn:btih:%s' % v1_hash)
+    if v2_hash:
+        # multihash prefix: sha2-256, 32 bytes
+        params.append('xt=urn:btmh:1220%s' % v2_hash)
+    if name:
+        params.append('dn=%s' % quote(name,safe=''))
+    if length is not None:
+        params.append('xl=%s' % length)
+    for tracker in trackers:
+        params.append('tr=%s' % quote(tracker,safe=''))
+    return 'magnet:?' + '&'.join(params)
+
+
+def info_length(info):
+    """ the total length of the info's files, w/o any padding. v2
+        only infos' lengths come from their file tree """
+    length = info.get('length')
+    if length is not None:
+        return length
+    if 'files' in info:
+        return sum((f['length'] for f in info['files']
+                    if 'p' not in f.get('attr','')))
+    if 'file tree' not in info:
+        return None
+
+    # a file's node is just it's '' key, anything else is a dir
+    length = 0
+    dirs = [info['file tree']]
+    while dirs:
+        for name, node in dirs.pop().items():
+            if '' in node:
+                length += node['']['length']
+            else:
+                dirs.append(node)
+    return length
+
+
+def torrent_magnet_link(torrent_data):
+    """ magnet link for a bencoded torrent, read lazily """
+    v1, v2 = torrent_info_hashes(torrent_data)
+    meta_data = bdecode_lazy(torrent_data)
+    info = meta_data['info']
+
+    trackers = []
+    if meta_data.get('announce'):
+        trackers.append(meta_data['announce'])
+    for tier in meta_data.get('announce-list') or []:
+        trackers += [t for t in tier if t not in trackers]
+
+    return magnet_link(v1,v2,info.get('name'),trackers,info_length(info))
+
+
+# the range of piece sizes we'll pick from, v2 needs at least 16k
+MIN_PIECE_SIZE = 16 * 1024
+MAX_PIECE_SIZE = 64 * 1024 * 1024
+
+# past the top of the ladder, pieces grow to keep to this many
+LADDER_MAX_PIECES = 32768
+
+# what the meta data costs besides the info the estimate counts
+# (the name, announce, comment ...), a guess
+TORRENT_OVERHEAD = 512
+
+PiecePlan = namedtuple('PiecePlan',
+                       'piece_size piece_count data_size torrent_size')
+
+
 def determine_piece_size(total_size):
     exponent = 15 # < 4mb, 32k pieces
     if total_size   > 8L*1024*1024*1024: # > 8gb, 2mb pieces
@@ -231,5 +425,138 @@ def determine_piece_size(total_size):
         exponent = 17
     elif total_size > 4L*1024*1024: # > 4mb, 64k pieces
         exponent = 16
+
+    # > 64gb, keep the piece count down
+    while 2 ** exponent * LADDER_MAX_PIECES < total_size \
+          and 2 ** exponent < MAX_PIECE_SIZE:
+        exponent += 1
     return 2 ** exponent
 
+
+def bencoded_int_size(n):
+    return len(str(n)) + 2
+
+
+def bencoded_string_size(length):
+    return len(str(length)) + 1 + length
+
+
+def estimate_torrent_size(file_sizes,piece_size,path_sizes=None,
+                          pad_files=False,version='v1',create_md5=False,
+                          tree_size=None):
+    """
+    estimates how big the bencoded meta data will be, in bytes, w/o
+    hashing anything. file_sizes are the sizes of the files in order,
+    path_sizes how many bytes each file's (relative) path takes when
+    bencoded and tree_size how many bytes the names in the v2 file
+    tree take (each dir's once, see PathTrie.tree_size). w/o it the
+    files' paths are counted in full. the info is counted to the byte
+    but for it's name (which a lone file's v2 tree has too),
+    TORRENT_OVERHEAD is added for that and the outer fields. returns
+    (piece count, data size w/ padding, estimate).
+    """
+    if path_sizes is None:
+        path_sizes = [0] * len(file_sizes)
+    v1 = version != 'v2'
+    v2 = version != 'v1'
+    multi = len(file_sizes) != 1
+
+    # d4:infod4:name..12:piece lengthi..e7:privatei0ee
+    estimate = TORRENT_OVERHEAD + 16 + 15 + bencoded_int_size(piece_size) \
+               + 12
+    if v1 and multi:
+        # 5:filesl..e
+        estimate += 9
+    elif v1:
+        # 6:lengthi..e
+        estimate += 8 + bencoded_int_size(sum(file_sizes))
+    if create_md5 and not multi:
+        # 6:md5sum..
+        estimate += 8 + bencoded_string_size(16)
+    if v2:
+        # 12:meta versioni2e9:file treed..e, a lone file's name in the
+        # tree is the torrent's
+        estimate += 18 + 13
+        if tree_size is None and multi:
+            tree_size = sum((max(0,p - 2) for p in path_sizes))
+        estimate += tree_size or 0
+
+    layers = False
+    data_size = 0L
+    for i, (size, path_size) in enumerate(zip(file_sizes,path_sizes)):
+        data_size += size
+        if v1 and multi:
+            # d6:lengthi..e4:pathl..ee
+            estimate += 16 + bencoded_int_size(size) + path_size
+            if create_md5:
+                estimate += 8 + bencoded_string_size(16)
+        if v2:
+            # {'': {length, pieces root}} under the file's name
+            estimate += 14 + bencoded_int_size(size)
+            if size:
+                estimate += 14 + bencoded_string_size(32)
+            # and it's piece layer
+            if size > piece_size:
+                layers = True
+                estimate += bencoded_string_size(32) + \
+                            bencoded_string_size(
+                                32 * ((size + piece_size - 1) // piece_size))
+
+        # padding out to the next piece,
+        # d4:attr1:p6:lengthi..e4:pathl4:.pad..ee
+        padding = pad_length(data_size,piece_size) if pad_files else 0
+        if padding and i < len(file_sizes) - 1:
+            data_size += padding
+            if v1:
+                estimate += 33 + bencoded_int_size(padding) \
+                            + bencoded_string_size(len(str(padding)))
+
+    # 12:piece layersd..e
+    if layers:
+        estimate += 17
+
+    piece_count = int((data_size + piece_size - 1) // piece_size)
+    if v1:
+        estimate += 8 + bencoded_string_size(20 * piece_count)
+    return piece_count, data_size, estimate
+
+
+def plan_piece_size(file_sizes,target_pieces=None,max_torrent_size=None,
+                    path_sizes=None,pad_files=False,version='v1',
+                    create_md5=False,min_size=MIN_PIECE_SIZE,
+                    max_size=MAX_PIECE_SIZE,tree_size=None):
+    """
+    picks the smallest (power of two) piece size that makes no more
+    than target_pieces pieces and keeps the meta data under
+    max_torrent_size bytes. padding grows w/ the piece size, so w/
+    lots of files the targets can be out of reach, in which case the
+    size making the smallest meta data is picked. w/o targets the
+    size comes from determine_piece_size. returns a PiecePlan.
+    """
+    file_sizes = list(file_sizes)
+    estimate = lambda size: estimate_torrent_size(file_sizes,size,
+                                                  path_sizes,pad_files,
+                                                  version,create_md5,
+                                                  tree_size)
+
+    if not target_pieces and not max_torrent_size:
+        piece_size = max(min_size,min(max_size,
+                         determine_piece_size(sum(file_sizes))))
+        return PiecePlan(piece_size,*estimate(piece_size))
+
+    best = None
+    piece_size = min_size
+    while piece_size <= max_size:
+        plan = PiecePlan(piece_size,*estimate(piece_size))
+        if (not target_pieces or plan.piece_count <= target_pieces) and \
+           (not max_torrent_size or plan.torrent_size <= max_torrent_size):
+            return plan
+        if best is None or plan.torrent_size < best.torrent_size:
+            best = plan
+        piece_size *= 2
+
+    log.warning('no piece size meets the targets, using %s (%s pieces, '
+                '~%s byte torrent)',best.piece_size,best.piece_count,
+                best.torrent_size)
+    return best
+
@@ -0,0 +1,192 @@
+"""
+how the files' data is laid out end to end for hashing. the Layout
+fixes the order of the files once, along w/ where each one starts and
+which pieces it covers. the hashers and the info builder all go off of
+the same Layout so the pieces always line up w/ the files list.
+"""
+
+from bisect import bisect_right
+
+from helpers import pad_length
+
+
+class PadFile(object):
+    """
+    stands in for a BEP 47 padding file in the hashers' file lists.
+    it's data is all zeros and is never read from the drive.
+    """
+    def __init__(self,length):
+        self.length = length
+
+    def __eq__(self,other):
+        return isinstance(other,PadFile) and other.length == self.length
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((PadFile, self.length))
+
+    def __repr__(self):
+        return 'PadFile(%s)' % self.length
+
+
+def add_padding(file_paths, file_sizes, piece_size):
+    """
+    returns the file paths w/ a PadFile after each file (but the last)
+    that doesn't end on a piece boundary, so every file starts on one.
+    the pad files' sizes are added to file_sizes.
+    """
+    padded = []
+    data_pos = 0L
+    for i, path in enumerate(file_paths):
+        padded.append(path)
+        data_pos += file_sizes.get(path)
+        length = pad_length(data_pos,piece_size)
+        if length and i < len(file_paths) - 1:
+            pad = PadFile(length)
+            file_sizes[pad] = length
+            padded.append(pad)
+            data_pos += length
+    return padded
+
+
+def count_pieces(total_size, piece_size):
+    """ how many pieces does total_size bytes of data make up """
+    return int((total_size + piece_size - 1) // piece_size)
+
+
+def iter_piece_segments(file_paths, file_sizes, piece_size,
+                        start=0, stop=None, offset=0):
+    """
+    walks the files' data concatenated end to end, yielding for
+    each piece (in order) a list of the (path, offset, length)
+    segments which make it up. pieces can span files. start / stop
+    limit the walk to that range of piece indexes. offset is where
+    the first of the files starts in the data, the files before it
+    having been left off.
+    """
+    segments = []
+    index = start
+    if stop is not None and index >= stop:
+        return
+
+    # the files before our first piece are skipped over
+    skip = start * piece_size - offset
+    piece_pos = 0L
+    for path in file_paths:
+        file_size = file_sizes.get(path)
+        if skip >= file_size:
+            skip -= file_size
+            continue
+        file_pos, skip = skip, 0L
+        while file_pos < file_size:
+            # same as the strait hasher, stop @ the end of the
+            # file or the end of the piece
+            read_len = min(file_size-file_pos,piece_size-piece_pos)
+            segments.append((path,file_pos,read_len))
+            file_pos += read_len
+            piece_pos += read_len
+            if piece_pos == piece_size:
+                yield segments
+                segments = []
+                piece_pos = 0L
+                index += 1
+                if index == stop:
+                    return
+
+    # the last piece can be short
+    if segments:
+        yield segments
+
+
+def iter_aligned_runs(file_paths, file_sizes, piece_size):
+    """
+    splits the files up into runs which start on a piece boundary and
+    end where the next run starts (or the data ends). the pieces of a
+    run depend only on it's own files, yields (first piece, stop piece,
+    paths) for each run.
+    """
+    run_paths = []
+    run_start = 0L
+    data_pos = 0L
+    for path in file_paths:
+        # starting on a piece boundary starts a new run
+        if data_pos % piece_size == 0 and run_paths:
+            yield (int(run_start // piece_size),
+                   count_pieces(data_pos,piece_size),
+                   run_paths)
+            run_paths = []
+            run_start = data_pos
+        run_paths.append(path)
+        data_pos += file_sizes.get(path)
+
+    if run_paths:
+        yield (int(run_start // piece_size),
+               count_pieces(data_pos,piece_size),
+               run_paths)
+
+
+class Layout(object):
+    """
+    the files in the order they're hashed and listed in, w/ pad files
+    between them when padding. paths are the files and pad files in
+    order, file_paths just the files. offsets are where each of the
+    paths starts in the data. the paths given can already have their
+    pad files, eg when laying out an existing torrent's files.
+    """
+    def __init__(self,file_paths,file_sizes,piece_size,pad_files=False):
+        self.piece_size = piece_size
+        self.pad_files = pad_files
+
+        self.file_sizes = dict(( (p, file_sizes[p]) for p in file_paths))
+
+        # line the files up on piece boundaries w/ padding
+        if pad_files:
+            self.paths = add_padding(list(file_paths),self.file_sizes,
+                                     piece_size)
+        else:
+            self.paths = list(file_paths)
+        self.file_paths = [p for p in self.paths
+                           if not isinstance(p,PadFile)]
+
+        self.offsets = []
+        self._index = {}
+        data_pos = 0L
+        for i, path in enumerate(self.paths):
+            self.offsets.append(data_pos)
+            if not isinstance(path,PadFile):
+                self._index[path] = i
+            data_pos += self.file_sizes[path]
+        self.total_size = data_pos
+        self.piece_count = count_pieces(data_pos,piece_size)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def offset(self,path):
+        """ where the file starts in the data """
+        return self.offsets[self._index[path]]
+
+    def piece_range(self,path):
+        """ the (start, stop) indexes of the pieces the file covers """
+        offset = self.offset(path)
+        size = self.file_sizes[path]
+        start = int(offset // self.piece_size)
+        if not size:
+            return start, start
+        return start, int((offset + size - 1) // self.piece_size) + 1
+
+    def iter_segments(self,start=0,stop=None):
+        """ the segments of the pieces from start to stop, see
+            iter_piece_segments. the walk starts from the file the
+            first piece is in rather than from the first file """
+        first = max(0, bisect_right(self.offsets,
+                                    start * self.piece_size) - 1)
+        return iter_piece_segments(self.paths[first:],self.file_sizes,
+                                   self.piece_size,start,stop,
+                                   self.offsets[first] if self.paths else 0)
+
+    def iter_aligned_runs(self):
+        return iter_aligned_runs(self.paths,self.file_sizes,
+                                 self.piece_size)
@@ -8,12 +8,23 @@ goals:
 Can create a meta file from N files
 """
 
-from helpers import validate_info_data, convert_unicode, find_files, \
+from helpers import validate_info_data, convert_unicode, \
                     get_file_name, get_common_name, \
                     determine_file_sizes, md5sum, determine_piece_size, \
-                    determine_torrent_name
-
-from hasher import StraitHasher as Hasher
+                    plan_piece_size, bencoded_string_size, \
+                    determine_torrent_name, \
+                    encode_info, info_hash, info_length, magnet_link, \
+                    torrent_info_hashes, torrent_magnet_link
+
+from piece_hasher import StraitPieceHasher, ParallelPieceHasher, READ_SIZE
+from pipeline import READ_BUFFERS
+from devices import DevicePieceHasher
+from scanner import scan
+from progress import ProgressBar, JsonProgress
+from layout import Layout, PadFile
+from path_trie import PathTrie
+from checkpoint import Checkpoint
+from cache import PieceCache, CACHE_SIZE
 
 import os.path
 import logging as log
@@ -37,23 +48,117 @@ except:
     from sys import getdefaultencoding as get_system_encoding
 
 class MetaCreator:
-    def __init__(self, encoding=None, piece_size=None, create_md5=False):
+    def __init__(self, encoding=None, piece_size=None, create_md5=False,
+                       workers=None, read_mode='buffered',
+                       checkpoint=None, resume=False,
+                       cache=None, cache_size=CACHE_SIZE,
+                       incremental=False, pad_files=False,
+                       version='v1', pool=None,
+                       target_pieces=None, max_torrent_size=None,
+                       progress=None, read_size=READ_SIZE,
+                       read_buffers=READ_BUFFERS, per_device=None):
         """ values passed @ construction are used as defaults for creation """
 
         # what kind of text encoding does this machine use?
         self.encoding = encoding or get_system_encoding()
 
-        # if we didn't get passed a piece size we'll pick later
+        # if we didn't get passed a piece size we'll pick later, aiming
+        # for target_pieces pieces / a torrent of at most
+        # max_torrent_size bytes if given them
         self.piece_size = piece_size
+        self.target_pieces = target_pieces
+        self.max_torrent_size = max_torrent_size
 
         # should we include the files md5s?
         self.create_md5 = create_md5
 
+        # how many workers to hash w/, None or 1 hashes in process
+        self.workers = workers
+
+        # a worker pool to hash w/, shared w/ whoever else is using it.
+        # given one we always hash in parallel, on it
+        self.pool = pool
+
+        # how the hashers pull data off the drive (buffered / mmap)
+        self.read_mode = read_mode
+
+        # how much of a file the hashers read at a time, independent
+        # of the piece size
+        self.read_size = read_size
+
+        # how many read_size buffers to read ahead into while hashing
+        # (in process), 0 reads and hashes in turn
+        self.read_buffers = read_buffers
+
+        # given this many readers per device, the files on each device
+        # (drive) are hashed at the same time as the others'
+        self.per_device = per_device
+
+        # sidecar file to save hashing progress to, and should we
+        # pick up from what's already in it?
+        self.checkpoint = checkpoint
+        self.resume = resume
+
+        # where we keep digests from one run to the next, opened
+        # the first time we hash
+        self.cache = cache
+        self.cache_size = cache_size
+        self.piece_cache = None
+
+        # should we keep our hasher around so that hashing files
+        # we've hashed before only rehashes what changed?
+        self.incremental = incremental
+        self.hasher = None
+
+        # should we pad each file out to a piece boundary (BEP 47)?
+        self.pad_files = pad_files
+
+        # called w/ the hasher's piece_hasher.HashStats as it goes,
+        # the stats of the last hashing are kept in hash_stats
+        self.progress = progress
+        self.hash_stats = None
+
+        # v1, v2 (BEP 52) or hybrid (both) torrents? hybrids have to be
+        # padded for the v1 pieces to line up w/ the v2 files
+        if version not in ('v1', 'v2', 'hybrid'):
+            raise ValueError('unknown torrent version: %s' % version)
+        self.version = version
+        if version == 'hybrid':
+            self.pad_files = True
+
+        # the v2 piece layers of the last info created, they go
+        # in the meta data outside the info
+        self.piece_layers = {}
+
+        # the last info created, it's canonical encoding (Bencached so
+        # it's spliced into the meta data as is) and it's infohashes
+        self.info_data = None
+        self.encoded_info = None
+        self.info_hash = None
+        self.info_hash_v2 = None
+
+        # how much data the last info covers, padding aside
+        self.total_size = 0
+
+        # how the last info's piece size was picked, see
+        # helpers.PiecePlan
+        self.piece_plan = None
+
     def create_info_dict(self,file_paths,pieces=None,file_sizes=None,
                          piece_size=None,total_size=None,
                          private=False,create_md5=False,file_name=None,
-                         rel_file_base=None):
-        """ creates a dict of the 'info' part of the meta data """
+                         rel_file_base=None,md5sums=None,trees=None,
+                         layout=None,trie=None):
+        """ creates a dict of the 'info' part of the meta data.
+            md5s already created while hashing can be passed in
+            as a lookup key'd off file path, as can the v2 merkle
+            trees which go in the file tree. the files are listed
+            in the order of the layout the pieces were hashed w/.
+            the files' PathTrie is made here if it's not passed """
+        if layout is not None:
+            file_paths = layout.file_paths
+            file_sizes = layout.file_sizes
+            piece_size = layout.piece_size
         # fill out our data
         if not file_sizes:
             file_sizes = determine_file_sizes(file_paths)
@@ -65,9 +170,14 @@ class MetaCreator:
         # create our meta data dict
         info_data = {
             'piece length': piece_size,
-            'pieces': ''.join(pieces),
             'private': 1 if private else 0,
         }
+        v1 = self.version != 'v2'
+        if v1:
+            # the hashers' piece table goes in as is
+            if not isinstance(pieces,(str,bytearray)):
+                pieces = ''.join(pieces)
+            info_data['pieces'] = pieces
 
         # don't have to have a file name
         if file_name:
@@ -80,26 +190,38 @@ class MetaCreator:
 
         log.debug('rel file base: %s',rel_file_base)
 
+        # the files list and file tree both come off the one trie,
+        # it's names already encoded
+        if trie is None and len(file_paths) > 1:
+            trie = self.create_path_trie(file_paths,rel_file_base)
+
         # length only appropriate if there is a single file
         if len(file_paths) == 1:
-            info_data['length'] = total_size
+            if v1:
+                info_data['length'] = total_size
 
             # if they want us to create the optional md5
             # for the files than lets do so
             if create_md5:
-                info_data['md5sum'] = md5sum(file_paths[0])
+                info_data['md5sum'] = (md5sums or {}).get(file_paths[0]) \
+                                      or md5sum(file_paths[0])
 
             if not info_data.get('name'):
-                # we'll go ahead and put a name
-                info_data['name'] = get_file_name(file_paths[0],
-                                                  rel_file_base)
+                # we'll go ahead and put a name, the file's
+                info_data['name'] = os.path.basename(file_paths[0])
 
         # if it's multiple files we give it each one individually
         else:
-            info_data['files'] = self.create_files_info(file_paths,
-                                                        file_sizes,
-                                                        create_md5,
-                                                        rel_file_base)
+            if v1:
+                info_data['files'] = self.create_files_info(file_paths,
+                                                            file_sizes,
+                                                            create_md5,
+                                                            rel_file_base,
+                                                            md5sums,
+                                                            self.pad_files,
+                                                            piece_size,
+                                                            layout,
+                                                            trie)
 
             if not info_data.get('name'):
                 # guess a name
@@ -107,61 +229,209 @@ class MetaCreator:
                 if name:
                     info_data['name'] = name
 
-        # make sure our meta info is valid
-        try:
-            validate_info_data(info_data)
-        except Exception, ex:
-            raise
+        # v2 describes the files as a tree w/ each file's merkle root
+        if self.version != 'v1':
+            info_data['meta version'] = 2
+            info_data['file tree'] = self.create_file_tree(
+                file_paths,file_sizes,trees,rel_file_base,
+                info_data.get('name'),trie)
+
+        # make sure our meta info is valid, the files' paths already
+        # were as they went in the trie
+        validate_info_data(info_data,trusted=trie is not None)
 
         # encode our strings into UTF-8
-        self.encode_meta_info_strings(info_data)
+        self.encode_meta_info_strings(info_data,files=trie is None)
 
         return info_data
 
-    def hash_pieces(self,file_paths,file_sizes=None,piece_size=None):
-        """ returns back a string hash of the pieces """
-
-        hasher = Hasher(file_paths)
-        hash_string = hasher.digest(piece_size)
+    def hash_pieces(self,file_paths,file_sizes=None,piece_size=None,
+                         workers=None,md5sums=None,trees=None,
+                         records=None,layout=None):
+        """ returns back a string hash of the pieces. if more than
+            one worker is asked for the pieces are hashed in parallel.
+            if given an md5sums dict it is filled w/ the files' md5s
+            from the same pass over the data, likewise a trees dict
+            w/ the files' v2 merkle trees. the files' scanner records
+            can be passed to save stat'ing them again, and the layout
+            to hash them in """
+
+        checkpoint = None
+        if self.checkpoint:
+            checkpoint = Checkpoint(self.checkpoint,self.resume)
+
+        if self.cache and not self.piece_cache:
+            self.piece_cache = PieceCache(self.cache,self.cache_size)
+
+        workers = workers or self.workers
+        if self.incremental and self.hasher:
+            # it still knows the pieces of the last files it hashed
+            hasher = self.hasher
+            hasher.set_paths(file_paths)
+            hasher.checkpoint = checkpoint
+            hasher.read_size = self.read_size
+            hasher.read_buffers = self.read_buffers
+        elif self.per_device:
+            hasher = DevicePieceHasher(file_paths,self.per_device,
+                                       self.read_mode,checkpoint,
+                                       self.piece_cache,self.pad_files,
+                                       read_size=self.read_size)
+        elif self.pool is not None or (workers and workers > 1):
+            hasher = ParallelPieceHasher(file_paths,workers,
+                                         read_mode=self.read_mode,
+                                         checkpoint=checkpoint,
+                                         cache=self.piece_cache,
+                                         pad_files=self.pad_files,
+                                         pool=self.pool,
+                                         read_size=self.read_size)
+        else:
+            hasher = StraitPieceHasher(file_paths,self.read_mode,
+                                       checkpoint,self.piece_cache,
+                                       self.pad_files,
+                                       read_size=self.read_size,
+                                       read_buffers=self.read_buffers)
+        if records:
+            hasher.set_records(records)
+        hasher.progress = self.progress
+        if self.incremental:
+            self.hasher = hasher
+
+        hash_string = hasher.digest(piece_size,md5sums is not None,
+                                    self.version != 'v2',
+                                    trees is not None,layout)
+        self.hash_stats = hasher.stats
+        if md5sums is not None:
+            md5sums.update(hasher.md5sums)
+        if trees is not None:
+            trees.update(hasher.trees)
         return hash_string
 
     def create_files_info(self,file_paths,file_sizes=None,
-                               create_md5=False,rel_file_base=None):
+                               create_md5=False,rel_file_base=None,
+                               md5sums=None,pad_files=False,
+                               piece_size=None,layout=None,trie=None):
         """ create dict of file info for the info section of meta data.
             file_paths can also be a dict who's key is the file path
-            and the value is the file size """
+            and the value is the file size. md5s which are not in the
+            md5sums lookup are read from the files. w/ pad_files, BEP 47
+            padding entries are put between files to start each one
+            on a piece boundary. given the layout, it's files (and
+            padding) are listed in it's order. given the files'
+            PathTrie their (UTF-8) paths come from it. """
 
-        if not file_sizes:
+        md5sums = md5sums or {}
+
+        if not file_sizes and layout is None:
             file_sizes = determine_file_sizes(file_paths)
 
+        # padding is laid out between the files
+        if layout is None and pad_files:
+            layout = Layout(file_paths,file_sizes,piece_size,True)
+        paths = file_paths
+        if layout is not None:
+            paths, file_sizes = layout.paths, layout.file_sizes
+
         files_info = []
         # go through our files adding thier info dict
-        for path in file_paths:
-            name = get_file_name(path,rel_file_base)
+        for path in paths:
+            # the last file left off mid piece, pad out the rest of it
+            if isinstance(path,PadFile):
+                files_info.append({
+                    'length': path.length,
+                    'path': ['.pad', str(path.length)],
+                    'attr': 'p'
+                })
+                continue
+
+            if trie is not None:
+                name = trie.path(path)
+            else:
+                name = get_file_name(path,rel_file_base)
+                # nested files come back already split
+                if not isinstance(name,list):
+                    name = [x for x in name.split(os.sep) if x.strip()]
             file_info = {
                 'length': file_sizes.get(path),
-                'path': [x for x in name.split(os.sep) if x.strip()]
+                'path': name
             }
             if create_md5:
-                file_info['md5sum'] = md5sum(path)
+                file_info['md5sum'] = md5sums.get(path) or md5sum(path)
             files_info.append(file_info)
 
         return files_info
 
-    def encode_meta_info_strings(self,info_data,encoding=None):
-        """ encodes file/path names (UTF-8) """
+    def create_file_tree(self,file_paths,file_sizes,trees,
+                              rel_file_base=None,file_name=None,
+                              trie=None):
+        """ create the v2 file tree, nested dicts of the files' path
+            pieces down to each file's length and pieces root. trees
+            is a lookup of the files' (pieces root, piece layer).
+            given the files' PathTrie it's laid out the same as it """
+
+        def create_file_info(path):
+            file_info = {'length': file_sizes.get(path)}
+            root, layer = trees.get(path)
+            if root:
+                file_info['pieces root'] = root
+            return file_info
+
+        if trie is not None:
+            return trie.file_tree(create_file_info)
+
+        file_tree = {}
+        for path in file_paths:
+            # a lone file goes in the tree under the torrent's name
+            if len(file_paths) == 1 and file_name:
+                name = [file_name]
+            else:
+                name = get_file_name(path,rel_file_base)
+                if not isinstance(name,list):
+                    name = [x for x in name.split(os.sep) if x.strip()]
+
+            node = file_tree
+            for dir_name in name[:-1]:
+                node = node.setdefault(dir_name,{})
+
+            node[name[-1]] = {'': create_file_info(path)}
+
+        return file_tree
+
+    def create_piece_layers(self,trees):
+        """ the v2 'piece layers' lookup of the files' piece layers
+            key'd off their pieces root """
+        return dict(((root, layer) for root, layer in trees.itervalues()
+                     if layer))
+
+    def create_path_trie(self,file_paths,rel_file_base=None):
+        """ the PathTrie of the files' paths relative to the base,
+            their names encoded from ours. raises if two of the
+            files end up w/ the same path """
+        if rel_file_base is None:
+            rel_file_base = os.path.commonprefix(file_paths)
+        return PathTrie.from_paths(file_paths,rel_file_base,
+                                   self.encoding or 'ascii')
+
+    def encode_meta_info_strings(self,info_data,encoding=None,files=True):
+        """ encodes file/path names (UTF-8). w/o files, the files
+            list and file tree are taken to be encoded already (eg
+            having come from a PathTrie) """
         # pick our encoding
         if not encoding:
             encoding = self.encoding or 'ascii'
         self.encoding = encoding # keep track of what encoding use
 
         if info_data.get('name'):
-            u = unicode(info_data.get('name'))
+            u = info_data.get('name')
+            if not isinstance(u,unicode):
+                u = convert_unicode(u,encoding)
             info_data['name'] = u.encode('UTF-8')
 
         # shortcut
         cu = convert_unicode
 
+        if not files:
+            return True
+
         if info_data.get('files'):
             for file_info in info_data.get('files'):
                 if file_info.get('path'):
@@ -169,40 +439,79 @@ class MetaCreator:
                 if file_info.get('name'):
                     file_info['name'] = cu(file_info['name'],encoding)
 
+        def encode_tree(tree):
+            return dict(((cu(name,encoding),
+                          node if '' in node else encode_tree(node))
+                         for name, node in tree.iteritems()))
+
+        if info_data.get('file tree'):
+            info_data['file tree'] = encode_tree(info_data['file tree'])
+
         return True
 
     def create_info_data(self,files,encoding=None,
-                         piece_size=None,validate=True,private=False):
+                         piece_size=None,validate=True,private=False,
+                         create_md5=None):
         """ creates dict which is the info part of a meta data file
              from a list of files / directories.
             if the list contains a directory the directory is recursively
             searched. values passed (other than file list) take priorty over
-            defaults passed in @ instantiation """
+            defaults passed in @ instantiation.
+
+            the info's 'pieces' is a (mutable) bytearray, the hasher's
+            piece table, rather than a string, str() it for a string.
+            encoded_info holds the same bytearray rather than a copy,
+            so changing it leaves encoded_info and the infohashes
+            taken of it silently wrong """
 
-        # get list of files to index
-        file_paths = []
-        for path in files:
-            file_paths += find_files(path)
+        # get list of files to index, w/ their sizes from the same stat
+        records = scan(files)
+        file_paths = [r.path for r in records]
 
         # make sure there are any files to be had
         if not file_paths:
             raise Exception('No Files Found!')
 
-        # get the file sizes
-        file_sizes = determine_file_sizes(file_paths)
+        file_sizes = dict(( (r.path, r.size) for r in records))
+
+        # the files' paths, a name which won't encode or a duplicate
+        # path fails now rather than after they're hashed
+        trie = None
+        if len(file_paths) > 1:
+            trie = self.create_path_trie(file_paths)
 
         # determine our total
         total_size = sum(file_sizes.itervalues())
+        self.total_size = total_size
+
+        # do we want the files' md5s?
+        if create_md5 is None:
+            create_md5 = self.create_md5
 
         # lets figure out what our piece size will be
+        self.piece_plan = None
         if not piece_size: # did they pass us a value ?
             if self.piece_size:
                 piece_size = self.piece_size # did they set a default ?
             else:
-                piece_size = determine_piece_size(total_size)
-
-        # lets get our hash
-        piece_hashes = self.hash_pieces(file_paths,file_sizes,piece_size)
+                self.piece_plan = self.plan_piece_size(file_paths,
+                                                       file_sizes,
+                                                       create_md5,
+                                                       trie=trie)
+                piece_size = self.piece_plan.piece_size
+
+        # fix the order of the files (and their padding) once, the
+        # pieces and the files list both go off of it
+        layout = Layout(file_paths,file_sizes,piece_size,self.pad_files)
+
+        # lets get our hash, picking up the md5s and v2 trees
+        # on the way if we want them
+        md5sums = {} if create_md5 else None
+        trees = {} if self.version != 'v1' else None
+        piece_hashes = self.hash_pieces(file_paths,file_sizes,piece_size,
+                                        md5sums=md5sums,trees=trees,
+                                        records=records,layout=layout)
+        self.piece_layers = self.create_piece_layers(trees or {})
 
         # figure out what the "name" of our torrent is
         torrent_name = determine_torrent_name(files)
@@ -214,19 +523,110 @@ class MetaCreator:
                                           piece_size,
                                           total_size,
                                           private,
-                                          torrent_name)
+                                          create_md5,
+                                          torrent_name,
+                                          md5sums=md5sums,
+                                          trees=trees,
+                                          layout=layout,
+                                          trie=trie)
 
-        # success ?
-        try:
-            validate_info_data(info_data)
-        except Exception, ex:
-            raise
+        # hang on to it's encoding, no need to redo it for the
+        # infohash or each time it's saved
+        self.set_info(info_data)
 
         return info_data
 
+    def plan_piece_size(self,file_paths,file_sizes,create_md5=None,
+                             piece_size=None,trie=None):
+        """ picks the piece size for the files, returning the
+            helpers.PiecePlan w/ the estimated size of the torrent.
+            given a piece size, that's the one planned w/. the files'
+            names are taken from their trie, a lone file's (w/o one)
+            being it's base name """
+        if create_md5 is None:
+            create_md5 = self.create_md5
+
+        # what the files' paths will cost in the info
+        if trie is not None:
+            names_of = lambda path: trie.files[path].path
+        else:
+            names_of = lambda path: [os.path.basename(path)]
+        path_sizes = [2 + sum((bencoded_string_size(len(n))
+                               for n in names_of(path)))
+                      for path in file_paths]
+
+        kwargs = {}
+        if piece_size:
+            kwargs = {'min_size': piece_size, 'max_size': piece_size}
+        if trie is not None:
+            kwargs['tree_size'] = trie.tree_size()
+        plan = plan_piece_size([file_sizes[p] for p in file_paths],
+                               self.target_pieces,self.max_torrent_size,
+                               path_sizes,self.pad_files,self.version,
+                               create_md5,**kwargs)
+        log.debug('piece plan: %s',plan)
+        return plan
+
+    def estimate(self,files,piece_size=None):
+        """ the helpers.PiecePlan for the files / directories, w/o
+            hashing anything """
+        records = scan(files)
+        if not records:
+            raise Exception('No Files Found!')
+        file_paths = [r.path for r in records]
+        file_sizes = dict(( (r.path, r.size) for r in records))
+        trie = None
+        if len(file_paths) > 1:
+            trie = self.create_path_trie(file_paths)
+        return self.plan_piece_size(file_paths,file_sizes,
+                                    piece_size=piece_size or self.piece_size,
+                                    trie=trie)
+
+    def set_info(self,info_data):
+        """ encodes the info once, taking it's infohashes """
+        self.info_data = info_data
+        self.encoded_info = encode_info(info_data)
+        self.info_hash = None
+        self.info_hash_v2 = None
+        if self.version != 'v2':
+            self.info_hash = info_hash(self.encoded_info)
+        if self.version != 'v1':
+            self.info_hash_v2 = info_hash(self.encoded_info,v2=True)
+        log.debug('info hash: %s %s',self.info_hash,self.info_hash_v2)
+
+    def create_meta_data(self,info_data=None,**fields):
+        """ the meta data for the info (the last created by default)
+            w/ the given outer fields. the info goes in as it's cached
+            encoding, so bencoding the meta data only encodes the
+            outer fields around it """
+        if info_data is not None and info_data is not self.info_data:
+            self.set_info(info_data)
+        if self.encoded_info is None:
+            raise Exception('No info created yet')
+
+        meta_data = {}
+        for k, v in fields.iteritems():
+            if v is not None:
+                meta_data[k] = v
+        meta_data['info'] = self.encoded_info
+
+        # v2 piece layers go alongside the info
+        if self.piece_layers:
+            meta_data['piece layers'] = self.piece_layers
+
+        return meta_data
+
+    def magnet_link(self,trackers=()):
+        """ magnet link for the last info created """
+        if self.info_data is None:
+            raise Exception('No info created yet')
+        return magnet_link(self.info_hash,self.info_hash_v2,
+                           self.info_data.get('name'),trackers,
+                           info_length(self.info_data))
+
 
 if __name__ == '__main__':
-    from bencode import bencode
+    from bencode import bencode_to
     """
     we need to take in the following params:
      files - what do we include in the torrent? can be abs
@@ -298,6 +698,43 @@ if __name__ == '__main__':
                       dest="created by",
                       help="created by")
 
+    # hashing workers
+    parser.add_option("-w", "--workers",
+                      dest="workers",
+                      type="int",
+                      help="number of workers to hash pieces with")
+
+    # read mode
+    parser.add_option("--mmap",
+                      action="store_const",
+                      const="mmap",
+                      dest="read_mode",
+                      default="buffered",
+                      help="hash from memory mapped files")
+
+    # read size
+    parser.add_option("--read-size",
+                      dest="read_size",
+                      type="int",
+                      default=READ_SIZE // 1024,
+                      help="how much of a file to read at a time, in KB")
+
+    # multiple drives
+    parser.add_option("--per-device",
+                      dest="per_device",
+                      type="int",
+                      help="hash the files on each device at the same time, "
+                           "w/ this many readers per device (1 for "
+                           "spinning disks)")
+
+    # read ahead
+    parser.add_option("--read-buffers",
+                      dest="read_buffers",
+                      type="int",
+                      default=READ_BUFFERS,
+                      help="how many reads to buffer ahead of the hashing, "
+                           "0 to read and hash in turn")
+
     # output file
     parser.add_option("-o", "--outfile",
                       action="store",
@@ -305,6 +742,97 @@ if __name__ == '__main__':
                       type="abspath",
                       help="where do we save the resulting file?")
 
+    # padding
+    parser.add_option("--pad",
+                      action="store_true",
+                      dest="pad_files",
+                      default=False,
+                      help="pad files out to piece boundaries (BEP 47)")
+
+    # torrent version
+    parser.add_option("--v2",
+                      action="store_const",
+                      const="v2",
+                      dest="version",
+                      default="v1",
+                      help="create a v2 (BEP 52) only torrent")
+
+    parser.add_option("--hybrid",
+                      action="store_const",
+                      const="hybrid",
+                      dest="version",
+                      help="create a hybrid v1 + v2 torrent")
+
+    # hashing progress
+    parser.add_option("--checkpoint",
+                      action="store",
+                      dest="checkpoint",
+                      type="abspath",
+                      help="where to save hashing progress, defaults "
+                           "to the outfile + .checkpoint")
+
+    # resume
+    parser.add_option("--resume",
+                      action="store_true",
+                      dest="resume",
+                      default=False,
+                      help="pick up hashing from the last checkpoint")
+
+    # digest cache
+    parser.add_option("--cache",
+                      action="store",
+                      dest="cache",
+                      type="abspath",
+                      help="file to cache piece digests in between runs")
+
+    # piece size
+    parser.add_option("-p", "--piece-size",
+                      dest="piece_size",
+                      type="int",
+                      help="piece size in KB, picked for the data "
+                           "if not given")
+
+    parser.add_option("--target-pieces",
+                      dest="target_pieces",
+                      type="int",
+                      help="pick the piece size making about this many "
+                           "pieces")
+
+    parser.add_option("--max-torrent-size",
+                      dest="max_torrent_size",
+                      type="int",
+                      help="pick a piece size keeping the .torrent "
+                           "under this many KB")
+
+    parser.add_option("--estimate",
+                      action="store_true",
+                      dest="estimate",
+                      default=False,
+                      help="print the piece size and estimated .torrent "
+                           "size w/o hashing anything")
+
+    # progress
+    parser.add_option("--progress",
+                      dest="progress",
+                      type="choice",
+                      choices=["bar", "json"],
+                      help="show hashing progress as a bar (stderr) or "
+                           "JSON lines (stdout)")
+
+    # infohash / magnet
+    parser.add_option("--magnet",
+                      action="store_true",
+                      dest="magnet",
+                      default=False,
+                      help="print the infohash and magnet link, given "
+                           "only .torrent files just print theirs")
+
+    parser.add_option("--cache-size",
+                      dest="cache_size",
+                      type="int",
+                      default=CACHE_SIZE // (1024 * 1024),
+                      help="max size of the digest cache in MB")
+
     (options, args) = parser.parse_args()
 
     log.debug('options: %s',options)
@@ -315,14 +843,62 @@ if __name__ == '__main__':
     file_list = options.get('file_paths',[]) + args
     log.debug('file_list: %s' % file_list)
 
+    # were we handed torrents to report on rather than files to make
+    # one from? than there is nothing to hash or write
+    if options.get('magnet') and file_list and \
+       all((p.endswith('.torrent') and os.path.isfile(p) for p in file_list)):
+        for path in file_list:
+            with file(path,'rb') as fh:
+                torrent_data = fh.read()
+            v1, v2 = torrent_info_hashes(torrent_data)
+            print '%s %s' % (path, v1 or v2)
+            print torrent_magnet_link(torrent_data)
+        raise SystemExit(0)
+
     # lets make some meta data !
-    meta_creator = MetaCreator()
+    # if we are saving the torrent, save our progress along the way
+    checkpoint = options.get('checkpoint')
+    if not checkpoint and options.get('outfile'):
+        checkpoint = options.get('outfile') + '.checkpoint'
+
+    piece_size = options.get('piece_size')
+    max_torrent_size = options.get('max_torrent_size')
+    progress = None
+    if options.get('progress') == 'bar':
+        progress = ProgressBar()
+    elif options.get('progress') == 'json':
+        progress = JsonProgress()
+    meta_creator = MetaCreator(piece_size=piece_size and piece_size*1024,
+                               target_pieces=options.get('target_pieces'),
+                               max_torrent_size=max_torrent_size and
+                                                max_torrent_size*1024,
+                               workers=options.get('workers'),
+                               read_mode=options.get('read_mode'),
+                               read_size=options.get('read_size')*1024,
+                               read_buffers=options.get('read_buffers'),
+                               per_device=options.get('per_device'),
+                               checkpoint=checkpoint,
+                               resume=options.get('resume'),
+                               cache=options.get('cache'),
+                               cache_size=options.get('cache_size')*1024*1024,
+                               pad_files=options.get('pad_files'),
+                               version=options.get('version'),
+                               progress=progress)
+
+    # how big would it be?
+    if options.get('estimate'):
+        plan = meta_creator.estimate(file_list)
+        print 'piece size: %s KB' % (plan.piece_size // 1024)
+        print 'pieces: %s' % plan.piece_count
+        print 'data: %s bytes' % plan.data_size
+        print 'torrent: ~%s bytes' % plan.torrent_size
+        raise SystemExit(0)
+
     info_data = meta_creator.create_info_data(file_list)
 
-    # the info is the only non-optional data
-    meta_data = {
-        'info': info_data
-    }
+    # the info is the only non-optional data, it goes in already
+    # encoded so the rest is cheap to add
+    meta_data = meta_creator.create_meta_data()
 
     # now optional info
     optional_options = ['announce','announce_list','creation date',
@@ -342,6 +918,12 @@ if __name__ == '__main__':
     # now lets save it
     log.debug('outfile: %s',options.get('outfile'))
     if options.get('outfile'):
-        bencoded = bencode(meta_data)
+        # write it out as it's encoded, the pieces alone can be huge
         with file(options.get('outfile'),'wb') as fh:
-            fh.write(bencoded)
+            bencode_to(fh,meta_data)
+
+    # let them know what it's called
+    if options.get('magnet'):
+        print meta_creator.info_hash or meta_creator.info_hash_v2
+        print meta_creator.magnet_link([meta_data['announce']]
+                                       if meta_data.get('announce') else [])
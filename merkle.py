@@ -0,0 +1,195 @@
+"""
+BitTorrent v2 (BEP 52) hashing. each file gets it's own SHA-256 merkle
+tree over 16KiB blocks, the tree's root being the file's "pieces root"
+and the layer of the tree w/ one hash per piece being it's piece layer.
+"""
+
+from hashlib import sha256
+
+# v2 hashes the data in blocks of this size
+BLOCK_SIZE = 16 * 1024
+
+# stands in for the leaves past the end of the file
+ZERO_HASH = '\0' * 32
+
+
+def next_power_of_two(n):
+    power = 1
+    while power < n:
+        power *= 2
+    return power
+
+
+def merkle_root(hashes, leaf_count, pad_hash=ZERO_HASH):
+    """
+    returns the root of the tree whose leaves are the given hashes,
+    padded out to leaf_count (a power of two) w/ pad_hash
+    """
+    layer = list(hashes)
+    while leaf_count > 1:
+        # the padding past the end of this layer pairs off w/ itself
+        if len(layer) % 2:
+            layer.append(pad_hash)
+        layer = [sha256(layer[i] + layer[i+1]).digest()
+                 for i in xrange(0,len(layer),2)]
+        pad_hash = sha256(pad_hash + pad_hash).digest()
+        leaf_count //= 2
+    return layer[0] if layer else pad_hash
+
+
+class FileTreeHasher(object):
+    """
+    builds a file's merkle tree from it's data as it's fed in, in
+    order. only the current piece's block hashes are held on to.
+    digest returns the (pieces root, piece layer) of the file, the
+    piece layer being '' for files no bigger than one piece and the
+    root being None for empty files.
+    """
+    def __init__(self,piece_size):
+        if piece_size < BLOCK_SIZE or piece_size & (piece_size - 1):
+            raise ValueError('v2 piece size must be a power of two '
+                             'of at least %s' % BLOCK_SIZE)
+        self.piece_size = piece_size
+        self.blocks_per_piece = piece_size // BLOCK_SIZE
+
+        # the part of a block we've been fed so far
+        self.block = sha256()
+        self.block_pos = 0
+
+        self.block_hashes = []
+        self.piece_hashes = []
+        self.length = 0L
+
+    def update(self,data):
+        data_len = len(data)
+        pos = 0
+        while pos < data_len:
+            take = min(BLOCK_SIZE - self.block_pos, data_len - pos)
+            self.block.update(buffer(data,pos,take))
+            self.block_pos += take
+            pos += take
+            if self.block_pos == BLOCK_SIZE:
+                self._end_block()
+        self.length += data_len
+
+    def update_blocks(self,hashes,length):
+        """ takes in the leaf hashes of the blocks which come next,
+            worked out elsewhere (see BlockHasher). length is how much
+            data they cover, only the file's last block can be short """
+        if self.block_pos:
+            raise ValueError('blocks have to start on a block boundary')
+        for block_hash in hashes:
+            self.block_hashes.append(block_hash)
+            if len(self.block_hashes) == self.blocks_per_piece:
+                self._end_piece()
+        self.length += length
+
+    def _end_block(self):
+        self.block_hashes.append(self.block.digest())
+        self.block = sha256()
+        self.block_pos = 0
+        if len(self.block_hashes) == self.blocks_per_piece:
+            self._end_piece()
+
+    def _end_piece(self):
+        self.piece_hashes.append(merkle_root(self.block_hashes,
+                                             self.blocks_per_piece))
+        self.block_hashes = []
+
+    def digest(self):
+        if self.length == 0:
+            return None, ''
+
+        # the last block can be short
+        if self.block_pos:
+            self._end_block()
+
+        # files w/in a single piece are just a tree of their blocks
+        if not self.piece_hashes:
+            root = merkle_root(self.block_hashes,
+                               next_power_of_two(len(self.block_hashes)))
+            return root, ''
+
+        if self.block_hashes:
+            self._end_piece()
+
+        # the pieces past the end of the file are all zero leaves
+        pad_piece = merkle_root([],self.blocks_per_piece)
+        root = merkle_root(self.piece_hashes,
+                           next_power_of_two(len(self.piece_hashes)),
+                           pad_piece)
+
+        # only files bigger than a piece have a piece layer
+        if self.length <= self.piece_size:
+            return root, ''
+        return root, ''.join(self.piece_hashes)
+
+
+class BlockHasher(object):
+    """
+    works out the leaf hashes of a stretch of a file, from offset on,
+    for a FileTreeHasher to take in, eg in a pool worker hashing part
+    of a file. the blocks it only has part of, at either end of the
+    stretch, are kept as data (the file's short last block is a leaf
+    of it's own). chunks gives what to feed the FileTreeHasher, in
+    order: data to update it w/ and (hashes, length) for update_blocks.
+    """
+    def __init__(self,offset,file_size):
+        self.pos = offset
+        self.file_size = file_size
+
+        # how much of the block we start part way through is to go
+        self.head = -offset % BLOCK_SIZE
+        self.head_data = []
+
+        # the block we're in, and a copy of it's data so far
+        self.block = sha256()
+        self.block_pos = 0
+        self.block_data = []
+
+        self.leaves = []
+        self.leaves_length = 0L
+
+    def update(self,data):
+        data_len = len(data)
+        pos = 0
+        if self.head:
+            pos = min(self.head,data_len)
+            self.head_data.append(str(buffer(data,0,pos)))
+            self.head -= pos
+        while pos < data_len:
+            take = min(BLOCK_SIZE - self.block_pos, data_len - pos)
+            chunk = buffer(data,pos,take)
+            self.block.update(chunk)
+            self.block_pos += take
+            pos += take
+            if self.block_pos == BLOCK_SIZE:
+                self.leaves.append(self.block.digest())
+                self.leaves_length += BLOCK_SIZE
+                self.block = sha256()
+                self.block_pos = 0
+                self.block_data = []
+            else:
+                # the next stretch may have to finish the block
+                self.block_data.append(str(chunk))
+        self.pos += data_len
+
+    def chunks(self):
+        tail = ''
+        if self.block_pos:
+            if self.pos == self.file_size:
+                self.leaves.append(self.block.digest())
+                self.leaves_length += self.block_pos
+            else:
+                tail = ''.join(self.block_data)
+            self.block_pos = 0
+            self.block_data = []
+
+        chunks = []
+        if self.head_data:
+            chunks.append(''.join(self.head_data))
+        if self.leaves:
+            chunks.append((self.leaves,self.leaves_length))
+        if tail:
+            chunks.append(tail)
+        return chunks
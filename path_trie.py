@@ -0,0 +1,109 @@
+"""
+the files' paths (relative to the torrent) as a trie of their
+components. each distinct dir / file name is a node, decoded from the
+filesystem's encoding and encoded to UTF-8 the once however many
+files are under it, and the files' path lists share the nodes'
+strings. the files list, the v2 file tree and the check for duplicate
+paths all come from the one trie.
+"""
+
+import os
+
+from helpers import convert_unicode, bencoded_string_size, SAFE_NAME
+
+
+class PathNode(object):
+    """ a dir or file in the trie. name is it's UTF-8 name and path
+        the UTF-8 names from the top of the torrent down to it. dirs
+        have children (key'd off their raw names), files the abs path
+        of the file """
+    __slots__ = ('name', 'path', 'children', 'file_path')
+
+    def __init__(self,name,path,children=None):
+        self.name = name
+        self.path = path
+        self.children = children
+        self.file_path = None
+
+
+class PathTrie(object):
+    """
+    the trie of the files' paths. names which can't be decoded w/ the
+    encoding raise a UnicodeError, insecure names (see
+    helpers.SAFE_NAME) and paths which end up the same as (or inside
+    of) another file's raise a ValueError. so the paths of infos made
+    from the trie needn't be validated again.
+    """
+    def __init__(self,encoding='UTF-8'):
+        self.encoding = encoding
+        self.root = PathNode(None,(),{})
+
+        # the file nodes, key'd off their abs paths
+        self.files = {}
+
+    @classmethod
+    def from_paths(cls,file_paths,rel_file_base='',encoding='UTF-8'):
+        """ the trie of the paths w/ the base taken off """
+        trie = cls(encoding)
+        base = rel_file_base or ''
+        for path in file_paths:
+            rel_path = path[len(base):] if path.startswith(base) else path
+            trie.add(path,[x for x in rel_path.split(os.sep) if x.strip()])
+        return trie
+
+    def add(self,file_path,names):
+        """ adds the file w/ the given (raw) path names """
+        node = self.root
+        last = len(names) - 1
+        for i, name in enumerate(names):
+            if node.children is None:
+                raise ValueError('invalid info: duplicate path :: %s'
+                                 % file_path)
+            child = node.children.get(name)
+            if child is None:
+                encoded = convert_unicode(name,self.encoding).encode('UTF-8')
+                if not SAFE_NAME.match(encoded):
+                    raise ValueError('invalid info: insecure path dir :: %s'
+                                     % file_path)
+                child = PathNode(encoded,node.path + (encoded,),
+                                 {} if i < last else None)
+                node.children[name] = child
+            node = child
+
+        # a file can only be in the one place
+        if node.children is not None or node.file_path is not None:
+            raise ValueError('invalid info: duplicate path :: %s'
+                             % file_path)
+        node.file_path = file_path
+        self.files[file_path] = node
+        return node
+
+    def path(self,file_path):
+        """ the files list path of the file, a list of it's names """
+        return list(self.files[file_path].path)
+
+    def file_tree(self,file_info):
+        """ the v2 file tree, file_info gives the dict that goes under
+            a file's '' key from it's abs path """
+        def build(node):
+            tree = {}
+            for child in node.children.itervalues():
+                if child.children is None:
+                    tree[child.name] = {'': file_info(child.file_path)}
+                else:
+                    tree[child.name] = build(child)
+            return tree
+        return build(self.root)
+
+    def tree_size(self):
+        """ how many bytes the names in the file tree take bencoded,
+            each dir's name (and it's d..e) being there the once """
+        size = 0
+        nodes = list(self.root.children.itervalues())
+        while nodes:
+            node = nodes.pop()
+            size += bencoded_string_size(len(node.name))
+            if node.children is not None:
+                size += 2
+                nodes.extend(node.children.itervalues())
+        return size
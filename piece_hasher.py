@@ -1,15 +1,786 @@
-from helpers import determine_file_sizes
+import os
+import os.path
+import stat
+import mmap
+import time
+import logging
+from functools import partial
+from collections import OrderedDict, deque
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from helpers import determine_piece_size
+from fadvise import advise, SEQUENTIAL, NOREUSE, DONTNEED
+from layout import Layout, PadFile, count_pieces
+from merkle import FileTreeHasher, BlockHasher
+from scanner import stat_record
+from pipeline import ReadAhead, iter_file_spans, READ_BUFFERS
+from piece_table import PieceTable
 from sha import sha
+from hashlib import md5
+
+log = logging.getLogger(__name__)
+
+# how much data (roughly) each unit of parallel work covers
+BATCH_SIZE = 16 * 1024 * 1024
+
+# how much of a file we read at a time (in buffered mode), the pieces
+# are hashed out of the blocks read rather than read one by one
+READ_SIZE = 4 * 1024 * 1024
+
+# ways we can pull the files' data off the drive
+READ_MODES = ('buffered', 'mmap')
+
+# how many seconds back the recent rate / eta go by
+RATE_WINDOW = 10.0
+
+
+class FileReader(object):
+    """
+    hands out a file's data for hashing. buffered mode reads the file
+    in blocks of read_size and hands out buffers over the block, so
+    small pieces don't mean small reads. in mmap mode the file is
+    mapped and zero copy buffers over the mapping are handed out
+    instead. files which can't be mapped (empty, special) fall back to
+    buffered reads. end is how far into the file we'll be reading,
+    blocks aren't read past it (defaults to the end of the file).
+
+    the kernel is told we're reading the file once, in order, and the
+    pages we read are dropped from the cache when we're done w/ them.
+    """
+    def __init__(self,path,read_mode='buffered',read_size=READ_SIZE,
+                      end=None):
+        if read_mode not in READ_MODES:
+            raise ValueError('unknown read mode: %s' % read_mode)
+        self.path = path
+        self.fh = file(path,'rb')
+        self.mm = None
+        self.pos = 0L
+
+        # the last block we read and where in the file it's from
+        self.read_size = read_size or READ_SIZE
+        self.block = ''
+        self.block_start = 0L
+
+        # the first byte we read, the cache is dropped from there
+        self.first = None
+
+        st = os.fstat(self.fh.fileno())
+        self.end = st.st_size if end is None else min(end,st.st_size)
+
+        # how much data did we have to copy out of the file
+        self.reads = 0
+        self.bytes_copied = 0L
+
+        advise(self.fh.fileno(),0,0,SEQUENTIAL,NOREUSE)
+        if read_mode == 'mmap':
+            self.mm = self._map()
+
+    def _map(self):
+        st = os.fstat(self.fh.fileno())
+        if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+            return None
+        try:
+            return mmap.mmap(self.fh.fileno(),0,access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return None
+
+    def read(self,offset,length):
+        """ returns length bytes of the file starting @ offset """
+        if self.first is None or offset < self.first:
+            self.first = offset
+
+        if self.mm is not None:
+            # the file's shorter than when we looked, eg truncated
+            # since the scan
+            if offset + length > len(self.mm):
+                raise IOError('%s ended @ %s, expected %s bytes'
+                              % (self.path,len(self.mm),offset+length))
+            self.pos = max(self.pos,offset + length)
+            return buffer(self.mm,offset,length)
+
+        # most of the time it's already in the block
+        block_end = self.block_start + len(self.block)
+        if self.block_start <= offset and offset + length <= block_end:
+            return buffer(self.block,offset-self.block_start,length)
+
+        # the start of it is in the block, the rest is in the next one
+        if self.block_start <= offset < block_end == self.pos:
+            head = self.block[offset-self.block_start:]
+            self._read_block(block_end,length-len(head))
+            data = head + self.block[:length-len(head)]
+            self.bytes_copied += len(data)
+            return data
+
+        self._read_block(offset,length)
+        return buffer(self.block,0,length)
+
+    def _read_block(self,offset,length):
+        """ reads the block starting @ offset, at least length long """
+        if offset != self.pos:
+            self.fh.seek(offset)
+        size = max(length, min(self.read_size, self.end - offset))
+        self.block = self.fh.read(size)
+        self.block_start = offset
+        self.pos = offset + len(self.block)
+        self.reads += 1
+        self.bytes_copied += len(self.block)
+        if len(self.block) < length:
+            raise IOError('%s ended @ %s, expected %s bytes'
+                          % (self.path,self.pos,offset+length))
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.block = ''
+
+        # we won't be back for what we read, leave room for others
+        if self.first is not None and self.pos > self.first:
+            advise(self.fh.fileno(),self.first,self.pos-self.first,
+                   DONTNEED)
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+class FileSource(object):
+    """
+    hands out the data of the pieces' segments from FileReaders, only
+    keeping the one file open. end_of gives how far into a file we'll
+    be reading, if we know. same iter_read as pipeline.ReadAhead.
+    """
+    def __init__(self,read_mode='buffered',read_size=READ_SIZE,end_of=None):
+        self.read_mode = read_mode
+        self.read_size = read_size
+        self.end_of = end_of
+        self.reader = None
+        self.path = None
+
+        # totals of the readers we've closed
+        self.reads = 0
+        self.bytes_copied = 0L
+
+    def iter_read(self,path,offset,length):
+        """ yields the length bytes of the file from offset """
+        # segments come in file order, only keep one file open
+        if path != self.path:
+            self.close()
+            end = self.end_of(path) if self.end_of else None
+            self.reader = FileReader(path,self.read_mode,self.read_size,end)
+            self.path = path
+        yield self.reader.read(offset,length)
+
+    def close(self):
+        if self.reader:
+            self.reader.close()
+            self.reads += self.reader.reads
+            self.bytes_copied += self.reader.bytes_copied
+            self.reader = None
+            self.path = None
+
+
+# shared source of padding data
+_zeros = ''
+
+def zeros(length):
+    """ returns a buffer of length zero bytes """
+    global _zeros
+    if len(_zeros) < length:
+        _zeros = '\0' * length
+    return buffer(_zeros,0,length)
+
+
+class HashStats(object):
+    """
+    running totals of the work a hasher has done. read time is the
+    time spent getting the data out of the files and hash time the
+    time spent running it through the hashes. in mmap mode the data
+    is only paged in as it's hashed, so it's read time shows up as
+    hash time.
+    """
+    def __init__(self):
+        # how many strings / how much data we had to copy
+        # out of the files
+        self.reads = 0
+        self.bytes_copied = 0L
+
+        # how much data we hashed, and how long it took
+        self.bytes_read = 0L
+        self.read_time = 0.0
+        self.hash_time = 0.0
+
+        # seconds spent on each file
+        self.file_times = {}
+
+        # how many pieces there are, how many we hashed and how many
+        # we got from earlier runs
+        self.piece_count = 0
+        self.pieces_hashed = 0
+        self.pieces_reused = 0
+
+        # how much data there is to go through, are we through it?
+        self.total_size = 0L
+        self.finished = False
+
+        self.started = time.time()
+
+        # (time, bytes read, fraction) as of the last few looks at how
+        # we're doing, for the recent rate
+        self.samples = deque([(self.started, 0L, 0.0)])
+
+    def add_reader(self,reader):
+        self.reads += reader.reads
+        self.bytes_copied += reader.bytes_copied
+
+    def add_segment(self,path,length,read_time,hash_time):
+        """ takes note of a stretch of a file being hashed """
+        self.bytes_read += length
+        self.read_time += read_time
+        self.hash_time += hash_time
+        self.file_times[path] = self.file_times.get(path,0.0) \
+                                + read_time + hash_time
+
+    def merge(self,other):
+        """ adds in the totals of other (eg from a pool worker) """
+        self.reads += other.reads
+        self.bytes_copied += other.bytes_copied
+        self.bytes_read += other.bytes_read
+        self.read_time += other.read_time
+        self.hash_time += other.hash_time
+        self.pieces_hashed += other.pieces_hashed
+        for path, seconds in other.file_times.iteritems():
+            self.file_times[path] = self.file_times.get(path,0.0) + seconds
+
+    @property
+    def pieces_done(self):
+        return self.pieces_hashed + self.pieces_reused
+
+    @property
+    def fraction(self):
+        """ how far along we are, by piece (by data w/o v1 pieces) """
+        if self.finished:
+            return 1.0
+        if self.piece_count:
+            return float(self.pieces_done) / self.piece_count
+        if self.total_size:
+            return min(1.0, float(self.bytes_read) / self.total_size)
+        return 0.0
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def rate(self):
+        """ MB/s read since we started """
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.bytes_read / elapsed / (1024 * 1024)
+
+    def sample(self):
+        """ takes note of how far we've got, returns the oldest and
+            newest notes in the last RATE_WINDOW seconds """
+        now = time.time()
+        samples = self.samples
+        samples.append((now, self.bytes_read, self.fraction))
+        # keep the last note from before the window, so it's full
+        while len(samples) > 2 and samples[1][0] <= now - RATE_WINDOW:
+            samples.popleft()
+        return samples[0], samples[-1]
+
+    @property
+    def recent_rate(self):
+        """ MB/s read over the last RATE_WINDOW seconds """
+        (start, start_read, _), (end, end_read, _) = self.sample()
+        if end <= start:
+            return self.rate
+        return (end_read - start_read) / (end - start) / (1024 * 1024)
+
+    @property
+    def eta(self):
+        """ seconds left going at the recent rate, None if we can't
+            tell (not started / done / stalled) """
+        (start, _, start_done), (end, _, done) = self.sample()
+        if not 0 < done < 1 or done <= start_done or end <= start:
+            return None
+        return (1 - done) * (end - start) / (done - start_done)
+
+    def as_dict(self):
+        return {
+            'bytes_read': self.bytes_read,
+            'bytes_copied': self.bytes_copied,
+            'reads': self.reads,
+            'pieces': self.piece_count,
+            'pieces_done': self.pieces_done,
+            'pieces_hashed': self.pieces_hashed,
+            'pieces_reused': self.pieces_reused,
+            'read_time': round(self.read_time,6),
+            'hash_time': round(self.hash_time,6),
+            'elapsed': round(self.elapsed,6),
+            'mb_per_sec': round(self.rate,3),
+            'recent_mb_per_sec': round(self.recent_rate,3),
+            'eta': round(self.eta,3) if self.eta is not None else None,
+            'fraction': round(self.fraction,6),
+            'finished': self.finished,
+        }
+
+
+class FileSums(object):
+    """
+    runs the files' data through a hash from each of the file_hashes'
+    factories as it's read, in order. each file which is seen from
+    beginning to end gets it's digests put in the results under it's
+    path. see iter_piece_digests for file_hashes.
+    """
+    def __init__(self,file_hashes,file_sizes):
+        self.file_hashes = file_hashes
+        self.file_sizes = file_sizes
+
+        # the file we're in, it's hashes and how far into it we are
+        self.path = None
+        self.sums = []
+        self.pos = 0L
+
+    def begin(self,path,offset):
+        """ the data which follows is the file's from offset on """
+        if path == self.path and offset == self.pos:
+            return
+        # we can only hash the files we see all of
+        self.path = path
+        self.pos = offset
+        self.sums = []
+        if offset == 0 and self.file_hashes:
+            self.sums = [(new_hash(), results)
+                         for new_hash, results in self.file_hashes]
+
+    def update(self,data):
+        if not self.sums:
+            return
+        for file_sum, results in self.sums:
+            if file_sum is not None:
+                file_sum.update(data)
+        self._advance(len(data))
+
+    def add_part(self,path,offset,length,digests,chunks):
+        """ takes in a part of a file worked out by a BatchSums, see
+            BatchSums.end """
+        if digests is not None:
+            for (new_hash, results), digest in zip(self.file_hashes,digests):
+                results[path] = digest
+            self.path = None
+            self.sums = []
+            return
+
+        self.begin(path,offset)
+        if not self.sums:
+            return
+        sums = []
+        for (file_sum, results), file_chunks in zip(self.sums,chunks):
+            # we didn't get all of the file, it's read again after
+            if file_chunks is None:
+                file_sum = None
+            elif file_sum is not None:
+                for chunk in file_chunks:
+                    if isinstance(chunk,tuple):
+                        file_sum.update_blocks(*chunk)
+                    else:
+                        file_sum.update(chunk)
+            sums.append((file_sum, results))
+        self.sums = sums
+        self._advance(length)
+
+    def _advance(self,length):
+        self.pos += length
+        if self.pos == self.file_sizes[self.path]:
+            for file_sum, results in self.sums:
+                if file_sum is not None:
+                    results[self.path] = file_sum.digest()
+            self.sums = []
+
+
+def splits(new_hash):
+    """ can the hash be worked out a part of a file at a time, ie is
+        it a v2 tree """
+    return hasattr(new_hash(),'update_blocks')
+
+
+class DataCopy(object):
+    """ stands in for a hash which can't be split up (md5) in a
+        BatchSums, keeping a copy of the data for it """
+    def __init__(self):
+        self.data = []
+
+    def update(self,data):
+        self.data.append(str(data))
+
+    def chunks(self):
+        return self.data
+
+
+class BatchSums(object):
+    """
+    the files' own hashes from the reads of a batch of pieces, in a
+    pool worker. files the batch has all of are hashed here and their
+    digests handed back. of those it only has part of, v2 trees get
+    their leaf hashes worked out here (see merkle.BlockHasher) but
+    md5s can't be split up, their data is copied out of the reads w/
+    copy and otherwise left to be read again. file_sizes and lengths
+    are the sizes of the batch's files and how much of them it reads.
+    parts is what's handed back, see end.
+    """
+    def __init__(self,new_hashes,file_sizes,lengths,copy=False):
+        self.new_hashes = new_hashes
+        self.file_sizes = file_sizes
+        self.lengths = lengths
+        self.copy = copy
+        self.parts = []
+
+        # the stretch of the file we're in
+        self.path = None
+        self.offset = 0L
+        self.length = 0L
+        self.sums = None
+        self.whole = False
+
+    def begin(self,path,offset):
+        """ the data which follows is the file's from offset on """
+        if path == self.path and offset == self.offset + self.length:
+            return
+        self.end()
+        size = self.file_sizes[path]
+        self.path = path
+        self.offset = offset
+        self.length = 0L
+        self.whole = offset == 0 and self.lengths[path] == size
+        if self.whole:
+            self.sums = [new_hash() for new_hash in self.new_hashes]
+            return
+        self.sums = []
+        for new_hash in self.new_hashes:
+            if splits(new_hash):
+                self.sums.append(BlockHasher(offset,size))
+            elif self.copy:
+                self.sums.append(DataCopy())
+            else:
+                self.sums.append(None)
+
+    def update(self,data):
+        for file_sum in self.sums:
+            if file_sum is not None:
+                file_sum.update(data)
+        self.length += len(data)
+
+    def end(self):
+        """ ends the stretch we're in, adding it's (path, offset,
+            length, digests, chunks) to the parts. digests are those
+            of a whole file, otherwise chunks has each hash's data /
+            leaves to feed it (see BlockHasher), None where it has to
+            be read again """
+        if self.path is None:
+            return
+        digests = chunks = None
+        if self.whole:
+            digests = [file_sum.digest() for file_sum in self.sums]
+        else:
+            chunks = [file_sum.chunks() if file_sum is not None else None
+                      for file_sum in self.sums]
+        self.parts.append((self.path,self.offset,self.length,digests,
+                           chunks))
+        self.path = None
+        self.sums = None
+
+
+def iter_piece_digests(layout, start=0, stop=None, read_mode='buffered',
+                       file_hashes=(), stats=None, read_size=READ_SIZE,
+                       read_buffers=0):
+    """
+    hashes the pieces from start up to stop, reading through the
+    layout's files in order, yielding (piece index, digest). file_hashes is a
+    list of (hash factory, results dict) pairs, each file which is
+    read from beginning to end is also run through a hash from each
+    factory w/ the digest put in the results under the file's path.
+    given read_buffers (and buffered reads) the files are read ahead
+    into that many buffers by a thread while we hash, see pipeline.
+    """
+    if read_buffers and read_mode == 'buffered':
+        spans = iter_file_spans(layout.iter_segments(start,stop),PadFile)
+        source = ReadAhead(spans,read_size,read_buffers)
+    else:
+        # where the data we're hashing ends, the files aren't read past it
+        end_of = None
+        if stop is not None:
+            data_end = stop * layout.piece_size
+            end_of = lambda path: data_end - layout.offset(path)
+        source = FileSource(read_mode,read_size,end_of)
+
+    index = start
+    file_sums = FileSums(file_hashes,layout.file_sizes)
+    try:
+        for segments in layout.iter_segments(start,stop):
+            sh = sha()
+            for path, offset, length in segments:
+                # padding is never read
+                if isinstance(path,PadFile):
+                    sh.update(zeros(length))
+                    continue
+
+                file_sums.begin(path,offset)
+                read_time = hash_time = 0.0
+                read_start = time.time()
+                for data in source.iter_read(path,offset,length):
+                    hash_start = time.time()
+                    sh.update(data)
+
+                    # the file's hashes come from the same reads as the pieces
+                    file_sums.update(data)
+
+                    hash_end = time.time()
+                    read_time += hash_start - read_start
+                    hash_time += hash_end - hash_start
+                    read_start = hash_end
+
+                if stats:
+                    stats.add_segment(path,length,read_time,hash_time)
+
+            if stats:
+                stats.pieces_hashed += 1
+            yield index, sh.digest()
+            index += 1
+    finally:
+        source.close()
+        if stats:
+            stats.add_reader(source)
+
+
+def hash_file(path, new_hashes, read_mode='buffered', stats=None,
+              read_size=READ_SIZE):
+    """
+    runs the whole file through a hash from each of the factories,
+    returning their digests
+    """
+    hashes = [new_hash() for new_hash in new_hashes]
+    file_size = os.path.getsize(path)
+    with FileReader(path,read_mode,read_size) as reader:
+        file_pos = 0L
+        while file_pos < file_size:
+            read_start = time.time()
+            data = reader.read(file_pos,min(reader.read_size,
+                                            file_size-file_pos))
+            hash_start = time.time()
+            for file_sum in hashes:
+                file_sum.update(data)
+            file_pos += len(data)
+            if stats:
+                stats.add_segment(path,len(data),hash_start-read_start,
+                                  time.time()-hash_start)
+    if stats:
+        stats.add_reader(reader)
+    return [file_sum.digest() for file_sum in hashes]
+
+
+def hash_file_job(job):
+    """ hash_file for a (path, hash factories, read mode, read size)
+        job, module level so it can be handed off to a process pool.
+        returns the digests and the HashStats of the work """
+    path, new_hashes, read_mode, read_size = job
+    stats = HashStats()
+    return hash_file(path,new_hashes,read_mode,stats,read_size), stats
+
+
+def iter_file_jobs(file_paths, file_hashes):
+    """
+    yields (path, hash factories, results dicts) for the files that
+    are missing from some of the file_hashes' results
+    """
+    for path in file_paths:
+        if isinstance(path,PadFile):
+            continue
+        missing = [(new_hash, results) for new_hash, results in file_hashes
+                   if path not in results]
+        if missing:
+            new_hashes, results = zip(*missing)
+            yield path, new_hashes, results
+
+
+def reusable_pieces(old_files, new_files, piece_size):
+    """
+    works out which pieces hashed for old_files are still good for
+    new_files, both being ordered lists of (path, size, mtime). pieces
+    before the first file which was added, removed or changed size
+    line up and are kept, less those overlapping files modified in
+    place. returns the list of piece indexes which can be reused.
+    """
+    stable_size = 0L
+    invalid = set()
+    same = 0
+    for (old_path, old_size, old_mtime), (path, size, mtime) \
+            in zip(old_files,new_files):
+        if (old_path, old_size) != (path, size):
+            break
+
+        # a changed file only spoils the pieces it overlaps
+        if old_mtime != mtime and size:
+            first = stable_size // piece_size
+            last = (stable_size + size - 1) // piece_size
+            invalid.update(xrange(first,last+1))
+
+        stable_size += size
+        same += 1
+
+    # the last piece can only be kept if nothing came after it
+    if same == len(old_files) == len(new_files):
+        limit = count_pieces(stable_size,piece_size)
+    else:
+        limit = int(stable_size // piece_size)
+
+    return [i for i in xrange(limit) if i not in invalid]
+
+
+def iter_missing_runs(pieces):
+    """ yields the (start, stop) index ranges of the pieces not yet
+        known, pieces being a PieceTable """
+    return pieces.iter_missing_runs()
+
+
+def iter_batches(iterable, batch_len):
+    """ groups the iterable's items into lists of batch_len """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_len:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def batch_ends(batch):
+    """ how far into each file the batch of pieces goes """
+    ends = {}
+    for index, segments in batch:
+        for path, offset, length in segments:
+            ends[path] = offset + length
+    return ends
+
+
+def batch_lengths(batch):
+    """ how much of each file the batch of pieces reads, which isn't
+        all of the file between it's first and last piece if pieces
+        we already have were left out """
+    lengths = {}
+    for index, segments in batch:
+        for path, offset, length in segments:
+            lengths[path] = lengths.get(path,0) + length
+    return lengths
+
+
+def hash_piece_batch(batch,read_mode='buffered',stats=None,
+                     read_size=READ_SIZE,table=None,file_sums=None):
+    """
+    returns the (piece index, digest) pairs for a batch of pieces,
+    each piece being a (piece index, list of (path, offset, length)
+    segments) pair. module level so that it can be handed off to a
+    process pool. given a PieceTable (in a thread) the digests go
+    strait into it instead. given file_sums (a BatchSums) what's read
+    is run through it too, for the files' own hashes.
+    """
+    # the files aren't read past where the batch ends in them
+    digests = []
+    source = FileSource(read_mode,read_size,batch_ends(batch).get)
+    try:
+        for index, segments in batch:
+            sh = sha()
+            for path, offset, length in segments:
+                # padding is never read
+                if isinstance(path,PadFile):
+                    sh.update(zeros(length))
+                    continue
+
+                if file_sums is not None:
+                    file_sums.begin(path,offset)
+                read_start = time.time()
+                for data in source.iter_read(path,offset,length):
+                    hash_start = time.time()
+                    sh.update(data)
+                    if file_sums is not None:
+                        file_sums.update(data)
+                if stats:
+                    stats.add_segment(path,length,hash_start-read_start,
+                                      time.time()-hash_start)
+            if table is not None:
+                table[index] = sh.digest()
+            else:
+                digests.append((index,sh.digest()))
+            if stats:
+                stats.pieces_hashed += 1
+    finally:
+        source.close()
+        if stats:
+            stats.add_reader(source)
+    if file_sums is not None:
+        file_sums.end()
+    return digests
+
+
+def hash_piece_batch_job(job,read_mode='buffered',read_size=READ_SIZE,
+                         table=None,new_hashes=(),copy=False):
+    """
+    hash_piece_batch for the pool, job being the batch and the sizes
+    of it's files (for the files' own hashes, from the hash factories
+    new_hashes, see BatchSums). returns the digests, the HashStats of
+    the work and the parts of the files' hashes for FileSums.add_part
+    """
+    batch, file_sizes = job
+    stats = HashStats()
+    file_sums = None
+    if new_hashes:
+        file_sums = BatchSums(new_hashes,file_sizes,batch_lengths(batch),
+                              copy)
+    digests = hash_piece_batch(batch,read_mode,stats,read_size,table,
+                               file_sums)
+    return digests, stats, file_sums.parts if file_sums else None
+
+
+def iter_batch_jobs(batches,file_sizes=None):
+    """ the (batch, sizes of it's files) jobs for hash_piece_batch_job,
+        w/o file_sizes there are no sizes to give """
+    for batch in batches:
+        sizes = None
+        if file_sizes is not None:
+            sizes = dict(( (path, file_sizes[path])
+                           for index, segments in batch
+                           for path, offset, length in segments
+                           if not isinstance(path,PadFile)))
+        yield batch, sizes
+
+
+def iter_ahead(pool,func,jobs,limit):
+    """ pool.imap, but w/ no more than limit jobs handed out ahead
+        of the one we're waiting on, so their results can't pile up """
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.apply_async(func,(job,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
 
 class PieceHasher(object):
     """
     generates "pieces" hash
     """
-    def add(self):
+    def add(self,path):
         """ add a file to be included """
         pass
 
-    def remove(self):
+    def remove(self,path):
         """ remove an already included file """
         pass
 
@@ -20,10 +791,58 @@ class PieceHasher(object):
 class StraitPieceHasher(PieceHasher):
     """
     will generate a pieces hash for the given files. nothing fancy.
+    the files are hashed in the order they were given / added. after
+    files are added or removed, digesting again only rehashes the
+    pieces from the first changed file on. w/ pad_files each file is
+    followed by enough (BEP 47) padding to start the next one on a
+    piece boundary.
     """
-    def __init__(self,paths=[]):
-        # lookup of file data key'd off abs path
-        self.files = dict(( (p, None) for p in paths))
+    def __init__(self,paths=[],read_mode='buffered',checkpoint=None,
+                      cache=None,pad_files=False,progress=None,
+                      read_size=READ_SIZE,read_buffers=READ_BUFFERS):
+        # lookup of file data key'd off abs path, in hashing order.
+        # the data is the file's scanner.FileRecord, if we have it
+        self.files = OrderedDict(( (p, None) for p in paths))
+
+        # md5 digests of the files, filled in by digest if asked
+        self.md5sums = {}
+
+        # buffered or mmap, see FileReader
+        self.read_mode = read_mode
+
+        # how much of a file we read at a time, see FileReader
+        self.read_size = read_size
+
+        # how many read_size buffers a thread reads ahead into while
+        # we hash, 0 reads and hashes in turn. see pipeline
+        self.read_buffers = read_buffers
+
+        # where we save our progress, see checkpoint.Checkpoint
+        self.checkpoint = checkpoint
+
+        # digests from earlier runs over the same files, see cache.PieceCache
+        self.cache = cache
+
+        # should the files be padded out to piece boundaries?
+        self.pad_files = pad_files
+
+        # what the last digest cost us
+        self.stats = HashStats()
+
+        # called w/ the stats as pieces / files get hashed
+        self.progress = progress
+
+        # the layout of the last digest, see layout.Layout
+        self.layout = None
+
+        # what the last digest hashed, the (path, size, mtime) of
+        # the files, piece size and digests
+        self.last_files = []
+        self.last_piece_size = None
+        self.last_pieces = PieceTable(0)
+
+        # v2 merkle trees of the files, filled in by digest if asked
+        self.trees = {}
 
     def add(self,path):
         """
@@ -33,7 +852,7 @@ class StraitPieceHasher(PieceHasher):
         self.files[path] = None
         return True
 
-    def remove(self):
+    def remove(self,path):
         """
         will remove path from those to be hashed
         """
@@ -43,76 +862,292 @@ class StraitPieceHasher(PieceHasher):
             return True
         return False
 
-    def digest(self,piece_size=None):
+    def set_paths(self,paths):
+        """
+        replaces the files to be hashed, in order. what was learned
+        from the last digest is kept.
+        """
+        self.files = OrderedDict(( (p, None) for p in paths))
+
+    def set_records(self,records):
+        """
+        replaces the files to be hashed w/ those of the (scanner)
+        records, in order. their sizes / mtimes are taken from the
+        records rather than stat'ing the files again.
+        """
+        self.files = OrderedDict(( (r.path, r) for r in records))
+
+    def file_records(self,paths=None):
+        """ the records of the files (or the given paths), stat'ing
+            those we don't have """
+        if paths is None:
+            paths = self.files.iterkeys()
+        return [self.files.get(path) or stat_record(path)
+                for path in paths]
+
+    def plan_layout(self,piece_size=None):
+        """ lays our files out in the order they were given, w/ the
+            given piece size (or one picked for their total size) """
+        records = self.file_records()
+        file_sizes = dict(( (r.path, r.size) for r in records))
+        if not piece_size:
+            piece_size = determine_piece_size(sum(file_sizes.itervalues()))
+        return Layout([r.path for r in records],file_sizes,piece_size,
+                      self.pad_files)
+
+    def digest(self,piece_size=None,create_md5=False,v1=True,v2=False,
+                    layout=None):
+        """
+        returns the (v1) pieces, the bytearray of the PieceTable they
+        were hashed into (it's not touched again), not a string. it's
+        handed on as is (eg as the info's pieces, see MetaCreator's
+        create_info_data) so changing it changes those too. if asked,
+        the files' md5s and v2 merkle trees ((pieces root, piece
+        layer) pairs) are made from the same reads and left in md5sums
+        and trees. given a layout, it's files are what's hashed, in
+        it's order.
+        """
         # we are going strait up and down with this
 
         # fill in our datas
-        file_paths = self.files.keys()
-        file_sizes = determine_file_sizes(file_paths)
-        total_size = sum(file_sizes.itervalues())
-        piece_size = piece_size or determine_piece_size(total_size)
+        if layout is None:
+            layout = self.plan_layout(piece_size)
+        self.layout = layout
+        piece_size = layout.piece_size
+        file_paths = layout.file_paths
+        layout_paths = layout.paths
+        file_sizes = layout.file_sizes
+        self.stats = HashStats()
+
+        # the files as they are before we read them, what they're
+        # cached / checkpointed as
+        records = dict(( (r.path, r)
+                         for r in self.file_records(file_paths)))
+        files = [(path, file_sizes.get(path),
+                  records[path].mtime if path in records else 0)
+                 for path in layout_paths]
+
+        # the digests we know, in piece order
+        pieces = PieceTable(layout.piece_count if v1 else 0)
+
+        # the per file hashes we want
+        md5sums = {} if create_md5 else None
+        trees = {} if v2 else None
+        file_hashes = []
+        if create_md5:
+            file_hashes.append((md5,md5sums))
+        if v2:
+            file_hashes.append((partial(FileTreeHasher,piece_size),trees))
+
+        # pick up what earlier runs already hashed
+        if self.last_piece_size == piece_size:
+            self.reuse_last(files,pieces,md5sums,trees)
+        if self.cache:
+            self.cache.restore(layout_paths,file_sizes,piece_size,
+                               pieces,md5sums,records)
+        if self.checkpoint and v1:
+            self.checkpoint.begin(files,piece_size)
+            self.checkpoint.restore(pieces)
+        self.stats.piece_count = len(pieces)
+        self.stats.pieces_reused = len(pieces) - pieces.missing
+        self.stats.total_size = layout.total_size
+        self.report()
 
         # now we go through the files data concatenated end to end
-        # hashing pieces along the way
-        data_pos = 0L
-        pieces = []
-        piece_pos = 0L
-        sh = sha()
-        for path in file_paths:
-            # pull this file's size
-            file_size = file_sizes.get(path)
-
-            # keep track of our pos w/in the file
-            file_pos = 0L
-
-            # open the file
-            with file(path,'rb') as fh:
-                # loop through the files data
-                while file_pos < file_size:
-                    # b/c we might hit the end of the file or
-                    # the end of a piece
-                    # we don't just want to read a while piece
-                    read_len = min(file_size-file_pos,piece_size-piece_pos)
-                    data = fh.read(read_len)
-                    sh.update(data)
+        # hashing the pieces we're missing along the way
+        if v1:
+            self.hash_pieces(layout,pieces,file_hashes)
 
-                    # update our positions
-                    file_pos += read_len
-                    data_pos += read_len
-                    piece_pos += read_len
+        # the files we didn't read all of still need their own hashes
+        self.hash_files(file_paths,file_hashes)
 
-                    # if we hit the end of a piece hash our data collected
-                    if piece_pos == piece_size:
-                        pieces.append(sh.digest())
-                        piece_pos = 0L
+        if self.cache:
+            self.cache.store(layout_paths,file_sizes,piece_size,
+                             pieces,md5sums,records)
 
+        # hang on to what we did for next time
+        self.last_files = files
+        self.last_piece_size = piece_size
+        self.last_pieces = pieces
+        self.md5sums = md5sums or {}
+        self.trees = trees or {}
 
-        # if we finished w/ some data left over add it
-        if piece_pos > 0:
-            pieces.append(sh.digest())
+        # we're done, no need to keep our progress around
+        if self.checkpoint and v1:
+            self.checkpoint.remove()
+        self.stats.finished = True
+        self.report()
 
-        return ''.join(pieces)
+        return pieces.data
 
+    def report(self):
+        """ lets whoever is watching know how we're doing """
+        if self.progress:
+            self.progress(self.stats)
 
+    def reuse_last(self,files,pieces,md5sums=None,trees=None):
+        """ fills in the pieces (and md5s / trees) from the last digest
+            which are still good, returns how many pieces were filled in """
+        reused = 0
+        if pieces:
+            for index in reusable_pieces(self.last_files,files,
+                                         self.last_piece_size):
+                if index >= len(self.last_pieces):
+                    break
+                digest = self.last_pieces[index]
+                if digest is not None:
+                    pieces[index] = digest
+                    reused += 1
 
+        # unchanged files keep their md5s and trees
+        unchanged = set(self.last_files)
+        for results, last_results in ((md5sums, self.md5sums),
+                                      (trees, self.trees)):
+            if results is None:
+                continue
+            for path, size, mtime in files:
+                if (path, size, mtime) in unchanged \
+                   and path in last_results:
+                    results[path] = last_results[path]
 
+        return reused
 
+    def hash_pieces(self,layout,pieces,file_hashes=()):
+        """ fills in the missing digests of the pieces list """
+        for start, stop in list(iter_missing_runs(pieces)):
+            for index, digest in iter_piece_digests(layout,start,stop,
+                                                    self.read_mode,
+                                                    file_hashes,
+                                                    self.stats,
+                                                    self.read_size,
+                                                    self.read_buffers):
+                pieces[index] = digest
+                if self.checkpoint:
+                    self.checkpoint.update(pieces)
+                self.report()
+
+    def hash_files(self,file_paths,file_hashes=()):
+        """ fills in the file_hashes' results the pieces didn't """
+        for path, new_hashes, results in iter_file_jobs(file_paths,
+                                                        file_hashes):
+            digests = hash_file(path,new_hashes,self.read_mode,self.stats,
+                                self.read_size)
+            for result, digest in zip(results,digests):
+                result[path] = digest
+            self.report()
+
+
+class ParallelPieceHasher(StraitPieceHasher):
+    """
+    generates the same pieces hash as the strait hasher, but splits
+    the data into piece aligned batches which are hashed by a pool
+    of workers. the digests are put back together in piece order.
+    md5s and v2 merkle trees can't be split up by piece, w/ a thread
+    pool they're made from the batches' data as it comes back in
+    order. w/ a process pool (or for the files the batches didn't
+    read all of) they're made by the pool as well, a whole file per
+    job, each from it's own read of the file.
+    """
+    def __init__(self,paths=[],workers=None,use_processes=False,
+                      read_mode='buffered',checkpoint=None,cache=None,
+                      pad_files=False,pool=None,progress=None,
+                      read_size=READ_SIZE):
+        StraitPieceHasher.__init__(self,paths,read_mode,checkpoint,cache,
+                                   pad_files,progress,read_size)
 
+        # how many workers? default to one per cpu
+        self.workers = workers or cpu_count()
 
+        # sha releases the GIL so threads are usually enough
+        self.use_processes = use_processes
 
+        # a pool shared w/ others, it's left open when we're done
+        # rather than us making (and closing) our own each time
+        self.pool = pool
 
+    def hash_pieces(self,layout,pieces,file_hashes=()):
+        """ fills in the missing digests of the pieces list """
 
+        # each worker gets a run of whole pieces to hash, the layout's
+        # offsets take each run strait to it's first file
+        def iter_missing():
+            for start, stop in list(iter_missing_runs(pieces)):
+                segments = layout.iter_segments(start,stop)
+                for index, piece_segments in enumerate(segments,start):
+                    yield index, piece_segments
 
+        batch_len = max(1, BATCH_SIZE // layout.piece_size)
+        batches = iter_batches(iter_missing(),batch_len)
 
+        pool = self.create_pool()
+        threads = isinstance(pool,ThreadPool)
 
+        # the workers work out the files' hashes (v2 trees' leaves)
+        # from their reads, all but the md5s of files split between
+        # batches, those need the data in order. w/ threads we're
+        # handed a copy of it, process pools leave them to be read again
+        new_hashes = [new_hash for new_hash, results in file_hashes]
+        copy = any((not splits(new_hash) for new_hash in new_hashes))
+        if copy and not threads:
+            log.warning('md5s of files split between batches are read '
+                        'again w/ a process pool')
+        copy = copy and threads
+        jobs = iter_batch_jobs(batches,
+                               layout.file_sizes if new_hashes else None)
+        try:
+            # imap hands back results in the order they went in. pool
+            # threads put their digests strait into the table
+            hash_batch = partial(hash_piece_batch_job,
+                                 read_mode=self.read_mode,
+                                 read_size=self.read_size,
+                                 table=pieces if threads else None,
+                                 new_hashes=new_hashes,
+                                 copy=copy)
+            if copy:
+                # the copied data waits on us, only so much of it at once
+                results = iter_ahead(pool,hash_batch,jobs,
+                                     self.workers * 2)
+            else:
+                results = pool.imap(hash_batch, jobs)
+            file_sums = FileSums(file_hashes,layout.file_sizes)
+            for digests, stats, parts in results:
+                for index, digest in digests:
+                    pieces[index] = digest
+                for part in parts or ():
+                    file_sums.add_part(*part)
+                if self.checkpoint:
+                    self.checkpoint.update(pieces)
+                self.stats.merge(stats)
+                self.report()
+        finally:
+            self.release_pool(pool)
 
+    def hash_files(self,file_paths,file_hashes=()):
+        """ fills in the file_hashes' results, a file per job """
+        jobs = list(iter_file_jobs(file_paths,file_hashes))
+        if not jobs:
+            return
 
-        # we are going to fill out the info for the files
-        # we don't have info for
-        for path, info in self.files.iteritems():
-            # first check and see if we have the size
-            # we need to be sure to include 0 size files
-            if info.get('size') is None:
-                info['size'] = os.path.getsize(path)
+        pool = self.create_pool()
+        try:
+            work = [(path, new_hashes, self.read_mode, self.read_size)
+                    for path, new_hashes, results in jobs]
+            for (path, new_hashes, results), (digests, stats) \
+                    in zip(jobs,pool.imap(hash_file_job,work)):
+                for result, digest in zip(results,digests):
+                    result[path] = digest
+                self.stats.merge(stats)
+                self.report()
+        finally:
+            self.release_pool(pool)
 
+    def create_pool(self):
+        if self.pool is not None:
+            return self.pool
+        pool_type = Pool if self.use_processes else ThreadPool
+        return pool_type(self.workers)
 
+    def release_pool(self,pool):
+        if pool is not self.pool:
+            pool.close()
+            pool.join()
@@ -0,0 +1,74 @@
+"""
+the pieces' digests, in a single preallocated bytearray rather than a
+string per piece in a list. a torrent w/ millions of pieces would
+otherwise have millions of little string objects hanging around, and
+have to join them all up at the end. the table's data is what ends up
+in the info's pieces as is.
+"""
+
+DIGEST_SIZE = 20
+
+
+class PieceTable(object):
+    """
+    the digests of count pieces, indexed by piece. pieces we don't
+    know yet are None when asked for (and all zeros in the data).
+    pool threads can each set their own pieces at the same time.
+    """
+    def __init__(self,count):
+        self.data = bytearray(count * DIGEST_SIZE)
+
+        # a byte per piece, set once we know it's digest
+        self.known = bytearray(count)
+
+    def __len__(self):
+        return len(self.known)
+
+    def __getitem__(self,index):
+        if not self.known[index]:
+            return None
+        start = index * DIGEST_SIZE
+        return str(self.data[start:start+DIGEST_SIZE])
+
+    def __setitem__(self,index,digest):
+        start = index * DIGEST_SIZE
+        self.data[start:start+DIGEST_SIZE] = digest
+        self.known[index] = 1
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def set_run(self,start,digests):
+        """ sets the pieces from start on to the joined up digests """
+        count = len(digests) // DIGEST_SIZE
+        self.data[start*DIGEST_SIZE:(start+count)*DIGEST_SIZE] = digests
+        self.known[start:start+count] = '\1' * count
+
+    @property
+    def missing(self):
+        """ how many pieces we don't know yet """
+        return self.known.count('\0')
+
+    def has_run(self,start,stop):
+        """ do we know all the pieces from start up to stop? """
+        return self.known.find('\0',start,stop) == -1
+
+    def digests(self,start=0,stop=None):
+        """ the joined up digests from start up to stop """
+        if stop is None:
+            stop = len(self)
+        return str(self.data[start*DIGEST_SIZE:stop*DIGEST_SIZE])
+
+    def iter_missing_runs(self):
+        """ yields the (start, stop) index ranges of the pieces we don't
+            know yet """
+        known = self.known
+        count = len(known)
+        start = known.find('\0')
+        while start != -1:
+            stop = known.find('\1',start)
+            if stop == -1:
+                stop = count
+            yield start, stop
+            start = known.find('\0',stop) if stop < count else -1
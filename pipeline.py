@@ -0,0 +1,162 @@
+"""
+overlaps reading the files w/ hashing them. a reader thread reads the
+files' data into a fixed ring of buffers while the hashing thread
+works through the buffers already filled, handing each one back once
+it's done w/ it. the read happens outside the GIL, so even on one core
+the drive and the cpu are both kept busy and hashing takes about as
+long as the slower of the two rather than both added up.
+
+memory use is the number of buffers times their size, no matter how
+big the files are.
+"""
+
+import io
+import sys
+from threading import Thread
+from Queue import Queue
+
+from fadvise import advise, SEQUENTIAL, NOREUSE, DONTNEED
+
+# how many buffers the reader can fill ahead of the hashing
+READ_BUFFERS = 4
+
+
+def iter_file_spans(segments_iter, skip=()):
+    """
+    joins up the pieces' (path, offset, length) segments into the
+    (path, start, end) spans of each file they cover, in order.
+    segments of paths which are instances of the skip types (eg pad
+    files) are left out.
+    """
+    span = None
+    for segments in segments_iter:
+        for path, offset, length in segments:
+            if skip and isinstance(path,skip):
+                continue
+            if span and span[0] == path and span[2] == offset:
+                span[2] = offset + length
+                continue
+            if span:
+                yield tuple(span)
+            span = [path, offset, offset + length]
+    if span:
+        yield tuple(span)
+
+
+class ReadAhead(object):
+    """
+    reads the (path, start, end) spans of the files in a thread, into
+    a ring of buffers of read_size bytes. the data is handed back, in
+    order, through iter_read w/ the same (path, offset, length)
+    segments the spans were made from.
+    """
+    def __init__(self,spans,read_size,buffers=READ_BUFFERS):
+        # buffers waiting to be filled, and filled buffers
+        # waiting to be hashed
+        self.free = Queue()
+        self.full = Queue()
+        for i in xrange(max(1,buffers)):
+            self.free.put(bytearray(read_size))
+
+        # the block we're hashing from and how far into it we are
+        self.block = None
+        self.block_pos = 0
+
+        # how much data we read, same as FileReader's
+        self.reads = 0
+        self.bytes_copied = 0L
+
+        self.stopped = False
+        self.thread = Thread(target=self._run,args=(spans,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self,spans):
+        try:
+            for path, start, end in spans:
+                if not self._read_span(path,start,end):
+                    return
+            self.full.put(None)
+        except Exception:
+            # goes back to the hashing thread to be raised there
+            self.full.put(sys.exc_info())
+
+    def _read_span(self,path,start,end):
+        """ fills buffers from the span of the file, returns False if
+            we were stopped part way """
+        with io.open(path,'rb',buffering=0) as fh:
+            fd = fh.fileno()
+            advise(fd,start,end-start,SEQUENTIAL,NOREUSE)
+            fh.seek(start)
+            pos = start
+            while pos < end:
+                buf = self.free.get()
+                if self.stopped:
+                    return False
+                read_len = fh.readinto(
+                    memoryview(buf)[:min(len(buf),end-pos)])
+                if not read_len:
+                    raise IOError('%s ended @ %s, expected %s bytes'
+                                  % (path,pos,end))
+                self.reads += 1
+                self.bytes_copied += read_len
+                self.full.put((path,pos,read_len,buf))
+                pos += read_len
+
+            # we're through w/ it, leave the cache to others
+            advise(fd,start,end-start,DONTNEED)
+        return True
+
+    def _next_block(self):
+        # the buffer we were on can be filled again
+        if self.block is not None:
+            self.free.put(self.block[3])
+            self.block = None
+
+        item = self.full.get()
+        if item is None:
+            raise IOError('read past the end of the spans')
+        if len(item) == 3:
+            raise item[0], item[1], item[2]
+        self.block = item
+        self.block_pos = 0
+
+    def iter_read(self,path,offset,length):
+        """
+        yields buffers of the next length bytes, which must be those
+        of the file from offset. the buffers are over the ring and
+        are only good until the next one is asked for.
+        """
+        while length:
+            if self.block is None or self.block_pos == self.block[2]:
+                self._next_block()
+            block_path, block_offset, block_len, buf = self.block
+            if block_path != path \
+               or block_offset + self.block_pos != offset:
+                raise Exception('out of order read of %s @ %s, at %s @ %s'
+                                % (path,offset,block_path,
+                                   block_offset + self.block_pos))
+            take = min(length,block_len - self.block_pos)
+            data = buffer(buf,self.block_pos,take)
+            self.block_pos += take
+            offset += take
+            length -= take
+            yield data
+
+    def close(self):
+        """ stops the reader, waiting for it to finish """
+        self.stopped = True
+        if self.block is not None:
+            self.free.put(self.block[3])
+            self.block = None
+
+        # the reader only ever waits on a free buffer, give it one
+        # so it gets to see that we've stopped
+        self.free.put(bytearray(0))
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
@@ -0,0 +1,81 @@
+"""
+ways of showing how hashing is going. they're called w/ the hasher's
+piece_hasher.HashStats, so can be handed to MetaCreator (or a hasher)
+as it's progress callback.
+"""
+
+import sys
+import time
+import json
+
+
+class ProgressReporter(object):
+    """ shows the stats at most every interval seconds, and always
+        once hashing has finished. on it's own it writes a line of
+        them each time, the others show them their own way """
+    def __init__(self,stream=None,interval=1.0):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.last_shown = None
+
+    def __call__(self,stats):
+        now = time.time()
+        if not stats.finished and self.last_shown is not None \
+           and now - self.last_shown < self.interval:
+            return
+        self.last_shown = now
+        self.show(stats)
+
+    def show(self,stats):
+        self.stream.write('%3d%% %s of %s pieces %.1f MB/s%s\n'
+                          % (stats.fraction * 100, stats.pieces_done,
+                             stats.piece_count, stats.rate,
+                             ' done' if stats.finished else ''))
+        self.stream.flush()
+
+
+class ProgressBar(ProgressReporter):
+    """ a one line progress bar, redrawn in place """
+    width = 30
+
+    def show(self,stats):
+        filled = int(stats.fraction * self.width)
+        busy = stats.read_time + stats.hash_time
+        read_share = stats.read_time / busy if busy else 0.0
+
+        # going by how we've done of late, not since the start
+        eta = '-'
+        seconds = stats.eta
+        if seconds is not None:
+            seconds = int(seconds)
+            eta = '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                                    seconds % 60)
+
+        self.stream.write('\r[%s%s] %3d%% %7.1f MB/s read %2d%% sha %2d%% '
+                          'eta %s ' % ('#' * filled,
+                                       ' ' * (self.width - filled),
+                                       stats.fraction * 100,
+                                       stats.recent_rate,
+                                       read_share * 100,
+                                       (1 - read_share) * 100 if busy else 0,
+                                       eta))
+        if stats.finished:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+class JsonProgress(ProgressReporter):
+    """ a JSON object per line, for monitoring to pick up. the last
+        line (finished) has the seconds spent on each file """
+    def __init__(self,stream=None,interval=1.0):
+        ProgressReporter.__init__(self,stream or sys.stdout,interval)
+
+    def show(self,stats):
+        line = stats.as_dict()
+        line['time'] = time.time()
+        if stats.finished:
+            line['files'] = dict(((path.decode('utf-8','replace'),
+                                   round(seconds,6)) for path, seconds
+                                  in stats.file_times.iteritems()))
+        self.stream.write(json.dumps(line,sort_keys=True) + '\n')
+        self.stream.flush()
@@ -0,0 +1,148 @@
+"""
+finds the files under the given paths in a single pass, everything we
+need to know about a file comes from the one stat made while walking
+(rather than walking and then stat'ing each file again for it's size).
+on network filesystems w/ lots of small files the stats cost more than
+the hashing does.
+
+uses os.scandir (or the scandir backport) when there is one, otherwise
+falls back to listdir + a stat per entry.
+"""
+
+import os
+import os.path
+import stat
+import logging
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+# what we know of a file, mtime in microseconds
+FileRecord = namedtuple('FileRecord', 'path size mtime dev inode')
+
+
+def make_record(path,st):
+    return FileRecord(path, st.st_size, long(st.st_mtime * 1000000),
+                      st.st_dev, st.st_ino)
+
+
+def stat_record(path):
+    """ the record of a single file """
+    return make_record(path,os.stat(path))
+
+
+def wanted(name,extension=None,exclude=None):
+    return (not extension or name.endswith(extension)) \
+           and (not exclude or exclude not in name)
+
+
+def list_dir(path,followlinks=True,extension=None,exclude=None):
+    """
+    returns the records of the files in the directory and the
+    (path, (dev, inode)) of it's sub directories. names containing
+    exclude are skipped, as are files w/o the extension.
+    """
+    records, dirs = [], []
+
+    if scandir is not None:
+        for entry in scandir(path):
+            if exclude and exclude in entry.name:
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=followlinks):
+                    st = entry.stat(follow_symlinks=followlinks)
+                    dirs.append((entry.path, (st.st_dev, st.st_ino)))
+                elif entry.is_file() and wanted(entry.name,extension):
+                    records.append(make_record(entry.path,entry.stat()))
+            except OSError, ex:
+                log.warning('skipping %s: %s',entry.path,ex)
+        return records, dirs
+
+    for name in os.listdir(path):
+        if exclude and exclude in name:
+            continue
+        entry_path = os.path.join(path,name)
+        try:
+            st = os.stat(entry_path) if followlinks \
+                 else os.lstat(entry_path)
+        except OSError, ex:
+            log.warning('skipping %s: %s',entry_path,ex)
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            dirs.append((entry_path, (st.st_dev, st.st_ino)))
+        elif stat.S_ISREG(st.st_mode) and wanted(name,extension):
+            records.append(make_record(entry_path,st))
+        elif stat.S_ISLNK(st.st_mode) and wanted(name,extension):
+            # not following links, but the files they point at count
+            try:
+                st = os.stat(entry_path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                records.append(make_record(entry_path,st))
+    return records, dirs
+
+
+def sort_key(record):
+    # by path component, so a dir's contents stay together
+    return record.path.split(os.sep)
+
+
+def scan(paths,followlinks=True,extension=None,exclude=None,workers=None):
+    """
+    returns the sorted records of the files found recursively
+    searching from the passed paths (w/ abs paths). a path can also
+    be a file. directories we've already been in, eg by way of a
+    symlink loop, are skipped. given workers, each level of sub
+    directories is listed by that many threads.
+    """
+    records = []
+    seen = set()
+    level = []
+    for path in paths:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        if stat.S_ISDIR(st.st_mode):
+            level.append((path, (st.st_dev, st.st_ino)))
+        elif wanted(os.path.basename(path),extension,exclude):
+            records.append(make_record(path,st))
+
+    pool = ThreadPool(workers) if workers and workers > 1 else None
+    list_func = lambda path: list_dir(path,followlinks,extension,exclude)
+    try:
+        while level:
+            # a dir we've been in before is a loop (or a second link
+            # to the same place), either way once is enough
+            to_list = []
+            for path, identity in level:
+                if identity in seen:
+                    log.warning('skipping %s, already scanned',path)
+                    continue
+                seen.add(identity)
+                to_list.append(path)
+
+            if pool:
+                listings = pool.map(list_func,to_list)
+            else:
+                listings = map(list_func,to_list)
+
+            level = []
+            for found, dirs in listings:
+                records.extend(found)
+                level.extend(dirs)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    records.sort(key=sort_key)
+    return records
@@ -0,0 +1,275 @@
+"""
+creates torrents from data which is streamed in rather than read off
+the drive, eg the files coming out of a tar stream or being downloaded
+from an object store. the files' data is pushed in a chunk at a time,
+one file after the other, and the pieces (and md5s / v2 trees) are
+hashed as it goes by. nothing is written out or read back.
+
+the info at the end is made by the MetaCreator, the same as it would
+make of the same files on disk, so the MetaCreator can go on to make
+the meta data / magnet link from it.
+"""
+
+import time
+
+from sha import sha
+from hashlib import md5
+
+from helpers import plan_piece_size, pad_length, convert_unicode
+from layout import Layout
+from merkle import FileTreeHasher
+from path_trie import PathTrie
+from piece_hasher import HashStats, zeros
+from make_torrent import MetaCreator
+
+
+class StreamFile(object):
+    """
+    a file being streamed in. names is it's path in the torrent and
+    path the same joined up, which stands in for the file's path in
+    the MetaCreator's lookups. size is what it was declared to be,
+    None going by what's written.
+    """
+    def __init__(self,names,size=None):
+        self.names = names
+        self.path = '/'.join(names)
+        self.size = size
+        self.length = 0L
+
+        # the file's md5 / v2 tree, as asked for
+        self.md5 = None
+        self.tree = None
+
+    def __repr__(self):
+        return 'StreamFile(%r, %s)' % (self.path,self.length)
+
+
+class StreamCreator(object):
+    """
+    builds a torrent's info from it's files' data as it's pushed in.
+    files are started w/ begin_file, written to w/ write and ended w/
+    end_file (or all in one go w/ add_file), finish gives the info.
+    the meta_creator's settings (piece size, md5s, padding, version,
+    progress, piece size targets) are used, it's piece size if it has
+    one, otherwise one planned the same as for files on disk. that
+    needs the files' sizes up front, or at least their total_size.
+    names can be lists of the path's names or / separated strings,
+    unicode or in the meta_creator's encoding.
+
+    a hybrid torrent's v1 files have to be in the same order as it's
+    v2 file tree, so their files have to be pushed in that (path)
+    order, ie sorted by their names from the top down.
+    """
+    def __init__(self,name=None,meta_creator=None,total_size=None,
+                      private=False,file_sizes=None):
+        self.meta_creator = meta_creator or MetaCreator(encoding='UTF-8')
+        self.name = name
+        self.private = private
+
+        meta_creator = self.meta_creator
+        self.v1 = meta_creator.version != 'v2'
+        self.v2 = meta_creator.version != 'v1'
+        self.create_md5 = meta_creator.create_md5
+        self.pad_files = meta_creator.pad_files
+
+        # the pieces can't be hashed w/o knowing their size up front
+        if file_sizes and not total_size:
+            total_size = sum(file_sizes)
+        piece_size = meta_creator.piece_size
+        meta_creator.piece_plan = None
+        if not piece_size:
+            if not total_size:
+                raise ValueError('streaming needs a piece size or the '
+                                 'total size')
+            meta_creator.piece_plan = plan_piece_size(
+                file_sizes or [total_size],meta_creator.target_pieces,
+                meta_creator.max_torrent_size,None,self.pad_files,
+                meta_creator.version,self.create_md5)
+            piece_size = meta_creator.piece_plan.piece_size
+        self.piece_size = piece_size
+
+        # hybrids' files have to come in order, see the class doc string
+        self.ordered = meta_creator.version == 'hybrid'
+        self.last_names = None
+
+        # the piece we're part way through, and the digests of the
+        # pieces before it
+        self.piece = sha()
+        self.piece_pos = 0
+        self.pieces = bytearray()
+
+        self.files = []
+        self.current = None
+        self.data_pos = 0L
+
+        # the files' paths, duplicates fail as soon as they're begun
+        self.trie = PathTrie(self.meta_creator.encoding or 'UTF-8')
+
+        self.stats = HashStats()
+        self.stats.total_size = total_size or 0L
+        self.info_data = None
+
+    def begin_file(self,names,size=None):
+        """ starts the next file, ending the last one if need be """
+        if self.info_data is not None:
+            raise Exception('already finished')
+        if self.current is not None:
+            self.end_file()
+
+        if isinstance(names,basestring):
+            names = names.split('/')
+        encoding = self.trie.encoding
+        names = [n.encode(encoding) if isinstance(n,unicode) else n
+                 for n in names]
+        stream_file = StreamFile([n for n in names if n.strip()],size)
+        if not stream_file.names:
+            raise ValueError('file has no name')
+
+        # the file tree is in the order of the UTF-8 names
+        if self.ordered:
+            utf8_names = [convert_unicode(n,encoding).encode('UTF-8')
+                          for n in stream_file.names]
+            if self.last_names is not None \
+               and utf8_names < self.last_names:
+                raise ValueError('hybrid torrents\' files have to be '
+                                 'pushed in order, %s came after %s'
+                                 % (stream_file.path,
+                                    '/'.join(self.last_names)))
+        self.trie.add(stream_file.path,stream_file.names)
+        if self.ordered:
+            self.last_names = utf8_names
+
+        # the last file left off mid piece, pad out the rest of it
+        if self.pad_files and self.files:
+            length = pad_length(self.data_pos,self.piece_size)
+            self.data_pos += length
+            if length and self.v1:
+                self._hash_pieces(zeros(length))
+
+        if self.create_md5:
+            stream_file.md5 = md5()
+        if self.v2:
+            stream_file.tree = FileTreeHasher(self.piece_size)
+        self.files.append(stream_file)
+        self.current = stream_file
+        return stream_file
+
+    def write(self,data):
+        """ hashes the next chunk of the current file's data """
+        stream_file = self.current
+        if stream_file is None:
+            raise Exception('no file begun')
+        length = len(data)
+        if stream_file.size is not None \
+           and stream_file.length + length > stream_file.size:
+            raise ValueError('%s is bigger than the %s bytes declared'
+                             % (stream_file.path,stream_file.size))
+
+        hash_start = time.time()
+        if stream_file.md5 is not None:
+            stream_file.md5.update(data)
+        if stream_file.tree is not None:
+            stream_file.tree.update(data)
+        if self.v1:
+            self._hash_pieces(data)
+        stream_file.length += length
+        self.data_pos += length
+        self.stats.add_segment(stream_file.path,length,0.0,
+                               time.time()-hash_start)
+        self.report()
+
+    def _hash_pieces(self,data):
+        """ runs the data through the pieces, padding included """
+        data_len = len(data)
+        pos = 0
+        while pos < data_len:
+            take = min(self.piece_size - self.piece_pos, data_len - pos)
+            self.piece.update(buffer(data,pos,take))
+            self.piece_pos += take
+            pos += take
+            if self.piece_pos == self.piece_size:
+                self._end_piece()
+
+    def _end_piece(self):
+        self.pieces.extend(self.piece.digest())
+        self.piece = sha()
+        self.piece_pos = 0
+        self.stats.pieces_hashed += 1
+
+    def end_file(self):
+        """ ends the current file, which must be it's declared size """
+        stream_file = self.current
+        if stream_file is None:
+            raise Exception('no file begun')
+        if stream_file.size is not None \
+           and stream_file.length != stream_file.size:
+            raise ValueError('%s ended @ %s, expected %s bytes'
+                             % (stream_file.path,stream_file.length,
+                                stream_file.size))
+        self.current = None
+        return stream_file
+
+    def add_file(self,names,chunks,size=None):
+        """ streams in a whole file from the iterable of chunks """
+        stream_file = self.begin_file(names,size)
+        for chunk in chunks:
+            self.write(chunk)
+        return self.end_file()
+
+    def report(self):
+        """ lets whoever is watching know how we're doing """
+        progress = self.meta_creator.progress
+        if progress:
+            progress(self.stats)
+
+    def finish(self):
+        """ returns the info of the files streamed in, it's also left
+            w/ the MetaCreator for making the meta data """
+        if self.info_data is not None:
+            return self.info_data
+        if self.current is not None:
+            self.end_file()
+        if not self.files:
+            raise Exception('No Files Found!')
+
+        # the last piece can be short
+        if self.piece_pos:
+            self._end_piece()
+
+        file_paths = [f.path for f in self.files]
+        file_sizes = dict(( (f.path, f.length) for f in self.files))
+        md5sums = trees = None
+        if self.create_md5:
+            md5sums = dict(( (f.path, f.md5.digest()) for f in self.files))
+        if self.v2:
+            trees = dict(( (f.path, f.tree.digest()) for f in self.files))
+
+        # a lone file's name is the torrent's unless we were given one
+        name = self.name
+        if not name and len(self.files) == 1:
+            name = self.files[0].names[-1]
+        if not name:
+            raise ValueError('torrents of more than one file need a name')
+        if isinstance(name,unicode):
+            name = name.encode(self.trie.encoding)
+
+        layout = Layout(file_paths,file_sizes,self.piece_size,
+                        self.pad_files)
+        meta_creator = self.meta_creator
+        info_data = meta_creator.create_info_dict(
+            file_paths,self.pieces,file_sizes,self.piece_size,
+            sum(file_sizes.itervalues()),self.private,self.create_md5,
+            name,md5sums=md5sums,trees=trees,layout=layout,
+            trie=self.trie if len(file_paths) > 1 else None)
+
+        meta_creator.piece_layers = meta_creator.create_piece_layers(
+            trees or {})
+        meta_creator.total_size = sum(file_sizes.itervalues())
+        meta_creator.set_info(info_data)
+
+        self.stats.piece_count = layout.piece_count if self.v1 else 0
+        self.stats.finished = True
+        self.report()
+
+        self.info_data = info_data
+        return info_data
@@ -0,0 +1,217 @@
+"""
+the helpers the MetaCreator builds on: validating infos, planning
+piece sizes, infohashes and magnet links
+"""
+
+import os
+import mmap
+import logging
+from hashlib import sha1, sha256
+from urlparse import parse_qs
+
+import pytest
+
+from bencode import bencode, bdecode
+from helpers import validate_info_data, plan_piece_size, \
+                    estimate_torrent_size, bencoded_string_size, \
+                    torrent_info_hashes, torrent_magnet_link, magnet_link, \
+                    TORRENT_OVERHEAD
+from make_torrent import MetaCreator
+
+MB = 1024 * 1024
+
+
+def make_info(extra_files=None,**fields):
+    info = {'name': 'test', 'piece length': 32768, 'pieces': 'x' * 20,
+            'files': [{'length': 1, 'path': ['a']},
+                      {'length': 2, 'path': ['d', 'b']}]}
+    if extra_files:
+        info['files'] = info['files'] + extra_files
+    info.update(fields)
+    return info
+
+
+# a BEP 47 pad file, it's path isn't a real one
+PAD = {'attr': 'p', 'length': 5, 'path': ['.pad', '5']}
+
+
+@pytest.mark.parametrize('files', [
+    [],
+    [PAD],
+    [{'length': 0, 'path': ['d', 'c']}],
+])
+def test_good(files):
+    assert validate_info_data(make_info(files))
+
+
+@pytest.mark.parametrize('files', [
+    [{'length': -1, 'path': ['c']}],                # bad length
+    [{'length': '1', 'path': ['c']}],
+    [{'path': ['c']}],
+    [{'length': 1, 'path': [['c']]}],               # unhashable dir
+    [{'length': 1, 'path': [1]}],                   # not a string
+    [{'length': 1, 'path': []}],
+    [{'length': 1, 'path': 'c'}],
+    [{'length': 1, 'path': ['..', 'c']}],           # insecure dirs
+    [{'length': 1, 'path': ['.c']}],
+    [{'length': 1, 'path': ['d/c']}],
+    [{'length': 1, 'path': ['~c']}],
+    [{'length': 1, 'path': ['a']}],                 # duplicates
+    [{'length': 1, 'path': ['d', 'b']}],
+    [{'attr': 'p', 'length': 5, 'path': '.pad'}],   # bad pad entries
+    [{'attr': 'p', 'length': -5, 'path': []}],
+    [dict(PAD,attr=1)],
+    ['a'],
+])
+def test_bad_files(files):
+    with pytest.raises(ValueError):
+        validate_info_data(make_info(files))
+
+
+@pytest.mark.parametrize('fields', [
+    dict(name='.test'),
+    dict(name=None),
+    dict(pieces='x' * 21),
+    dict(pieces=None),
+    dict(files={}),
+    dict(length=10),
+])
+def test_bad_info(fields):
+    with pytest.raises(ValueError):
+        validate_info_data(make_info(**fields))
+
+
+def test_trusted():
+    # trusted infos don't have their files gone through
+    info = make_info([{'length': 1, 'path': ['a']}])
+    assert validate_info_data(info,trusted=True)
+    with pytest.raises(ValueError):
+        validate_info_data(info)
+
+    # but the rest of the info still is checked
+    for fields in (dict(pieces='x' * 21), dict(name='..'),
+                   dict(files='a')):
+        with pytest.raises(ValueError):
+            validate_info_data(make_info(**fields),trusted=True)
+
+
+def test_plan_targets():
+    sizes = [3 * MB, 10 * MB, 1, 0, 700 * 1024]
+
+    # the smallest piece size making no more than the pieces asked for
+    plan = plan_piece_size(sizes,target_pieces=100)
+    assert plan.piece_count <= 100
+    assert plan.piece_size == 256 * 1024
+    assert estimate_torrent_size(sizes,plan.piece_size // 2)[0] > 100
+
+    # likewise keeping the torrent under the size asked for
+    plan = plan_piece_size(sizes,max_torrent_size=TORRENT_OVERHEAD + 2000,
+                           path_sizes=[10] * len(sizes))
+    assert plan.torrent_size <= TORRENT_OVERHEAD + 2000
+    smaller = estimate_torrent_size(sizes,plan.piece_size // 2,
+                                    [10] * len(sizes))
+    assert smaller[2] > TORRENT_OVERHEAD + 2000
+
+    # a piece size given is the one used
+    plan = plan_piece_size(sizes,100,min_size=MB,max_size=MB)
+    assert (plan.piece_size, plan.piece_count) == (MB, 14)
+
+
+def test_plan_unreachable(caplog):
+    # padded, every file takes at least a piece of it's own, and the
+    # padding grows w/ the piece size
+    sizes = [1000] * 50
+    with caplog.at_level(logging.WARNING):
+        plan = plan_piece_size(sizes,target_pieces=10,pad_files=True,
+                               path_sizes=[10] * len(sizes))
+    assert 'no piece size meets the targets' in caplog.text
+
+    # it's the piece size making the smallest torrent
+    assert plan.piece_count == 50
+    sizes_tried = [16 * 1024 * 2 ** i for i in xrange(13)]
+    assert plan.torrent_size == min((
+        estimate_torrent_size(sizes,size,[10] * len(sizes),True)[2]
+        for size in sizes_tried))
+
+
+def make_tree(tmpdir,names_sizes):
+    data_dir = tmpdir.mkdir('data')
+    for name, size in names_sizes:
+        data_dir.join(*name.split('/')).write(os.urandom(size),'wb',
+                                              ensure=True)
+    return str(data_dir)
+
+
+# files of their own and in dirs, bigger than a piece and empty
+FILES = [('a', 100), ('b/c', 70000), ('b/d/e', 3 * 32768), ('b/f', 0),
+         ('g', 5)]
+
+
+@pytest.mark.parametrize('version', ['v1', 'v2', 'hybrid'])
+@pytest.mark.parametrize('pad_files', [False, True])
+@pytest.mark.parametrize('create_md5', [False, True])
+@pytest.mark.parametrize('files', [FILES, [('x', 70000)]])
+def test_estimate(tmpdir,version,pad_files,create_md5,files):
+    data_dir = make_tree(tmpdir,files)
+    creator = MetaCreator(piece_size=32768,version=version,
+                          pad_files=pad_files,create_md5=create_md5)
+    plan = creator.estimate([data_dir])
+    creator.create_info_data([data_dir])
+    actual = len(bencode(creator.create_meta_data()))
+
+    # to the byte, but for the name and the outer fields
+    name = bencoded_string_size(len(creator.info_data['name']))
+    if len(files) == 1 and version != 'v1':
+        name *= 2
+    assert plan.torrent_size == actual + TORRENT_OVERHEAD - name
+
+
+@pytest.mark.parametrize('version', ['v1', 'v2', 'hybrid'])
+@pytest.mark.parametrize('files', [FILES, [('x', 70000)]])
+def test_info_hashes(tmpdir,version,files):
+    data_dir = make_tree(tmpdir,files)
+    creator = MetaCreator(piece_size=32768,version=version,
+                          pad_files=version == 'v1')
+    creator.create_info_data([data_dir])
+    trackers = ['http://a.example.com/announce', 'udp://b.example.com:80']
+    data = bencode(creator.create_meta_data(
+        announce=trackers[0],**{'announce-list': [trackers[:1],
+                                                  trackers[1:]]}))
+    expected = (creator.info_hash, creator.info_hash_v2)
+    assert expected == (sha1(bencode(bdecode(data)['info'])).hexdigest()
+                        if version != 'v2' else None,
+                        sha256(bencode(bdecode(data)['info'])).hexdigest()
+                        if version != 'v1' else None)
+
+    # straight from the info's span in the data, a string or mapped
+    assert torrent_info_hashes(data) == expected
+    path = str(tmpdir.join('test.torrent'))
+    with open(path,'wb') as fh:
+        fh.write(data)
+    with open(path,'rb') as fh:
+        mm = mmap.mmap(fh.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            assert torrent_info_hashes(mm) == expected
+        finally:
+            mm.close()
+
+    # the links from the torrent and from the creator are the same,
+    # v2 only ones included (their length comes from the file tree)
+    link = torrent_magnet_link(data)
+    assert link == creator.magnet_link(trackers)
+    params = parse_qs(link.split('?',1)[1])
+    assert params['xl'] == [str(sum((size for name, size in files)))]
+    assert params['dn'] == ['data']
+    assert params['tr'] == trackers
+    assert sorted(params['xt']) == sorted(
+        (['urn:btih:%s' % expected[0]] if expected[0] else []) +
+        (['urn:btmh:1220%s' % expected[1]] if expected[1] else []))
+
+
+def test_magnet_link():
+    assert magnet_link('ab' * 20,name='a b/c',trackers=['http://t/a?b'],
+                       length=5) == \
+           'magnet:?xt=urn:btih:%s&dn=a%%20b%%2Fc&xl=5' \
+           '&tr=http%%3A%%2F%%2Ft%%2Fa%%3Fb' % ('ab' * 20)
+    assert magnet_link(None,'cd' * 32) == \
+           'magnet:?xt=urn:btmh:1220%s' % ('cd' * 32)
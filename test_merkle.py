@@ -0,0 +1,167 @@
+"""
+v2 (BEP 52) hashing, checked against the merkle trees worked out the
+long way: every block's leaf, padded w/ zero leaves out to a power of
+two, hashed up a layer at a time
+"""
+
+import os
+import random
+from hashlib import sha256
+
+import pytest
+
+from sha import sha
+from merkle import FileTreeHasher, BlockHasher, merkle_root, BLOCK_SIZE, \
+                   ZERO_HASH
+from make_torrent import MetaCreator
+
+PIECE_SIZE = 4 * BLOCK_SIZE
+
+
+def random_data(size,seed=0):
+    rand = random.Random(seed)
+    return ''.join((chr(rand.getrandbits(8)) for x in xrange(size)))
+
+
+def tree_root(leaves):
+    """ the root of the leaves, which must be a power of two of them """
+    while len(leaves) > 1:
+        leaves = [sha256(leaves[i] + leaves[i+1]).digest()
+                  for i in xrange(0,len(leaves),2)]
+    return leaves[0]
+
+
+def padded(leaves,count):
+    return leaves + [ZERO_HASH] * (count - len(leaves))
+
+
+def expected_tree(data,piece_size=PIECE_SIZE):
+    """ the (pieces root, piece layer) of the data the long way """
+    leaves = [sha256(data[i:i+BLOCK_SIZE]).digest()
+              for i in xrange(0,len(data),BLOCK_SIZE)]
+    count = 1
+    while count < len(leaves):
+        count *= 2
+    root = tree_root(padded(leaves,count))
+    if len(data) <= piece_size:
+        return root, ''
+
+    per_piece = piece_size // BLOCK_SIZE
+    layer = [tree_root(padded(leaves[i:i+per_piece],per_piece))
+             for i in xrange(0,len(leaves),per_piece)]
+    return root, ''.join(layer)
+
+
+def tree_digest(data,piece_size=PIECE_SIZE,chunk_size=10000):
+    hasher = FileTreeHasher(piece_size)
+    for i in xrange(0,len(data),chunk_size):
+        hasher.update(data[i:i+chunk_size])
+    return hasher.digest()
+
+
+def test_smaller_than_a_block():
+    data = random_data(1000)
+    # a single leaf is it's own root
+    assert tree_digest(data) == (sha256(data).digest(), '')
+
+
+def test_empty():
+    assert tree_digest('') == (None, '')
+
+
+def test_whole_blocks():
+    data = random_data(2 * BLOCK_SIZE)
+    root, layer = tree_digest(data)
+    assert root == sha256(sha256(data[:BLOCK_SIZE]).digest()
+                          + sha256(data[BLOCK_SIZE:]).digest()).digest()
+    assert layer == ''
+
+
+def test_unbalanced():
+    # three blocks pair the last one off w/ a zero leaf
+    data = random_data(3 * BLOCK_SIZE - 5)
+    h = [sha256(data[i:i+BLOCK_SIZE]).digest()
+         for i in xrange(0,len(data),BLOCK_SIZE)]
+    root = sha256(sha256(h[0] + h[1]).digest()
+                  + sha256(h[2] + ZERO_HASH).digest()).digest()
+    assert tree_digest(data) == (root, '')
+    assert merkle_root(h,4) == root
+
+
+@pytest.mark.parametrize('size', [
+    PIECE_SIZE,                 # a single whole piece
+    4 * PIECE_SIZE,             # exact multiple of the piece size
+    2 * PIECE_SIZE + 100,       # a partial last piece
+    3 * PIECE_SIZE + BLOCK_SIZE # unbalanced piece layer
+])
+def test_piece_layer(size):
+    data = random_data(size,size)
+    assert tree_digest(data) == expected_tree(data)
+
+
+@pytest.mark.parametrize('cuts', [
+    [],                                 # the lot in one stretch
+    [PIECE_SIZE],                       # on a piece boundary
+    [100, BLOCK_SIZE + 5, 3 * PIECE_SIZE - 1],
+    [BLOCK_SIZE + 1, BLOCK_SIZE + 2],   # a stretch w/in a block
+])
+def test_block_hasher(cuts):
+    # the file cut into stretches, each worked out on it's own and fed
+    # to the one tree in order
+    data = random_data(3 * PIECE_SIZE + 100)
+    tree = FileTreeHasher(PIECE_SIZE)
+    starts = [0] + cuts
+    for start, end in zip(starts,cuts + [len(data)]):
+        blocks = BlockHasher(start,len(data))
+        for i in xrange(start,end,10000):
+            blocks.update(data[i:min(i+10000,end)])
+        for chunk in blocks.chunks():
+            if isinstance(chunk,tuple):
+                tree.update_blocks(*chunk)
+            else:
+                tree.update(chunk)
+    assert tree.digest() == expected_tree(data)
+
+
+def test_hybrid(tmpdir):
+    sizes = [100, 2 * PIECE_SIZE + 100, 3 * PIECE_SIZE, 0, PIECE_SIZE + 1]
+    paths = []
+    for i, size in enumerate(sizes):
+        path = str(tmpdir.join('abcde'[i]))
+        with open(path,'wb') as fh:
+            fh.write(random_data(size,i))
+        paths.append(path)
+
+    meta_creator = MetaCreator(piece_size=PIECE_SIZE,version='hybrid')
+    info = meta_creator.create_info_data([str(tmpdir)])
+    pieces = str(info['pieces'])
+    tree = info['file tree']
+    layers = meta_creator.piece_layers
+
+    # each file (being padded) has it's own v1 pieces, they and the
+    # v2 piece layer are of the same data
+    piece_index = 0
+    for path, size in zip(paths,sizes):
+        data = open(path,'rb').read()
+        node = tree[os.path.basename(path)]['']
+        assert node['length'] == size
+        if not size:
+            assert 'pieces root' not in node
+            continue
+
+        root, layer = expected_tree(data)
+        assert node['pieces root'] == root
+        assert layers.get(root,'') == layer
+
+        file_pieces = (size + PIECE_SIZE - 1) // PIECE_SIZE
+        if layer:
+            assert len(layer) == 32 * file_pieces
+
+        for i in xrange(0,size,PIECE_SIZE):
+            piece = data[i:i+PIECE_SIZE]
+            if path != paths[-1]:
+                piece += '\0' * (PIECE_SIZE - len(piece))
+            assert pieces[piece_index*20:(piece_index+1)*20] == \
+                   sha(piece).digest()
+            piece_index += 1
+    assert piece_index * 20 == len(pieces)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+the PathTrie the files list and file tree are built off of
+"""
+
+import pytest
+
+from path_trie import PathTrie
+
+
+def test_paths_and_tree():
+    trie = PathTrie.from_paths(['/r/d/a', '/r/d/s/b', '/r/c'],'/r/')
+    assert trie.path('/r/d/s/b') == ['d', 's', 'b']
+    assert trie.path('/r/c') == ['c']
+
+    # the names are shared by the files under them
+    assert trie.path('/r/d/a')[0] is trie.path('/r/d/s/b')[0]
+
+    tree = trie.file_tree(lambda path: {'length': len(path)})
+    assert tree == {'d': {'a': {'': {'length': 6}},
+                          's': {'b': {'': {'length': 8}}}},
+                    'c': {'': {'length': 4}}}
+
+
+def test_encoding():
+    trie = PathTrie.from_paths(['/r/d\xe9/a', '/r/b'],'/r/','latin-1')
+    assert trie.path('/r/d\xe9/a') == ['d\xc3\xa9', 'a']
+    with pytest.raises(UnicodeError):
+        PathTrie.from_paths(['/r/d\xe9/a', '/r/b'],'/r/','ascii')
+
+
+@pytest.mark.parametrize('paths', [
+    ['/r/a/ /b', '/r/a/b'],     # blank names are dropped
+    ['/r/x', '/r/x/y'],         # a file under another file
+    ['/r/x/y', '/r/x'],         # a file where a dir is
+])
+def test_duplicates(paths):
+    with pytest.raises(ValueError):
+        PathTrie.from_paths(paths,'/r/')
+
+
+@pytest.mark.parametrize('names', [['..', 'a'], ['d', '.hidden'],
+                                   ['~root'], ['a\\b']])
+def test_insecure(names):
+    trie = PathTrie()
+    with pytest.raises(ValueError):
+        trie.add('/r/x',names)
+    assert not trie.files
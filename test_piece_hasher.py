@@ -0,0 +1,321 @@
+"""
+the hashers, checked against the pieces of the files' data joined up
+end to end and hashed a piece at a time
+"""
+
+import os
+import random
+
+import pytest
+
+from sha import sha
+from hashlib import md5
+import piece_hasher
+from piece_hasher import StraitPieceHasher, ParallelPieceHasher, HashStats
+from checkpoint import Checkpoint
+from cache import PieceCache
+from layout import Layout, PadFile
+from helpers import pad_length
+from scanner import stat_record
+import devices
+from devices import DevicePieceHasher, plan_device_pieces, STITCHED
+
+PIECE_SIZE = 32 * 1024
+
+MB = 1024 * 1024
+
+READ_MODES = ['buffered', 'mmap']
+
+# sizes which start / end the files part way through pieces, and
+# files bigger than a piece
+FILE_SIZES = [0, 1, 1000, PIECE_SIZE, PIECE_SIZE + 1, 3 * PIECE_SIZE - 7,
+              70000, 5]
+
+
+def make_files(root,sizes=FILE_SIZES,seed=0):
+    """ writes files of the sizes (random data) under root, returns
+        their paths in order """
+    rand = random.Random(seed)
+    paths = []
+    for i, size in enumerate(sizes):
+        path = os.path.join(str(root),'f%02d' % i)
+        with open(path,'wb') as fh:
+            fh.write(''.join((chr(rand.getrandbits(8))
+                              for x in xrange(size))))
+        paths.append(path)
+    return paths
+
+
+def expected_pieces(paths,piece_size=PIECE_SIZE):
+    data = ''.join((open(path,'rb').read() for path in paths))
+    return ''.join((sha(data[i:i+piece_size]).digest()
+                    for i in xrange(0,len(data),piece_size)))
+
+
+@pytest.mark.parametrize('read_mode', READ_MODES)
+def test_strait(tmpdir,read_mode):
+    paths = make_files(tmpdir)
+    hasher = StraitPieceHasher(paths,read_mode)
+    assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths)
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4])
+@pytest.mark.parametrize('use_processes', [False, True])
+@pytest.mark.parametrize('read_mode', READ_MODES)
+def test_parallel(tmpdir,workers,use_processes,read_mode):
+    paths = make_files(tmpdir)
+    hasher = ParallelPieceHasher(paths,workers,use_processes,read_mode)
+    assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_parallel_md5(tmpdir,workers,use_processes):
+    paths = make_files(tmpdir)
+    hasher = ParallelPieceHasher(paths,workers,use_processes)
+    assert str(hasher.digest(PIECE_SIZE,True)) == expected_pieces(paths)
+    assert hasher.md5sums == dict(( (p, md5(open(p,'rb').read()).digest())
+                                    for p in paths))
+
+    # w/ threads the md5s come from the pieces' reads, no file is
+    # read twice
+    total_size = sum(FILE_SIZES)
+    if not use_processes:
+        assert hasher.stats.bytes_read == total_size
+
+
+@pytest.mark.parametrize('read_buffers', [0, 2])
+@pytest.mark.parametrize('read_mode', READ_MODES)
+def test_truncated(tmpdir,read_mode,read_buffers):
+    paths = make_files(tmpdir)
+    records = [stat_record(path) for path in paths]
+
+    # a file cut short after it was scanned fails rather than being
+    # hashed short
+    with open(paths[-3],'r+b') as fh:
+        fh.truncate(100)
+    hasher = StraitPieceHasher(paths,read_mode,read_buffers=read_buffers)
+    hasher.set_records(records)
+    with pytest.raises(IOError):
+        hasher.digest(PIECE_SIZE)
+
+
+def test_recent_rate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(piece_hasher.time,'time',lambda: now[0])
+    stats = HashStats()
+    stats.total_size = 100 * MB
+
+    # a slow start, then going 4x as fast: the recent rate / eta only
+    # go by the last RATE_WINDOW seconds
+    for second in xrange(1,31):
+        now[0] += 1
+        stats.bytes_read += MB if second <= 20 else 4 * MB
+        stats.sample()
+    assert stats.rate == pytest.approx(60 / 30.0)
+    assert stats.recent_rate == pytest.approx(4.0)
+    assert stats.eta == pytest.approx(40 / 4.0)
+    line = stats.as_dict()
+    assert (line['recent_mb_per_sec'], line['eta']) == (4.0, 10.0)
+
+    stats.finished = True
+    assert stats.eta is None
+
+
+@pytest.mark.parametrize('use_processes', [False, True])
+@pytest.mark.parametrize('pad_files', [False, True])
+@pytest.mark.parametrize('read_mode', READ_MODES)
+def test_parallel_trees(tmpdir,monkeypatch,use_processes,pad_files,
+                        read_mode):
+    # small batches, so files are split between them (part way through
+    # their blocks w/o padding)
+    monkeypatch.setattr(piece_hasher,'BATCH_SIZE',2 * PIECE_SIZE)
+    paths = make_files(tmpdir)
+    expected = StraitPieceHasher(paths,pad_files=pad_files)
+    expected.digest(PIECE_SIZE,True,v2=True)
+
+    for create_md5 in (True, False):
+        hasher = ParallelPieceHasher(paths,3,use_processes,read_mode,
+                                     pad_files=pad_files)
+        assert hasher.digest(PIECE_SIZE,create_md5,v2=True) == \
+               expected.last_pieces.data
+        assert hasher.trees == expected.trees
+        assert hasher.md5sums == (expected.md5sums if create_md5 else {})
+
+        # the trees come from the batches' leaf hashes and the md5s
+        # from their data w/ threads, nothing's read twice
+        if create_md5 and use_processes:
+            continue
+        assert hasher.stats.bytes_read == sum(FILE_SIZES)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_checkpoint_resume(tmpdir):
+    paths = make_files(tmpdir)
+    checkpoint_path = str(tmpdir.join('progress.checkpoint'))
+
+    # stopped part way, w/ the progress saved after every piece
+    def interrupt(stats):
+        if stats.pieces_hashed == 3:
+            raise Interrupted()
+    hasher = StraitPieceHasher(paths,checkpoint=Checkpoint(checkpoint_path,
+                                                           interval=0),
+                               progress=interrupt,read_buffers=0)
+    with pytest.raises(Interrupted):
+        hasher.digest(PIECE_SIZE)
+    assert os.path.exists(checkpoint_path)
+
+    hasher = StraitPieceHasher(paths,checkpoint=Checkpoint(checkpoint_path,
+                                                           True))
+    assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths)
+    assert hasher.stats.pieces_reused == 3
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_cache(tmpdir):
+    paths = make_files(tmpdir)
+    cache = PieceCache(str(tmpdir.join('cache.db')))
+    expected_md5s = dict(( (p, md5(open(p,'rb').read()).digest())
+                           for p in paths))
+
+    hasher = StraitPieceHasher(paths,cache=cache)
+    hasher.digest(PIECE_SIZE,True)
+
+    # the same files again are all cached, nothing's read
+    hasher = StraitPieceHasher(paths,cache=cache)
+    assert str(hasher.digest(PIECE_SIZE,True)) == expected_pieces(paths)
+    assert hasher.md5sums == expected_md5s
+    assert hasher.stats.pieces_reused == hasher.stats.piece_count
+    assert hasher.stats.bytes_read == 0
+
+    # a changed file isn't taken from the cache
+    with open(paths[-2],'r+b') as fh:
+        fh.write('changed')
+    os.utime(paths[-2],(1,1))
+    hasher = StraitPieceHasher(paths,cache=cache)
+    assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths)
+    assert hasher.stats.pieces_hashed
+    cache.close()
+
+
+def test_cache_changed_while_hashing(tmpdir):
+    paths = make_files(tmpdir)
+    cache = PieceCache(str(tmpdir.join('cache.db')))
+
+    # a file changes after we've hashed it, what we hashed is cached
+    # as the file was before, not as it is now
+    def change(stats):
+        if stats.pieces_hashed == 3:
+            with open(paths[3],'r+b') as fh:
+                fh.write('changed')
+            os.utime(paths[3],(1,1))
+    StraitPieceHasher(paths,cache=cache,progress=change,
+                      read_buffers=0).digest(PIECE_SIZE,True)
+
+    hasher = StraitPieceHasher(paths,cache=cache)
+    assert str(hasher.digest(PIECE_SIZE,True)) == expected_pieces(paths)
+    assert hasher.md5sums[paths[3]] == md5(open(paths[3],'rb')
+                                           .read()).digest()
+    cache.close()
+
+
+def test_incremental(tmpdir):
+    paths = make_files(tmpdir)
+    hasher = StraitPieceHasher(paths[:-2])
+    hasher.digest(PIECE_SIZE)
+
+    # adding files on the end only hashes from the last whole piece
+    hasher.set_paths(paths)
+    assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths)
+    stable_size = sum(FILE_SIZES[:-2])
+    assert hasher.stats.pieces_reused == stable_size // PIECE_SIZE
+
+    # as does taking them off again
+    hasher.remove(paths[-1])
+    assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths[:-1])
+    assert hasher.stats.pieces_reused == sum(FILE_SIZES[:-1]) // PIECE_SIZE
+
+
+def test_pad_layout():
+    sizes = {'a': 10, 'b': PIECE_SIZE, 'c': 0, 'd': 5}
+    layout = Layout(['a', 'b', 'c', 'd'],sizes,PIECE_SIZE,True)
+
+    # every file starts on a piece boundary, the last isn't padded
+    assert layout.paths == ['a', PadFile(PIECE_SIZE - 10), 'b', 'c', 'd']
+    assert layout.file_paths == ['a', 'b', 'c', 'd']
+    assert [layout.offset(p) for p in 'abcd'] == \
+           [0, PIECE_SIZE, 2 * PIECE_SIZE, 2 * PIECE_SIZE]
+    assert layout.total_size == 2 * PIECE_SIZE + 5
+    assert layout.piece_count == 3
+    assert layout.piece_range('b') == (1, 2)
+    assert layout.piece_range('c') == (2, 2)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_pad_files(tmpdir,workers):
+    paths = make_files(tmpdir)
+    hasher = ParallelPieceHasher(paths,workers,pad_files=True)
+
+    # the same as the files w/ zeros after them up to a piece boundary
+    data = []
+    for i, path in enumerate(paths):
+        data.append(open(path,'rb').read())
+        if i < len(paths) - 1:
+            data.append('\0' * pad_length(sum(map(len,data)),PIECE_SIZE))
+    data = ''.join(data)
+    expected = ''.join((sha(data[i:i+PIECE_SIZE]).digest()
+                        for i in xrange(0,len(data),PIECE_SIZE)))
+    assert str(hasher.digest(PIECE_SIZE)) == expected
+    assert str(StraitPieceHasher(paths,pad_files=True)
+               .digest(PIECE_SIZE)) == expected
+
+
+@pytest.mark.parametrize('per_device', [1, 2])
+@pytest.mark.parametrize('pad_files', [False, True])
+def test_devices(tmpdir,per_device,pad_files):
+    paths = make_files(tmpdir)
+
+    # the files take turns being on one of two (made up) devices, so
+    # pieces span them
+    hasher = DevicePieceHasher(paths,per_device,pad_files=pad_files)
+    devices = dict(( (path, i % 2) for i, path in enumerate(paths)))
+    hasher.file_devices = lambda paths: devices
+
+    expected = StraitPieceHasher(paths,pad_files=pad_files)
+    assert hasher.digest(PIECE_SIZE,True) == expected.digest(PIECE_SIZE,True)
+    assert hasher.md5sums == expected.md5sums
+    if not pad_files:
+        assert str(hasher.digest(PIECE_SIZE)) == expected_pieces(paths)
+
+
+@pytest.mark.parametrize('pad_files', [False, True])
+def test_device_trees(tmpdir,monkeypatch,pad_files):
+    # small batches, which the devices' readers finish out of order
+    monkeypatch.setattr(devices,'BATCH_SIZE',2 * PIECE_SIZE)
+    paths = make_files(tmpdir)
+    file_devices = dict(( (path, i % 2) for i, path in enumerate(paths)))
+
+    expected = StraitPieceHasher(paths,pad_files=pad_files)
+    expected.digest(PIECE_SIZE,True,v2=True)
+    for create_md5 in (True, False):
+        hasher = DevicePieceHasher(paths,2,pad_files=pad_files)
+        hasher.file_devices = lambda paths: file_devices
+        assert hasher.digest(PIECE_SIZE,create_md5,v2=True) == \
+               expected.last_pieces.data
+        assert hasher.trees == expected.trees
+        assert hasher.md5sums == (expected.md5sums if create_md5 else {})
+
+    # the trees come from the pieces' reads, nothing's read twice
+    assert hasher.stats.bytes_read == sum(FILE_SIZES)
+
+
+def test_device_plan():
+    sizes = {'a': 10, 'b': PIECE_SIZE, 'c': 3 * PIECE_SIZE}
+    layout = Layout(['a', 'b', 'c'],sizes,PIECE_SIZE)
+    plan = plan_device_pieces(layout,{'a': 1, 'b': 1, 'c': 2})
+
+    # the piece w/ data from both devices is read on it's own
+    assert plan == {1: [(0, 1)], 2: [(2, 5)], STITCHED: [(1, 2)]}
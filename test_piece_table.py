@@ -0,0 +1,49 @@
+"""
+the PieceTable the hashers keep their digests in
+"""
+
+from piece_table import PieceTable
+
+
+def digest(i):
+    return chr(i) * 20
+
+
+def test_set_get():
+    table = PieceTable(5)
+    assert len(table) == 5
+    assert table.missing == 5
+    assert list(table) == [None] * 5
+
+    table[1] = digest(1)
+    table[4] = digest(4)
+    assert table[1] == digest(1)
+    assert table[0] is None
+    assert table.missing == 3
+    assert str(table.data[20:40]) == digest(1)
+    assert table.data[:20] == bytearray(20)
+
+
+def test_runs():
+    table = PieceTable(8)
+    table.set_run(2,digest(2) + digest(3) + digest(4))
+    table[6] = digest(6)
+
+    assert list(table.iter_missing_runs()) == [(0, 2), (5, 6), (7, 8)]
+    assert table.has_run(2,5)
+    assert not table.has_run(1,5)
+    assert table.digests(2,5) == digest(2) + digest(3) + digest(4)
+    assert len(table.digests()) == 8 * 20
+
+    for i in xrange(8):
+        table[i] = digest(i)
+    assert list(table.iter_missing_runs()) == []
+    assert table.missing == 0
+    assert str(table.data) == ''.join(map(digest,xrange(8)))
+
+
+def test_empty():
+    table = PieceTable(0)
+    assert list(table.iter_missing_runs()) == []
+    assert table.missing == 0
+    assert table.data == bytearray()
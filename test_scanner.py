@@ -0,0 +1,88 @@
+"""
+the scanner, finding the files under the paths w/ the one stat each
+"""
+
+import os
+
+import pytest
+
+import scanner
+from scanner import scan, stat_record
+
+# a dir's contents sort before a sibling whose name sorts between the
+# dir's name and it's contents' paths ('a-b' < 'a/x' char by char)
+FILES = ['a/x.bin', 'a/y.txt', 'a-b', 'b/c/z.bin', 'b/skip/w.bin',
+         'b.bin']
+
+
+def make_tree(tmpdir,names=FILES):
+    root = tmpdir.mkdir('root')
+    for name in names:
+        root.join(*name.split('/')).write(name,ensure=True)
+    return str(root)
+
+
+def rel_paths(root,records):
+    return [os.path.relpath(r.path,root).replace(os.sep,'/')
+            for r in records]
+
+
+@pytest.fixture(params=['scandir', 'listdir'])
+def list_mode(request,monkeypatch):
+    """ runs the test w/ scandir and w/ the listdir + stat fallback """
+    if request.param == 'listdir':
+        monkeypatch.setattr(scanner,'scandir',None)
+    elif scanner.scandir is None:
+        pytest.skip('no scandir')
+    return request.param
+
+
+def test_sort_order(tmpdir,list_mode):
+    root = make_tree(tmpdir)
+    records = scan([root])
+    assert rel_paths(root,records) == FILES
+
+    # everything comes from the one stat
+    for record in records:
+        assert record == stat_record(record.path)
+
+
+@pytest.mark.parametrize('workers', [None, 1, 3])
+def test_threaded(tmpdir,list_mode,workers):
+    names = ['d%d/e%d/f%d' % (i % 3, i % 5, i) for i in xrange(40)]
+    root = make_tree(tmpdir,names)
+    records = scan([root],workers=workers)
+    assert records == scan([root])
+    assert sorted(rel_paths(root,records)) == sorted(names)
+
+
+def test_filters(tmpdir,list_mode):
+    root = make_tree(tmpdir)
+    assert rel_paths(root,scan([root],extension='.bin')) == \
+           ['a/x.bin', 'b/c/z.bin', 'b/skip/w.bin', 'b.bin']
+
+    # excluded names aren't gone into either
+    assert rel_paths(root,scan([root],exclude='skip')) == \
+           ['a/x.bin', 'a/y.txt', 'a-b', 'b/c/z.bin', 'b.bin']
+    assert rel_paths(root,scan([root],extension='.bin',exclude='c')) == \
+           ['a/x.bin', 'b/skip/w.bin', 'b.bin']
+
+    # as w/ a file given on it's own
+    path = os.path.join(root,'a','y.txt')
+    assert scan([path],extension='.bin') == []
+    assert scan([path]) == [stat_record(path)]
+
+
+def test_symlink_loop(tmpdir,list_mode):
+    root = make_tree(tmpdir)
+    os.symlink(os.path.join(root,'b'),os.path.join(root,'b','c','up'))
+    os.symlink(root,os.path.join(root,'a','top'))
+
+    # each dir is gone into the once, however many ways there are in
+    records = scan([root])
+    assert sorted(set((r.dev, r.inode) for r in records)) == \
+           sorted((r.dev, r.inode) for r in records)
+    assert len(records) == len(FILES)
+
+    # not following the links they're not gone into at all
+    assert rel_paths(root,scan([root],followlinks=False)) == FILES
@@ -0,0 +1,126 @@
+"""
+the StreamCreator, against the MetaCreator making the same files'
+torrent from the disk
+"""
+
+import os
+import random
+
+import pytest
+
+from bencode import bencode
+from make_torrent import MetaCreator
+from stream import StreamCreator
+
+PIECE_SIZE = 32 * 1024
+
+# names sorted the same as the scanner sorts them, a / b / c being
+# files of their own and dirs
+FILES = [('a', 10), ('b/x', 3 * PIECE_SIZE + 7), ('b/y', 0),
+         ('b/z/q', 70000), ('c', PIECE_SIZE)]
+
+
+def make_files(tmpdir,seed=0):
+    rand = random.Random(seed)
+    data_dir = tmpdir.mkdir('data')
+    files = []
+    for name, size in FILES:
+        data = ''.join((chr(rand.getrandbits(8)) for x in xrange(size)))
+        data_dir.join(*name.split('/')).write(data,'wb',ensure=True)
+        files.append((name, data))
+    return str(data_dir), files
+
+
+def stream_files(creator,files,seed=0):
+    """ pushes the files' data in random chunks, declaring every
+        other file's size """
+    rand = random.Random(seed)
+    for i, (name, data) in enumerate(files):
+        chunks, pos = [], 0
+        while pos < len(data):
+            size = rand.choice([1, 100, 16384, 40000, 300000])
+            chunks.append(data[pos:pos+size])
+            pos += size
+        creator.add_file(name,chunks,len(data) if i % 2 else None)
+    return creator.finish()
+
+
+@pytest.mark.parametrize('version', ['v1', 'v2', 'hybrid'])
+@pytest.mark.parametrize('pad_files', [False, True])
+@pytest.mark.parametrize('create_md5', [False, True])
+def test_same_as_disk(tmpdir,version,pad_files,create_md5):
+    data_dir, files = make_files(tmpdir)
+    settings = dict(piece_size=PIECE_SIZE,version=version,
+                    pad_files=pad_files,create_md5=create_md5)
+
+    disk = MetaCreator(**settings)
+    expected = disk.create_info_data([data_dir])
+    streamed = MetaCreator(**settings)
+    info = stream_files(StreamCreator('data',streamed),files)
+
+    assert bencode(info) == bencode(expected)
+    assert streamed.piece_layers == disk.piece_layers
+    assert (streamed.info_hash, streamed.info_hash_v2) == \
+           (disk.info_hash, disk.info_hash_v2)
+
+
+@pytest.mark.parametrize('version', ['v1', 'hybrid'])
+def test_planned_piece_size(tmpdir,version):
+    data_dir, files = make_files(tmpdir)
+    total_size = sum((len(data) for name, data in files))
+
+    disk = MetaCreator(version=version)
+    disk.create_info_data([data_dir])
+    for sizes in (dict(total_size=total_size),
+                  dict(file_sizes=[len(data) for name, data in files])):
+        streamed = MetaCreator(version=version)
+        stream_files(StreamCreator('data',streamed,**sizes),files)
+        assert streamed.piece_plan.piece_size == disk.piece_plan.piece_size
+        assert streamed.info_hash == disk.info_hash
+
+    with pytest.raises(ValueError):
+        StreamCreator('data',MetaCreator())
+
+
+def test_single_file(tmpdir):
+    data_dir, files = make_files(tmpdir)
+    name, data = files[1]
+    disk = MetaCreator(piece_size=PIECE_SIZE,version='hybrid')
+    expected = disk.create_info_data([os.path.join(data_dir,name)])
+
+    creator = StreamCreator(None,MetaCreator(piece_size=PIECE_SIZE,
+                                             version='hybrid'))
+    creator.begin_file('x')
+    creator.write(data)
+    assert bencode(creator.finish()) == bencode(expected)
+
+
+def test_hybrid_order():
+    creator = StreamCreator('data',MetaCreator(piece_size=PIECE_SIZE,
+                                               version='hybrid'))
+    creator.add_file('b.bin',['x'])
+    with pytest.raises(ValueError):
+        creator.add_file('a.bin',['y'])
+
+    # v1 only torrents don't have a file tree to keep in step w/
+    creator = StreamCreator('data',MetaCreator(piece_size=PIECE_SIZE))
+    creator.add_file('b.bin',['x'])
+    creator.add_file('a.bin',['y'])
+    assert [f['path'] for f in creator.finish()['files']] == \
+           [['b.bin'], ['a.bin']]
+
+
+def test_bad_files():
+    creator = StreamCreator('data',MetaCreator(piece_size=PIECE_SIZE))
+    creator.add_file('a/b',['x'])
+    with pytest.raises(ValueError):
+        creator.add_file('a//b',['y'])
+    with pytest.raises(ValueError):
+        creator.add_file('../b',['y'])
+    with pytest.raises(ValueError):
+        creator.add_file('c',['yy'],size=3)
+
+    creator = StreamCreator('data',MetaCreator(piece_size=PIECE_SIZE))
+    creator.begin_file('d',size=1)
+    with pytest.raises(ValueError):
+        creator.write('zz')
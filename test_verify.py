@@ -0,0 +1,68 @@
+"""
+verify, against torrents made of files we then change
+"""
+
+import os
+
+import pytest
+
+from bencode import bencode, bdecode
+from make_torrent import MetaCreator
+from verify import verify, torrent_layout
+
+PIECE_SIZE = 32 * 1024
+
+
+def make_torrent(tmpdir,sizes=(1000, 3 * PIECE_SIZE + 7, 5)):
+    """ makes the files under tmpdir/data, returns the decoded meta
+        data of their torrent """
+    data_dir = tmpdir.mkdir('data')
+    for i, size in enumerate(sizes):
+        data_dir.join('abcdefgh'[i]).write(os.urandom(size),'wb')
+    meta_creator = MetaCreator(piece_size=PIECE_SIZE)
+    meta_creator.create_info_data([str(data_dir)])
+    return bdecode(bencode(meta_creator.create_meta_data()))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_ok(tmpdir,workers):
+    torrent = make_torrent(tmpdir)
+    result = verify(torrent,str(tmpdir),workers)
+    assert result.ok
+    assert result.checked == result.piece_count
+
+
+def test_corrupt_and_missing(tmpdir):
+    torrent = make_torrent(tmpdir)
+    data_dir = tmpdir.join('data')
+    with open(str(data_dir.join('b')),'r+b') as fh:
+        fh.seek(PIECE_SIZE + 10)
+        fh.write('corrupt')
+    data_dir.join('c').remove()
+
+    result = verify(torrent,str(tmpdir),1)
+    assert not result.ok
+    assert result.corrupt == {str(data_dir.join('b')): [1]}
+    assert str(data_dir.join('c')) in result.missing
+
+
+@pytest.mark.parametrize('path', [
+    ['..', '..', 'etc', 'passwd'],
+    ['.hidden'],
+    ['a', ''],
+    ['a/b'],
+])
+def test_unsafe_paths(tmpdir,path):
+    torrent = make_torrent(tmpdir)
+    torrent['info']['files'][0]['path'] = path
+    with pytest.raises(ValueError):
+        torrent_layout(torrent['info'],str(tmpdir))
+    with pytest.raises(ValueError):
+        verify(torrent,str(tmpdir),1)
+
+
+def test_unsafe_name(tmpdir):
+    torrent = make_torrent(tmpdir)
+    torrent['info']['name'] = '..'
+    with pytest.raises(ValueError):
+        verify(torrent,str(tmpdir),1)
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+"""
+checks the data on disk against an existing torrent, for making sure
+what we are seeding still matches after it's been moved around.
+
+the torrent's files are mapped onto paths under a base directory (the
+directory the torrent's data was saved to) and their pieces are
+rehashed. files which are missing or short can't match so their pieces
+are never read, and once a file is known to be bad the pieces which
+are only in bad files are skipped unless asked to check everything.
+"""
+
+import os
+import os.path
+import logging
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from bencode import bdecode
+from helpers import validate_info_data
+from layout import Layout, PadFile
+from piece_hasher import iter_batches, hash_piece_batch, BATCH_SIZE, \
+                         READ_SIZE
+
+log = logging.getLogger(__name__)
+
+
+def torrent_layout(info_data,base_path):
+    """ lays the info's files out under base_path, pad files (as
+        PadFiles) and all. the info is validated first, so that a
+        torrent's paths can't take us outside of base_path """
+    validate_info_data(info_data)
+
+    name = info_data['name']
+    piece_size = info_data['piece length']
+
+    # single file torrents are just the one file
+    if 'files' not in info_data:
+        path = os.path.join(base_path,name)
+        return Layout([path],{path: info_data['length']},piece_size)
+
+    file_paths, file_sizes = [], {}
+    for f in info_data['files']:
+        if 'p' in f.get('attr',''):
+            path = PadFile(f['length'])
+        else:
+            path = os.path.join(base_path,name,*f['path'])
+        file_paths.append(path)
+        file_sizes[path] = f['length']
+    return Layout(file_paths,file_sizes,piece_size)
+
+
+class VerifyResult(object):
+    """
+    what we found. missing and short are lookups of the files' piece
+    ranges, corrupt is a lookup of the indexes of each file's pieces
+    which didn't match. skipped are the pieces we never hashed.
+    """
+    def __init__(self,piece_count):
+        self.piece_count = piece_count
+        self.missing = {}
+        self.short = {}
+        self.long = {}
+        self.corrupt = {}
+        self.bad_pieces = set()
+        self.skipped = set()
+        self.checked = 0
+
+    @property
+    def ok(self):
+        return not (self.missing or self.short or self.corrupt)
+
+    def bad_files(self):
+        return set(self.missing) | set(self.short) | set(self.corrupt)
+
+
+def verify(torrent,base_path,workers=None,use_processes=False,
+           read_mode='buffered',stop_early=True,read_size=READ_SIZE):
+    """
+    rehashes the data under base_path against the torrent, which is
+    either the path to a .torrent or it's decoded meta data. returns
+    a VerifyResult. workers None hashes w/ one worker per cpu, 1
+    hashes in process.
+    """
+    if isinstance(torrent,basestring):
+        with file(torrent,'rb') as fh:
+            torrent = bdecode(fh.read())
+    info_data = torrent['info']
+    if 'pieces' not in info_data:
+        raise Exception('Only torrents w/ v1 pieces can be verified')
+
+    piece_size = info_data['piece length']
+    pieces = info_data['pieces']
+    layout = torrent_layout(info_data,base_path)
+    result = VerifyResult(layout.piece_count)
+    if len(pieces) != result.piece_count * 20:
+        raise Exception('Torrent has %s pieces, expected %s'
+                        % (len(pieces) // 20,result.piece_count))
+
+    # no need to read anything to know about the files which aren't
+    # there or are too short to match
+    for path in layout.file_paths:
+        if not os.path.isfile(path):
+            result.missing[path] = layout.piece_range(path)
+            continue
+        size = os.path.getsize(path)
+        expected = layout.file_sizes[path]
+        if size < expected:
+            result.short[path] = layout.piece_range(path)
+        elif size > expected:
+            # the torrent's part of it can still match
+            log.warning('%s is longer than expected: %s > %s',
+                        path,size,expected)
+            result.long[path] = size
+    unreadable = set(result.missing) | set(result.short)
+    bad = set(unreadable)
+
+    # walk the pieces same as the hashers, leaving out the ones we
+    # already know can't match or don't need checking
+    def iter_pieces():
+        for index, piece_segments in enumerate(layout.iter_segments()):
+            paths = [path for path, offset, length in piece_segments
+                     if not isinstance(path,PadFile)]
+            if unreadable.intersection(paths):
+                result.skipped.add(index)
+                result.bad_pieces.add(index)
+                continue
+            if stop_early and paths and bad.issuperset(paths):
+                result.skipped.add(index)
+                continue
+            yield index, piece_segments
+
+    def check(batch,digests):
+        piece_paths = dict(batch)
+        for index, digest in digests:
+            result.checked += 1
+            if digest == pieces[index*20:(index+1)*20]:
+                continue
+            result.bad_pieces.add(index)
+            for path, offset, length in piece_paths[index]:
+                if isinstance(path,PadFile):
+                    continue
+                result.corrupt.setdefault(path,[]).append(index)
+                bad.add(path)
+
+    batch_len = max(1, BATCH_SIZE // piece_size)
+    batches = iter_batches(iter_pieces(),batch_len)
+    hash_batch = partial(hash_piece_batch,read_mode=read_mode,
+                         read_size=read_size)
+
+    if workers == 1:
+        for batch in batches:
+            check(batch,hash_batch(batch))
+
+    else:
+        workers = workers or cpu_count()
+        pool_type = Pool if use_processes else ThreadPool
+        pool = pool_type(workers)
+        try:
+            # hand the pool a couple batches per worker at a time, so
+            # what we learn from one wave can cut the next one short
+            while True:
+                wave = list(islice(batches,workers * 2))
+                if not wave:
+                    break
+                for batch, digests in zip(wave,pool.imap(hash_batch,wave)):
+                    check(batch,digests)
+        finally:
+            pool.close()
+            pool.join()
+
+    for path in result.corrupt:
+        result.corrupt[path] = sorted(set(result.corrupt[path]))
+
+    log.info('verified %s of %s pieces, %s bad, %s skipped',
+             result.checked,result.piece_count,len(result.bad_pieces),
+             len(result.skipped))
+    return result
+
+
+def format_pieces(indexes):
+    """ collapses piece indexes into ranges, eg 1-3, 7 """
+    parts = []
+    for index in sorted(indexes):
+        if parts and parts[-1][1] == index - 1:
+            parts[-1][1] = index
+        else:
+            parts.append([index, index])
+    return ', '.join((str(a) if a == b else '%s-%s' % (a, b)
+                      for a, b in parts))
+
+
+if __name__ == '__main__':
+    """
+    we need to take in the following params:
+     torrent - the .torrent to check against
+     base path - the directory the torrent's data was saved to,
+                 defaults to the current directory
+    """
+
+    import sys
+    from cmdline_utils import EnhancedOptionParser
+    usage = "usage: %prog [options] torrent [base path]"
+    parser = EnhancedOptionParser(usage=usage)
+
+    # hashing workers
+    parser.add_option("-w", "--workers",
+                      dest="workers",
+                      type="int",
+                      help="number of workers to hash pieces with")
+
+    # read mode
+    parser.add_option("--mmap",
+                      action="store_const",
+                      const="mmap",
+                      dest="read_mode",
+                      default="buffered",
+                      help="hash from memory mapped files")
+
+    # early stop
+    parser.add_option("--all",
+                      action="store_false",
+                      dest="stop_early",
+                      default=True,
+                      help="check every piece, even of files known to "
+                           "be bad")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no torrent given')
+
+    base_path = args[1] if len(args) > 1 else os.getcwd()
+    result = verify(args[0],base_path,
+                    workers=options.get('workers'),
+                    read_mode=options.get('read_mode'),
+                    stop_early=options.get('stop_early'))
+
+    for path in sorted(result.missing):
+        start, stop = result.missing[path]
+        print 'missing: %s (pieces %s)' % (
+            path, format_pieces(xrange(start,stop)))
+    for path in sorted(result.short):
+        start, stop = result.short[path]
+        print 'short: %s (pieces %s)' % (
+            path, format_pieces(xrange(start,stop)))
+    for path in sorted(result.corrupt):
+        print 'corrupt: %s (pieces %s)' % (
+            path, format_pieces(result.corrupt[path]))
+    print '%s of %s pieces checked, %s bad, %s skipped' % (
+        result.checked, result.piece_count, len(result.bad_pieces),
+        len(result.skipped))
+
+    sys.exit(0 if result.ok else 1)